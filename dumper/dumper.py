@@ -1,14 +1,27 @@
 import traceback
 import threading
+import collections
 import os
 from enum import Enum
 import datetime
 import time
 import logging
 import gzip
+import zlib
+import bz2
+import lzma
 import sys
+import struct
+import asyncio
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import websocket
+try:
+    # Only needed when dumpers run in an asyncio event loop
+    import websockets
+except ImportError:
+    websockets = None
 import json
 import urllib.request
 
@@ -23,6 +36,170 @@ self.send_message emits event for a listener
 '''
 
 
+'''Metrics'''
+
+
+# Histogram of durations in seconds with fixed buckets, observing is a bisect and a few additions
+# Each histogram is observed from one thread only, readers may see it a little behind
+class Histogram:
+    # Upper bounds of buckets, the last bucket has no bound
+    BOUNDS = [bound * scale for scale in (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1) for bound in (1, 2, 5)] + [10]
+    LABELS = ['%g' % bound for bound in BOUNDS] + ['+Inf']
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket the quantile falls in, None if nothing is observed
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else float('inf')
+        return float('inf')
+
+
+# Counters and histograms of one dumper (one connection), named after its listener prefix
+class Metrics:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        # Messages received and their length in characters
+        self.messages = 0
+        self.message_bytes = 0
+        self.listener_errors = 0
+        # Connections made, including the first one, and seconds spent waiting before them
+        self.connects = 0
+        self.disconnects = 0
+        self.backoff_seconds = 0.0
+        # Time a listener takes for an event, and time to compress and write a buffer to a file
+        self.listener_latency = Histogram()
+        self.write_time = Histogram()
+        self.written_bytes = 0
+        # Name vs function returning a current value, e.g. a queue depth of a listener
+        self.gauges = {}
+
+    def values(self):
+        # Flat list of (metric name, labels, value)
+        result = [
+            ('dumper_messages_total', '', self.messages),
+            ('dumper_message_bytes_total', '', self.message_bytes),
+            ('dumper_listener_errors_total', '', self.listener_errors),
+            ('dumper_connects_total', '', self.connects),
+            ('dumper_disconnects_total', '', self.disconnects),
+            ('dumper_backoff_seconds_total', '', self.backoff_seconds),
+            ('dumper_written_bytes_total', '', self.written_bytes),
+        ]
+        for name, histogram in (('dumper_listener_seconds', self.listener_latency),
+                                ('dumper_write_seconds', self.write_time)):
+            total = 0
+            for bound, count in zip(Histogram.LABELS, histogram.counts):
+                total += count
+                result.append((name + '_bucket', ',le="%s"' % bound, total))
+            result.append((name + '_count', '', histogram.count))
+            result.append((name + '_sum', '', histogram.sum))
+        for name, gauge in self.gauges.items():
+            result.append(('dumper_' + name, '', gauge()))
+        return result
+
+
+# Metrics of all dumpers in this process, name vs Metrics
+METRICS = {}
+
+def get_metrics(name):
+    if name not in METRICS:
+        METRICS[name] = Metrics(name)
+    return METRICS[name]
+
+def format_metrics():
+    # Text exposition format Prometheus and similar tools read
+    lines = []
+    for name in sorted(METRICS):
+        for metric, labels, value in METRICS[name].values():
+            lines.append('%s{dumper="%s"%s} %s\n' % (metric, name, labels, value))
+    return ''.join(lines)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = format_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not logged
+        pass
+
+def start_metrics_server(port, host='127.0.0.1'):
+    # Serves format_metrics on any path from a daemon thread, only locally by default
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True)
+    thread.start()
+    return server
+
+
+# Logs one line of rates and latencies for each dumper every interval seconds
+class StatsReporter:
+    def __init__(self, interval, logger=None):
+        self.interval = interval
+        self.logger = logger if logger is not None else logging.getLogger('Stats')
+        # Name vs (time, messages, message bytes) of the last report
+        self._last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='StatsReporter', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def report(self):
+        now = time.time()
+        for name in sorted(METRICS):
+            metrics = METRICS[name]
+            last_time, last_messages, last_bytes = self._last.get(name, (metrics.started, 0, 0))
+            elapsed = max(now - last_time, 1e-9)
+            messages, message_bytes = metrics.messages, metrics.message_bytes
+            self._last[name] = (now, messages, message_bytes)
+            gauges = ''.join(' %s=%s' % (gauge_name, gauge()) for gauge_name, gauge in metrics.gauges.items())
+            self.logger.info('[%s] %.1f msg/s %.1f KB/s listener p50=%s p99=%s write p99=%s connects=%d backoff=%.0fs'
+                             ' errors=%d%s'
+                             % (name, (messages - last_messages) / elapsed, (message_bytes - last_bytes) / elapsed / 1024,
+                                _format_seconds(metrics.listener_latency.quantile(0.5)),
+                                _format_seconds(metrics.listener_latency.quantile(0.99)),
+                                _format_seconds(metrics.write_time.quantile(0.99)),
+                                metrics.connects, metrics.backoff_seconds, metrics.listener_errors, gauges))
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds == float('inf'):
+        return '>%gs' % Histogram.BOUNDS[-1]
+    if seconds < 1e-3:
+        return '%gus' % (seconds * 1e6)
+    if seconds < 1:
+        return '%gms' % (seconds * 1e3)
+    return '%gs' % seconds
+
+
 '''Utilities'''
 
 
@@ -41,6 +218,206 @@ class Listener:
         pass
 
 
+# Writes zlib stream, GzipFile/BZ2File/LZMAFile do the same for their formats
+class ZlibWriter:
+    def __init__(self, file, level=zlib.Z_DEFAULT_COMPRESSION):
+        self._file = file
+        self._compressor = zlib.compressobj(level)
+        self.closed = False
+
+    def write(self, data):
+        self._file.write(self._compressor.compress(data))
+
+    def close(self):
+        if not self.closed:
+            self._file.write(self._compressor.flush())
+            self.closed = True
+
+
+# Writes data as it is
+class PlainWriter:
+    def __init__(self, file):
+        self._file = file
+        self.closed = False
+
+    def write(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self.closed = True
+
+
+# Compression method for dump files, with file extension and function opening a compressing writer over a raw file
+class Compression:
+    def __init__(self, extension, open_writer):
+        self.extension = extension
+        self.open_writer = open_writer
+
+
+# Compression name vs Compression, level None means default level of each method
+COMPRESSIONS = {
+    'gzip': Compression('.gz', lambda file, level: gzip.GzipFile(
+        fileobj=file, mode='wb', compresslevel=9 if level is None else level)),
+    'zlib': Compression('.zz', lambda file, level: ZlibWriter(
+        file, zlib.Z_DEFAULT_COMPRESSION if level is None else level)),
+    'bz2': Compression('.bz2', lambda file, level: bz2.BZ2File(
+        file, 'wb', compresslevel=9 if level is None else level)),
+    'lzma': Compression('.xz', lambda file, level: lzma.LZMAFile(
+        file, 'wb', preset=level)),
+    'none': Compression('', lambda file, level: PlainWriter(file)),
+}
+
+
+# Text file written through a compression method
+class DumpFile:
+    # Text is buffered until this size before being compressed
+    BUFFER_SIZE = 64 * 1024
+    # A new compressed stream (gzip member) is started after this many bytes of text, always at a line boundary,
+    # so that a reader can start decompressing at any stream without reading the file from the beginning
+    STREAM_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, path, compression='gzip', level=None, metrics=None):
+        self._raw = open(path, 'ab')
+        # Metrics observing compression and write time, None if not measured
+        self._metrics = metrics
+        self._compression = COMPRESSIONS[compression]
+        self._level = level
+        self._stream = self._compression.open_writer(self._raw, level)
+        self._stream_size = 0
+        self._buffer = []
+        self._buffer_size = 0
+
+    @property
+    def closed(self):
+        return self._raw.closed
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+        if self._buffer_size >= self.BUFFER_SIZE:
+            self.flush()
+
+    def writelines(self, lines):
+        self.write(''.join(lines))
+
+    def flush(self):
+        # Buffer only has whole lines, so a stream ends at a line boundary
+        if len(self._buffer) > 0:
+            start = time.perf_counter()
+            data = ''.join(self._buffer).encode('utf-8')
+            self._stream.write(data)
+            self._buffer = []
+            self._buffer_size = 0
+            self._stream_size += len(data)
+            if self._stream_size >= self.STREAM_SIZE:
+                self._stream.close()
+                self._stream = self._compression.open_writer(self._raw, self._level)
+                self._stream_size = 0
+            if self._metrics is not None:
+                self._metrics.write_time.observe(time.perf_counter() - start)
+                self._metrics.written_bytes += len(data)
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self._stream.close()
+            self._raw.close()
+
+
+# Framing of dump files of FILE_WRITE_LISTENER_VERSION 1, a file header followed by independently compressed blocks
+# A block has a header and records, and a record is a header and a payload (text of a message in UTF-8)
+# All integers are little endian, times are microseconds from epoch
+BLOCK_FILE_MAGIC = b'DMPBLK'
+# Magic, version
+BLOCK_FILE_HEADER = struct.Struct('<6sH')
+BLOCK_MAGIC = b'DMPB'
+# Magic, compression method, stored (compressed) size, raw size, number of records, first and last record times
+BLOCK_HEADER = struct.Struct('<4sBIIIqq')
+# Payload size, record type, time
+RECORD_HEADER = struct.Struct('<IBq')
+RECORD_TYPES = {
+    EventType.OPEN: 0,
+    EventType.MSG: 1,
+    EventType.EMIT: 2,
+    EventType.ERR: 3,
+    EventType.EOF: 4,
+}
+# Compression name vs (method number in a block header, function compressing a block with a level)
+BLOCK_COMPRESSIONS = {
+    'none': (0, lambda data, level: data),
+    'zlib': (1, lambda data, level: zlib.compress(data, zlib.Z_DEFAULT_COMPRESSION if level is None else level)),
+    'bz2': (2, lambda data, level: bz2.compress(data, 9 if level is None else level)),
+    'lzma': (3, lambda data, level: lzma.compress(data, preset=level)),
+}
+# Blocks are deflate as gzip is, without gzip headers
+BLOCK_COMPRESSIONS['gzip'] = BLOCK_COMPRESSIONS['zlib']
+BLOCK_EXTENSION = '.json.blocks'
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_timestamp(dt):
+    # Microseconds from epoch of a naive UTC datetime, exact unlike datetime.timestamp
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+# Binary dump file written in blocks, each record is (record type, time, message text)
+class BlockDumpFile:
+    # Records are buffered until this size of raw data, and compressed into one block
+    BLOCK_SIZE = 256 * 1024
+
+    def __init__(self, path, compression='zlib', level=None, metrics=None, version=1):
+        self._raw = open(path, 'ab')
+        if self._raw.tell() == 0:
+            self._raw.write(BLOCK_FILE_HEADER.pack(BLOCK_FILE_MAGIC, version))
+        self._method, self._compress = BLOCK_COMPRESSIONS[compression]
+        self._level = level
+        self._metrics = metrics
+        self._buffer = bytearray()
+        self._records = 0
+        self._first_time = 0
+        self._last_time = 0
+
+    @property
+    def closed(self):
+        return self._raw.closed
+
+    def write(self, record):
+        record_type, timestamp, message = record
+        payload = message.encode('utf-8')
+        if self._records == 0:
+            self._first_time = timestamp
+        self._last_time = timestamp
+        self._records += 1
+        self._buffer += RECORD_HEADER.pack(len(payload), record_type, timestamp)
+        self._buffer += payload
+        if len(self._buffer) >= self.BLOCK_SIZE:
+            self.flush()
+
+    def writelines(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        # A block has whole records, so it can be decoded without any other block
+        if self._records > 0:
+            start = time.perf_counter()
+            data = self._compress(bytes(self._buffer), self._level)
+            self._raw.write(BLOCK_HEADER.pack(BLOCK_MAGIC, self._method, len(data), len(self._buffer), self._records,
+                                              self._first_time, self._last_time))
+            self._raw.write(data)
+            if self._metrics is not None:
+                self._metrics.write_time.observe(time.perf_counter() - start)
+                self._metrics.written_bytes += len(self._buffer)
+            self._buffer = bytearray()
+            self._records = 0
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self._raw.close()
+
+
 # Listener which saves messages to file
 class FileWriteListener(Listener):
     # File format version of this listener, if file format changes, increment this value
@@ -49,9 +426,16 @@ class FileWriteListener(Listener):
     # Datetime format
     DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
-    def __init__(self, directory, prefix):
+    def __init__(self, directory, prefix, compression='gzip', level=None):
         self.directory = directory
         self.prefix = prefix
+        # Compression method and its level for files
+        if compression not in COMPRESSIONS:
+            raise ValueError('Unknown compression %s' % compression)
+        self.compression = compression
+        self.level = level
+        # Metrics of a dumper writing through this listener, set by the dumper
+        self.metrics = None
         # Initialize file attribute as None
         self.file = None
         self.last_time_opened = None
@@ -73,7 +457,7 @@ class FileWriteListener(Listener):
         # Concatenate directory, prefix, datetime, and proper extention into final file path
         now = datetime.datetime.utcnow()
         formatted_datetime = now.strftime('%Y_%m_%d_%H_%M_%S')
-        file_path = self.directory + self.prefix + '.' + formatted_datetime + '.json.lines.gz'
+        file_path = self.directory + self.prefix + '.' + formatted_datetime + self.file_extension()
 
         # Making directories if not exist
         if not os.path.exists(self.directory):
@@ -82,45 +466,67 @@ class FileWriteListener(Listener):
         self.logger.info('Opening file %s' % file_path)
 
         # Opening file
-        self.file = gzip.open(file_path, 'at')
+        self.file = self.open_file(file_path)
 
         # Record open time
         self.last_time_opened = now
 
+    def file_extension(self):
+        return '.json.lines' + COMPRESSIONS[self.compression].extension
+
+    def open_file(self, file_path):
+        return DumpFile(file_path, self.compression, self.level, self.metrics)
+
     def on_event(self, call_type, message):
-        datetimenow = datetime.datetime.utcnow()
+        self.write_event(call_type, message, datetime.datetime.utcnow())
+
+    def format_datetime(self, dt):
+        # Same as strftime(DATETIME_FORMAT), but faster
+        return dt.isoformat(' ', 'microseconds')
+
+    def prepare_file(self, datetimenow, message):
+        # Before writing to file instance, check if it's opened, if not, open new file
+        # Calculate time difference between now and last file open,
+        # subtraction of datetime will produce datetime.timedelta
+        # by dividing it with timedelta having attribute 1 hours produces time difference in hours
+        if (datetimenow - self.last_time_opened) / datetime.timedelta(hours=1)\
+                >= self.NEW_FILE_INTERVAL:
+            # This will reopen a new file in another name
+            self.open_new_file()
+        elif self.file.closed:
+            # Reopen file (in another name)
+            self.logger.error('File already closed or not yet opened!')
+            self.logger.info(message)
+            return False
+        return True
+
+    def format_line(self, call_type, datetimenow, message):
+        if call_type == EventType.MSG:
+            return 'msg,%s,%s\n' % (self.format_datetime(datetimenow), message)
+        elif call_type == EventType.EMIT:
+            return 'emit,%s,%s\n' % (self.format_datetime(datetimenow), message)
+        else:
+            return 'error,%s,%s\n' % (self.format_datetime(datetimenow), message)
 
-        if call_type == EventType.MSG or call_type == EventType.EMIT or call_type == EventType.ERR:
-            # Received meaningful message, record it
+    def format_head(self, datetimenow, message):
+        return 'head,%d,%s,%s\n' % (self.FILE_WRITE_LISTENER_VERSION, self.format_datetime(datetimenow), message)
 
-            # Before writing to file instance, check if it's opened, if not, open new file
-            # Calculate time difference between now and last file open,
-            # subtraction of datetime will produce datetime.timedelta
-            # by dividing it with timedelta having attribute 1 hours produces time difference in hours
-            if (datetimenow - self.last_time_opened) / datetime.timedelta(hours=1)\
-                    >= self.NEW_FILE_INTERVAL:
-                # This will reopen a new file in another name
-                self.open_new_file()
-            elif self.file.closed:
-                # Reopen file (in another name)
-                self.logger.error('File already closed or not yet opened!')
-                self.logger.info(message)
-                return
+    def format_eos(self, datetimenow, message):
+        return 'eos,%s,%s\n' % (datetimenow, message)
 
-            if call_type == EventType.MSG:
-                self.file.write('msg,%s,%s\n' % (datetimenow.strftime(self.DATETIME_FORMAT), message))
-            elif call_type == EventType.EMIT:
-                self.file.write('emit,%s,%s\n' % (datetimenow.strftime(self.DATETIME_FORMAT), message))
-            elif call_type == EventType.ERR:
-                self.file.write('error,%s,%s\n' % (datetimenow.strftime(self.DATETIME_FORMAT), message))
+    def write_event(self, call_type, message, datetimenow):
+        if call_type == EventType.MSG or call_type == EventType.EMIT or call_type == EventType.ERR:
+            # Received meaningful message, record it
+            if self.prepare_file(datetimenow, message):
+                self.file.write(self.format_line(call_type, datetimenow, message))
         elif call_type == EventType.OPEN:
             # Beginning of a new file
             self.open_new_file()
-            self.file.write('head,%d,%s,%s\n' % (self.FILE_WRITE_LISTENER_VERSION, datetimenow.strftime(self.DATETIME_FORMAT), message))
+            self.file.write(self.format_head(datetimenow, message))
         elif call_type == EventType.EOF:
             # Stream from caller is ended, we can no longer expect any more messages, closing file
             if not self.file.closed:
-                self.file.write('eos,%s,%s\n' % (datetimenow, message))
+                self.file.write(self.format_eos(datetimenow, message))
             self.close_if_not()
         else:
             raise RuntimeError('got unknown type ' + call_type)
@@ -130,11 +536,177 @@ class FileWriteListener(Listener):
         self.close_if_not()
 
 
+# What AsyncFileWriteListener does when its queue is full
+class OverflowPolicy(Enum):
+    # Caller waits until the writer makes room
+    BLOCK = 0
+    # Incoming message is dropped
+    DROP_NEWEST = 1
+    # The oldest message waiting in the queue is dropped
+    DROP_OLDEST = 2
+
+
+# FileWriteListener which does not write in the caller's thread
+# Events are queued with the time they arrived, and a writer thread compresses and writes them in batches
+# OPEN and EOF events are never dropped, since a file can not be read without them
+class AsyncFileWriteListener(FileWriteListener):
+    DEFAULT_QUEUE_SIZE = 100000
+    # Maximum number of events written at once
+    BATCH_SIZE = 1000
+
+    def __init__(self, directory, prefix, compression='gzip', level=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, overflow_policy=OverflowPolicy.BLOCK):
+        super().__init__(directory, prefix, compression, level)
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        # Queue of (call_type, time, message), None stops the writer
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        # Counters
+        self.queued_count = 0
+        self.written_count = 0
+        self.dropped_count = 0
+        self.max_queue_depth = 0
+        self._writer = threading.Thread(target=self._run_writer, name='FileWriter/%s' % prefix, daemon=True)
+        self._writer.start()
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def on_event(self, call_type, message):
+        item = (call_type, datetime.datetime.utcnow(), message)
+        droppable = call_type != EventType.OPEN and call_type != EventType.EOF
+
+        with self._condition:
+            if len(self._queue) >= self.queue_size:
+                if self.overflow_policy == OverflowPolicy.BLOCK:
+                    while len(self._queue) >= self.queue_size:
+                        self._condition.wait()
+                elif not droppable:
+                    # Queued beyond the size rather than waiting, a caller of a dropping policy never waits
+                    self._drop_oldest()
+                elif self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+                    self.dropped_count += 1
+                    return
+                elif not self._drop_oldest():
+                    # Nothing could be dropped
+                    self.dropped_count += 1
+                    return
+
+            self._queue.append(item)
+            self.queued_count += 1
+            if len(self._queue) > self.max_queue_depth:
+                self.max_queue_depth = len(self._queue)
+            self._condition.notify_all()
+
+    def _drop_oldest(self):
+        for i, queued in enumerate(self._queue):
+            if queued is not None and queued[0] != EventType.OPEN and queued[0] != EventType.EOF:
+                del self._queue[i]
+                self.dropped_count += 1
+                return True
+        return False
+
+    def close(self):
+        # Write everything queued and stop the writer
+        with self._condition:
+            self._queue.append(None)
+            self._condition.notify_all()
+        self._writer.join()
+
+    def _run_writer(self):
+        while True:
+            with self._condition:
+                while len(self._queue) == 0:
+                    self._condition.wait()
+                batch = []
+                while len(self._queue) > 0 and len(batch) < self.BATCH_SIZE:
+                    batch.append(self._queue.popleft())
+                # Producers might be waiting for room
+                self._condition.notify_all()
+
+            if self._write_batch(batch):
+                return
+
+    def _write_batch(self, batch):
+        # Returns True when the writer is stopped, an event which fails to be written is counted as dropped and the
+        # rest of a batch is still written
+        lines = []
+        for item in batch:
+            if item is None:
+                self._write_lines(lines)
+                try:
+                    self.close_if_not()
+                except:
+                    self.logger.error('encountered an error in closing a file')
+                    traceback.print_exc()
+                return True
+
+            call_type, datetimenow, message = item
+            try:
+                if call_type == EventType.MSG or call_type == EventType.EMIT or call_type == EventType.ERR:
+                    if self.file is not None and not self.file.closed and \
+                            (datetimenow - self.last_time_opened) / datetime.timedelta(hours=1) < self.NEW_FILE_INTERVAL:
+                        lines.append(self.format_line(call_type, datetimenow, message))
+                        continue
+                # File is going to be renewed (or it is closed), write what is for the current file first
+                self._write_lines(lines)
+                self.write_event(call_type, message, datetimenow)
+                self.written_count += 1
+            except:
+                self.logger.error('encountered an error in writing an event')
+                traceback.print_exc()
+                self.dropped_count += 1
+        self._write_lines(lines)
+        return False
+
+    def _write_lines(self, lines):
+        # Lines are written at once, and all of them are counted as dropped if it fails
+        if len(lines) > 0:
+            try:
+                self.file.writelines(lines)
+                self.written_count += len(lines)
+            except:
+                self.logger.error('encountered an error in writing events')
+                traceback.print_exc()
+                self.dropped_count += len(lines)
+            lines.clear()
+
+
+# FileWriteListener writing the binary block format instead of text lines, records are (type, time, message)
+# The framing is parsed with struct instead of splitting lines and parsing times, and blocks can be decoded in parallel
+class BlockFileWriteListener(FileWriteListener):
+    FILE_WRITE_LISTENER_VERSION = 1
+
+    def file_extension(self):
+        return BLOCK_EXTENSION
+
+    def open_file(self, file_path):
+        if self.compression not in BLOCK_COMPRESSIONS:
+            raise ValueError('Compression %s can not be used for blocks' % self.compression)
+        return BlockDumpFile(file_path, self.compression, self.level, self.metrics, self.FILE_WRITE_LISTENER_VERSION)
+
+    def format_line(self, call_type, datetimenow, message):
+        return RECORD_TYPES.get(call_type, RECORD_TYPES[EventType.ERR]), to_timestamp(datetimenow), message
+
+    def format_head(self, datetimenow, message):
+        return RECORD_TYPES[EventType.OPEN], to_timestamp(datetimenow), message
+
+    def format_eos(self, datetimenow, message):
+        return RECORD_TYPES[EventType.EOF], to_timestamp(datetimenow), str(message)
+
+
+class AsyncBlockFileWriteListener(BlockFileWriteListener, AsyncFileWriteListener):
+    pass
+
+
 # Dumper receives stream from somewhere else (usually from internet), and send it to listener
 class Dumper:
     def __init__(self):
         self._listener = None
         self.logger = self.create_logger()
+        self.metrics = None
 
     def create_logger(self):
         return None
@@ -146,13 +718,31 @@ class Dumper:
     @listener.setter
     def listener(self, listener):
         self._listener = listener
+        # Metrics are named after a prefix of files, which is unique to a connection
+        self.metrics = get_metrics(getattr(listener, 'prefix', self.__class__.__name__))
+        if isinstance(listener, FileWriteListener):
+            listener.metrics = self.metrics
+        if isinstance(listener, AsyncFileWriteListener):
+            self.metrics.gauges['queue_depth'] = lambda: listener.queue_depth
+            self.metrics.gauges['dropped_total'] = lambda: listener.dropped_count
 
     def call_listener(self, call_type, message):
+        metrics = self.metrics
+        start = time.perf_counter()
         try:
             self._listener.on_event(call_type, message)
         except:
             self.logger.error('encountered an error in listener handling')
             traceback.print_exc()
+            if metrics is not None:
+                metrics.listener_errors += 1
+        if metrics is not None:
+            metrics.listener_latency.observe(time.perf_counter() - start)
+            if call_type == EventType.MSG:
+                metrics.messages += 1
+                # Bytes in UTF-8 as files have them, isascii does not scan a str so ASCII messages are not encoded
+                metrics.message_bytes += len(message) if isinstance(message, bytes) or message.isascii() \
+                    else len(message.encode('utf-8'))
 
     def do_dump(self):
         pass
@@ -175,6 +765,8 @@ class WebSocketDumper(Dumper):
         self.reconnection_time = self.DEFAULT_RECONNECTION_TIME
         # Number of disconnection in short period of time
         self.disconnection_count = 0
+        # Seconds to wait before connecting for the first time, for not connecting many at once
+        self.initial_wait = 0
 
     def subscribe(self, ws):
         pass
@@ -186,7 +778,48 @@ class WebSocketDumper(Dumper):
         ws.send(message)
         self.call_listener(EventType.EMIT, message)
 
+    def prepare(self):
+        # Called once before connecting for the first time, e.g. for retrieving markets
+        pass
+
+    def reconnection_wait(self):
+        # Returns seconds to wait before (re)connecting, and update reconnection state
+        if self.last_disconnect is None and self.initial_wait > 0:
+            wait, self.initial_wait = self.initial_wait, 0
+            return wait
+
+        # If last disconnect timestamp was set, and that timestamp was within 5 seconds from now,
+        # it recognize as short period connection trial and wait certain seconds
+        # for not repeatedly connecting to the target server
+        wait = 0
+        if (self.last_disconnect is not None) and\
+                ((datetime.datetime.utcnow() - self.last_disconnect) / datetime.timedelta(seconds=1) <= 5):
+            if self.disconnection_count != 0:
+                # Must wait more than before
+                # Set reconnection time as twice the time as before
+                self.reconnection_time *= 2
+                # Maximum reconnection time is MAX_RECONNECTION_TIME
+                if self.reconnection_time > self.MAX_RECONNECTION_TIME:
+                    self.reconnection_time = self.MAX_RECONNECTION_TIME
+
+                wait = self.reconnection_time
+
+            # Increase disconnection count
+            self.disconnection_count += 1
+        else:
+            # Reset disconnection information
+            self.disconnection_count = 0
+            self.reconnection_time = self.DEFAULT_RECONNECTION_TIME
+        return wait
+
+    def count_connect(self, wait):
+        if self.metrics is not None:
+            self.metrics.connects += 1
+            self.metrics.backoff_seconds += wait
+
     def do_dump(self):
+        self.prepare()
+
         # Get URL for target WebSocket stream
         url = self.get_url()
 
@@ -205,6 +838,8 @@ class WebSocketDumper(Dumper):
 
         def on_close(ws):
             self.logger.warn('WebSocket closed for [%s]' % url)
+            if self.metrics is not None:
+                self.metrics.disconnects += 1
             self.call_listener(EventType.EOF, None)
 
         def on_message(ws, message):
@@ -224,31 +859,14 @@ class WebSocketDumper(Dumper):
 
         try:
             while True:
-                # If last disconnect timestamp was set, and that timestamp was within 5 seconds from now,
-                # it recognize as short period connection trial and wait certain seconds
-                # for not repeatedly connecting to the target server
-                if (self.last_disconnect is not None) and\
-                        ((self.last_disconnect - datetime.datetime.utcnow()) / datetime.timedelta(seconds=1) <= 5):
-                    if self.disconnection_count != 0:
-                        # Must wait more than before
-                        # Set reconnection time as twice the time as before
-                        self.reconnection_time *= 2
-                        # Maximum reconnection time is MAX_RECONNECTION_TIME
-                        if self.reconnection_time > self.MAX_RECONNECTION_TIME:
-                            self.reconnection_time = self.MAX_RECONNECTION_TIME
-
-                        # Wait
-                        self.logger.warn('Waiting %d seconds for [%s]...' % (self.reconnection_time, url))
-                        time.sleep(self.reconnection_time)
-
-                    # Increase disconnection count
-                    self.disconnection_count += 1
-                else:
-                    # Reset disconnection information
-                    self.disconnection_count = 0
-                    self.reconnection_time = self.DEFAULT_RECONNECTION_TIME
+                wait = self.reconnection_wait()
+                if wait > 0:
+                    # Wait
+                    self.logger.warn('Waiting %d seconds for [%s]...' % (wait, url))
+                    time.sleep(wait)
 
                 self.logger.info('Connecting to [%s]...' % url)
+                self.count_connect(wait)
 
                 # Open connection to target WebSocket server
                 self.ws_app = websocket.WebSocketApp(url,
@@ -265,6 +883,92 @@ class WebSocketDumper(Dumper):
             return
 
 
+# Collects messages a dumper sends in subscribe, so that they can be sent asynchronously afterwards
+class MessageCollector:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+
+# Runs a WebSocketDumper in an asyncio event loop instead of a thread blocking in WebSocketApp.run_forever
+# It uses the same hooks of the dumper (prepare, get_url, subscribe) and calls its listener in the same way,
+# so many dumpers can share one event loop
+class AsyncWebSocketDumper:
+    def __init__(self, dumper):
+        self.dumper = dumper
+        self.logger = dumper.logger
+
+    async def _connect(self, url):
+        dumper = self.dumper
+
+        async with websockets.connect(url, max_size=None) as ws:
+            self.logger.info('WebSocket opened for [%s]' % url)
+            dumper.call_listener(EventType.OPEN, 'websocket,%d,%s' % (dumper.WEB_SOCKET_DUMPER_VERSION, url))
+
+            try:
+                try:
+                    # Do subscribing process, send_message emits events as it does with ws_app
+                    collector = MessageCollector()
+                    dumper.subscribe(collector)
+                    for message in collector.messages:
+                        await ws.send(message)
+                except (asyncio.CancelledError, websockets.ConnectionClosed):
+                    raise
+                except:
+                    self.logger.error('Encountered an error when sending subscribing message')
+                    traceback.print_exc()
+
+                async for message in ws:
+                    dumper.call_listener(EventType.MSG, message)
+            except websockets.ConnectionClosed as e:
+                if e.rcvd is None or e.rcvd.code != 1000:
+                    self.logger.error('Got WebSocket error [%s]:' % url)
+                    self.logger.error(e)
+                    dumper.call_listener(EventType.ERR, str(e))
+            finally:
+                self.logger.warn('WebSocket closed for [%s]' % url)
+                if dumper.metrics is not None:
+                    dumper.metrics.disconnects += 1
+                dumper.call_listener(EventType.EOF, None)
+
+    async def do_dump(self):
+        dumper = self.dumper
+
+        # Preparation might do blocking I/O
+        await asyncio.get_running_loop().run_in_executor(None, dumper.prepare)
+
+        url = dumper.get_url()
+
+        while True:
+            wait = dumper.reconnection_wait()
+            if wait > 0:
+                self.logger.warn('Waiting %d seconds for [%s]...' % (wait, url))
+                await asyncio.sleep(wait)
+
+            self.logger.info('Connecting to [%s]...' % url)
+            dumper.count_connect(wait)
+
+            try:
+                await self._connect(url)
+            except asyncio.CancelledError:
+                self.logger.warn('Got kill command, exiting main loop for [%s]...' % url)
+                raise
+            except Exception as e:
+                # Failed to connect, or connection is lost in another way
+                self.logger.error('Got WebSocket error [%s]:' % url)
+                self.logger.error(e)
+
+            # Take disconnection timestamp
+            dumper.last_disconnect = datetime.datetime.utcnow()
+
+
+async def run_dumpers(dumpers):
+    # Run WebSocketDumpers in the current event loop until all of them end
+    await asyncio.gather(*[AsyncWebSocketDumper(dumper).do_dump() for dumper in dumpers])
+
+
 '''Dumper for various exchanges'''
 
 
@@ -308,7 +1012,7 @@ class BitflyerDumper(WebSocketDumper):
                 curr_id += 1
                 self.send_message(ws, json.dumps(subscribe_obj))
 
-    def do_dump(self):
+    def prepare(self):
         # Get markets
         request = urllib.request.Request('https://api.bitflyer.com/v1/markets')
         with urllib.request.urlopen(request) as response:
@@ -318,8 +1022,6 @@ class BitflyerDumper(WebSocketDumper):
             # Convert it to an array of 'product_code'
             self.product_codes = [obj['product_code'] for obj in markets]
 
-        super().do_dump()
-
 
 class BitmexDumper(WebSocketDumper):
     def get_url(self):
@@ -333,10 +1035,13 @@ class BitmexDumper(WebSocketDumper):
 class BitfinexDumper(WebSocketDumper):
     # Amount of channels Bitfinex allows to open at maximum
     BITFINEX_CHANNEL_LIMIT = 30
+    # Each symbol takes two channels, trades and book
+    SYMBOLS_PER_CONNECTION = BITFINEX_CHANNEL_LIMIT // 2
 
-    def __init__(self):
+    def __init__(self, sub_symbols=None):
         super().__init__()
-        self.sub_symbols = None
+        # Symbols to subscribe to, retrieved when preparing if not given
+        self.sub_symbols = sub_symbols
 
     def get_url(self):
         return 'wss://api.bitfinex.com/ws/2'
@@ -344,12 +1049,13 @@ class BitfinexDumper(WebSocketDumper):
     def create_logger(self):
         return logging.getLogger('Bitfinex')
 
-    def do_dump(self):
-        # Before starting dumping, bitfinex has too much currencies so it has channel limitation
-        # of some channels, we must cherry pick the best one to observe it's trade
-        # Realize this by retrieving trading volumes for each symbol, and pick coins which volume is in the most 250
+    @staticmethod
+    def rank_symbols(logger):
+        # Bitfinex has too much currencies so it has channel limitation for a connection,
+        # we must know which one is the best to observe it's trade
+        # Realize this by retrieving trading volumes for each symbol, and sort symbols by volume
 
-        self.logger.info('Retrieving market volumes')
+        logger.info('Retrieving market volumes')
 
         request = urllib.request.Request('https://api.bitfinex.com/v2/tickers?symbols=ALL')
         with urllib.request.urlopen(request) as response:
@@ -397,15 +1103,16 @@ class BitfinexDumper(WebSocketDumper):
             itr = sorted(itr, key=lambda arr: arr[1], reverse=True)
 
             # Take only symbol, not an object
-            itr = map(lambda ticker: ticker[0], itr)
+            symbols = [ticker[0] for ticker in itr]
 
-            # Trim it down to fit a channel limit
-            self.sub_symbols = list(itr)[:self.BITFINEX_CHANNEL_LIMIT//2]
+        logger.info('Retrieving Done')
 
-        self.logger.info('Retrieving Done')
+        return symbols
 
-        # Call parent's do_dump
-        super().do_dump()
+    def prepare(self):
+        if self.sub_symbols is None:
+            # Trim it down to fit a channel limit
+            self.sub_symbols = self.rank_symbols(self.logger)[:self.SYMBOLS_PER_CONNECTION]
 
     def subscribe(self, ws):
         subscribe_obj = dict(
@@ -431,26 +1138,158 @@ class BitfinexDumper(WebSocketDumper):
 '''Main'''
 
 
-def do_dump_bitmex():
+# Listener classes of each file format, (synchronous, asynchronous)
+FILE_FORMATS = {
+    'lines': (FileWriteListener, AsyncFileWriteListener),
+    'blocks': (BlockFileWriteListener, AsyncBlockFileWriteListener),
+}
+
+def create_listener(directory, prefix, async_write=False, compression='gzip', level=None, file_format='lines',
+                    queue_size=AsyncFileWriteListener.DEFAULT_QUEUE_SIZE, overflow_policy=OverflowPolicy.BLOCK):
+    if async_write:
+        return FILE_FORMATS[file_format][1](directory, prefix, compression, level, queue_size, overflow_policy)
+    return FILE_FORMATS[file_format][0](directory, prefix, compression, level)
+
+def create_bitmex_dumpers(prefix='bitmex', **kwargs):
     bm = BitmexDumper()
-    bm.listener = FileWriteListener('./bitmex/', 'bitmex')
-    bm.do_dump()
+    bm.listener = create_listener('./bitmex/', prefix, **kwargs)
+    return [bm]
 
-def do_dump_bitflyer():
+def create_bitflyer_dumpers(prefix='bitflyer', **kwargs):
     bf = BitflyerDumper()
-    bf.listener = FileWriteListener('./bitflyer/', 'bitflyer')
-    bf.do_dump()
-
-def do_dump_bitfinex():
-    bf = BitfinexDumper()
-    bf.listener = FileWriteListener('./bitfinex/', 'bitfinex')
-    bf.do_dump()
+    bf.listener = create_listener('./bitflyer/', prefix, **kwargs)
+    return [bf]
+
+# Seconds between first connections of bitfinex shards, bitfinex limits how often connections can be made
+BITFINEX_SHARD_CONNECT_INTERVAL = 5
+
+def create_bitfinex_dumpers(prefix='bitfinex', connections=1, **kwargs):
+    # All symbols are split into shards fitting a channel limit, and each shard has its own connection
+    # Files of a shard are tagged as "<prefix>-s<shard number>", or "<prefix>-<connection>-s<shard number>" if each
+    # shard has more than one connection
+    # Symbols are ranked once, and first connections are staggered across shards of all connections
+    symbols = BitfinexDumper.rank_symbols(logging.getLogger('Bitfinex'))
+    size = BitfinexDumper.SYMBOLS_PER_CONNECTION
+    dumpers = []
+    for connection in range(connections):
+        connection_prefix = prefix if connections == 1 else '%s-%d' % (prefix, connection)
+        for shard, i in enumerate(range(0, len(symbols), size)):
+            bf = BitfinexDumper(symbols[i:i + size])
+            bf.listener = create_listener('./bitfinex/', '%s-s%02d' % (connection_prefix, shard), **kwargs)
+            bf.initial_wait = len(dumpers) * BITFINEX_SHARD_CONNECT_INTERVAL
+            dumpers.append(bf)
+    return dumpers
 
 DUMPERS = {
-    'bitmex': do_dump_bitmex,
-    'bitflyer': do_dump_bitflyer,
-    'bitfinex': do_dump_bitfinex,
+    'bitmex': create_bitmex_dumpers,
+    'bitflyer': create_bitflyer_dumpers,
+    'bitfinex': create_bitfinex_dumpers,
 }
+# Dumpers making all of their connections at once, so that they can share work and pace connecting
+MULTI_CONNECTION_DUMPERS = {'bitfinex'}
+
+# Options can be given after dumper names
+OPTION_ASYNC_WRITE = '--async-write'
+OPTION_COMPRESSION = '--compression='
+OPTION_LEVEL = '--level='
+# File format, "lines" (text, default) or "blocks" (binary)
+OPTION_FORMAT = '--format='
+# Run all dumpers in one asyncio event loop
+OPTION_ASYNCIO = '--asyncio'
+# What an asynchronous writer does when its queue is full, "block", "drop_newest" or "drop_oldest"
+# Blocking is not allowed with --asyncio since it would stop the event loop, which drops the oldest by default
+OPTION_OVERFLOW = '--overflow='
+# Number of events an asynchronous writer can queue
+OPTION_QUEUE_SIZE = '--queue-size='
+# Number of connections for each dumper
+OPTION_CONNECTIONS = '--connections='
+# Log a stats line of every dumper every this many seconds
+OPTION_STATS_INTERVAL = '--stats-interval='
+# Serve metrics as text at http://127.0.0.1:<port>/
+OPTION_METRICS_PORT = '--metrics-port='
+
+# Parse options into keyword arguments for create_listener and main options, returns None if invalid
+def parse_options(options):
+    kwargs = dict()
+    main_options = dict(asyncio=False, connections=1, stats_interval=None, metrics_port=None)
+    for option in options:
+        if option == OPTION_ASYNC_WRITE:
+            kwargs['async_write'] = True
+        elif option.startswith(OPTION_COMPRESSION) and option[len(OPTION_COMPRESSION):] in COMPRESSIONS:
+            kwargs['compression'] = option[len(OPTION_COMPRESSION):]
+        elif option.startswith(OPTION_FORMAT) and option[len(OPTION_FORMAT):] in FILE_FORMATS:
+            kwargs['file_format'] = option[len(OPTION_FORMAT):]
+        elif option.startswith(OPTION_LEVEL) and option[len(OPTION_LEVEL):].isdecimal():
+            kwargs['level'] = int(option[len(OPTION_LEVEL):])
+        elif option == OPTION_ASYNCIO:
+            main_options['asyncio'] = True
+        elif option.startswith(OPTION_OVERFLOW) and option[len(OPTION_OVERFLOW):].upper() in OverflowPolicy.__members__:
+            kwargs['overflow_policy'] = OverflowPolicy[option[len(OPTION_OVERFLOW):].upper()]
+        elif option.startswith(OPTION_QUEUE_SIZE) and option[len(OPTION_QUEUE_SIZE):].isdecimal()\
+                and int(option[len(OPTION_QUEUE_SIZE):]) > 0:
+            kwargs['queue_size'] = int(option[len(OPTION_QUEUE_SIZE):])
+        elif option.startswith(OPTION_CONNECTIONS) and option[len(OPTION_CONNECTIONS):].isdecimal()\
+                and int(option[len(OPTION_CONNECTIONS):]) > 0:
+            main_options['connections'] = int(option[len(OPTION_CONNECTIONS):])
+        elif option.startswith(OPTION_STATS_INTERVAL) and option[len(OPTION_STATS_INTERVAL):].isdecimal()\
+                and int(option[len(OPTION_STATS_INTERVAL):]) > 0:
+            main_options['stats_interval'] = int(option[len(OPTION_STATS_INTERVAL):])
+        elif option.startswith(OPTION_METRICS_PORT) and option[len(OPTION_METRICS_PORT):].isdecimal():
+            main_options['metrics_port'] = int(option[len(OPTION_METRICS_PORT):])
+        else:
+            return None, None
+
+    if main_options['asyncio']:
+        # Writing files must not block the event loop
+        kwargs['async_write'] = True
+        if kwargs.get('overflow_policy') == OverflowPolicy.BLOCK:
+            return None, None
+        kwargs.setdefault('overflow_policy', OverflowPolicy.DROP_OLDEST)
+    elif not kwargs.get('async_write', False) and ('overflow_policy' in kwargs or 'queue_size' in kwargs):
+        # Only an asynchronous writer has a queue
+        return None, None
+    return kwargs, main_options
+
+# Make dumpers for names, each connection writes files with its own prefix
+def create_dumpers(names, connections, **kwargs):
+    dumpers = []
+    for name in names:
+        if name in MULTI_CONNECTION_DUMPERS:
+            dumpers.extend(DUMPERS[name](connections=connections, **kwargs))
+            continue
+        for i in range(connections):
+            if connections == 1:
+                dumpers.extend(DUMPERS[name](**kwargs))
+            else:
+                dumpers.extend(DUMPERS[name](prefix='%s-%d' % (name, i), **kwargs))
+    return dumpers
+
+def close_listeners(dumpers):
+    # Write everything queued before exiting
+    for dumper in dumpers:
+        if isinstance(dumper.listener, AsyncFileWriteListener):
+            dumper.listener.close()
+
+def run_asyncio(dumpers):
+    try:
+        asyncio.run(run_dumpers(dumpers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_listeners(dumpers)
+
+def run_threads(dumpers):
+    # Dumper threads are daemons, so that the main thread gets a kill command and closes listeners before exiting
+    threads = [threading.Thread(target=dumper.do_dump, daemon=True) for dumper in dumpers]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_listeners(dumpers)
 
 if __name__ == '__main__':
     # Setting config format
@@ -460,16 +1299,31 @@ if __name__ == '__main__':
 
     logger.info('Ver [%s] starting now...', DUMPER_VERSION)
 
-    if len(sys.argv) != 2:
+    if len(sys.argv) < 2:
         logger.error('Parameter needed')
         exit(1)
 
-    if sys.argv[1] not in DUMPERS:
+    # Dumper names are separated by comma
+    names = sys.argv[1].split(',')
+    if any(name not in DUMPERS for name in names):
         logger.error('Invalid parameter')
         exit(1)
 
-    dumper = DUMPERS[sys.argv[1]]
-
-    thread = threading.Thread(target=dumper)
-    thread.start()
+    kwargs, main_options = parse_options(sys.argv[2:])
+    if kwargs is None:
+        logger.error('Invalid option')
+        exit(1)
 
+    if main_options['stats_interval'] is not None:
+        StatsReporter(main_options['stats_interval']).start()
+    if main_options['metrics_port'] is not None:
+        start_metrics_server(main_options['metrics_port'])
+        logger.info('Serving metrics at http://127.0.0.1:%d/' % main_options['metrics_port'])
+
+    if main_options['asyncio']:
+        if websockets is None:
+            logger.error('Package "websockets" is needed for %s' % OPTION_ASYNCIO)
+            exit(1)
+        run_asyncio(create_dumpers(names, main_options['connections'], **kwargs))
+    else:
+        run_threads(create_dumpers(names, main_options['connections'], **kwargs))
@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import time
+import tempfile
+
+from reader import compression
+from reader.blocks import BLOCK_EXTENSION, convert_to_blocks, open_reader, read_records
+from reader.line_reader import tokenize_line
+import reader.processor.protocols as protocols
+from benchmark import synthetic
+
+
+
+def frame_lines(path: str):
+    # Decompress, split lines and parse their times, what FileLineReader does before a processor
+    count = 0
+    with compression.open_dump(path) as file:
+        file.readline()
+        for line in file:
+            tokenize_line(line)
+            count += 1
+    return count
+
+def frame_records(path: str):
+    # Decompress blocks and unpack record headers, payloads are decoded to str as a processor takes them
+    count = 0
+    with open(path, 'rb') as file:
+        for record_type, timestamp, payload in read_records(file):
+            str(payload, 'utf-8')
+            count += 1
+    return count
+
+def replay(path: str):
+    # Whole reader with a processor, into a listener doing nothing
+    reader = open_reader(path)
+    try:
+        reader.setup(protocols.Listener())
+        count = 0
+        while reader.next_line():
+            count += 1
+    finally:
+        reader.file.close()
+    return count
+
+
+def measure(name: str, func, path: str):
+    start = time.perf_counter()
+    count = func(path)
+    elapsed = time.perf_counter() - start
+    print('%-24s %9d records %8.3f s %10.0f records/s %8.2f us/record'
+          % (name, count, elapsed, count / elapsed, elapsed / count * 1e6))
+
+def run(path: str, directory: str):
+    block_path = os.path.join(directory, 'sample' + BLOCK_EXTENSION)
+    convert_to_blocks(path, block_path)
+    print('text %.1f MB, blocks %.1f MB' % (os.path.getsize(path) / 2 ** 20, os.path.getsize(block_path) / 2 ** 20))
+    measure('text framing', frame_lines, path)
+    measure('block framing', frame_records, block_path)
+    measure('text replay', replay, path)
+    measure('block replay', replay, block_path)
+
+    # Uncompressed copy is read through a memory map
+    plain_path = os.path.join(directory, 'sample' + compression.DUMP_EXTENSION)
+    with compression.open_dump(path, 'rb') as source, open(plain_path, 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    measure('uncompressed replay', replay, plain_path)
+
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        if len(sys.argv) > 1:
+            run(sys.argv[1], directory)
+        else:
+            path = os.path.join(directory, 'synthetic.json.lines.gz')
+            synthetic.write_dump(path, 100000)
+            run(path, directory)
@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import random
+import tempfile
+
+from reader.structures import Board, RecordListSource, RECORD_CLEAR_ALL, RECORD_INSERT_BUY,\
+    RECORD_INSERT_SELL, RECORD_SET_BUY, RECORD_SET_SELL
+from database.database import BoardTableSource
+
+
+
+def delta_records(count: int, depth: int = 500, seed: int = 0):
+    # Records like bitflyer diffs: a snapshot first, then levels set to new amounts (0 removes)
+    rand = random.Random(seed)
+    mid = 1000000
+    records = [(0, RECORD_CLEAR_ALL, None, None)]
+    for i in range(depth):
+        records.append((0, RECORD_INSERT_BUY, mid - 1 - i, rand.random()))
+        records.append((0, RECORD_INSERT_SELL, mid + 1 + i, rand.random()))
+    timestamp = 0
+    while len(records) < count:
+        timestamp += rand.randint(1, 5000)
+        mid += rand.randint(-2, 2)
+        # A message has a few levels around the mid price
+        for i in range(rand.randint(1, 6)):
+            amount = 0 if rand.random() < 0.3 else rand.random()
+            if rand.random() < 0.5:
+                records.append((timestamp, RECORD_SET_BUY, mid - rand.randint(1, 50), amount))
+            else:
+                records.append((timestamp, RECORD_SET_SELL, mid + rand.randint(1, 50), amount))
+    return records
+
+
+def replay(price_type: type, source):
+    # Step message by message (time by time) and read the top of the book at every step
+    board = Board(price_type, source)
+    source_records = list(source.records())
+    times = sorted(set(record[1] for record in source_records))
+    start = time.perf_counter()
+    for timestamp in times:
+        board.set_time(timestamp)
+        board.best_bid
+        board.best_ask
+    elapsed = time.perf_counter() - start
+    return len(source_records), len(times), elapsed
+
+
+def report(name: str, result: tuple):
+    records, messages, elapsed = result
+    print('%s: %d updates, %d messages in %.3f s, %.0f updates/s, %.0f messages/s'
+          % (name, records, messages, elapsed, records / elapsed, messages / elapsed))
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        # A database litesqlize wrote and a name of a board table
+        source = BoardTableSource(sys.argv[1], sys.argv[2])
+        report('%s %s' % (sys.argv[1], sys.argv[2]), replay(float, source))
+    else:
+        # Optionally a number of levels on each side, e.g. 100000 for a deep book
+        depth = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+        records = delta_records(1000000, depth)
+        report('synthetic deltas, depth %d' % depth, replay(int, RecordListSource(records)))
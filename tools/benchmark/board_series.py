@@ -0,0 +1,35 @@
+import sys
+import time
+
+import numpy as np
+
+from reader.structures import RecordListSource
+from database.database import BoardTableSource
+from database.analytics import BoardRecords, board_series, load_board_table
+from .board import delta_records, replay, report
+
+
+
+def vectorized(records: BoardRecords, levels: int):
+    # Same samples as replay, after the last record of each timestamp
+    start = time.perf_counter()
+    series = board_series(records, levels)
+    elapsed = time.perf_counter() - start
+    return len(records), len(series), elapsed
+
+
+
+if __name__ == '__main__':
+    levels = 10
+    if len(sys.argv) > 2:
+        # A database litesqlize wrote and a name of a board table
+        report('replay %s' % sys.argv[2], replay(float, BoardTableSource(sys.argv[1], sys.argv[2])))
+        report('board_series %s' % sys.argv[2], vectorized(load_board_table(sys.argv[1], sys.argv[2]), levels))
+    else:
+        records = delta_records(1000000)
+        report('replay synthetic deltas', replay(int, RecordListSource(records)))
+        arrays = BoardRecords([record[0] for record in records], [record[1] for record in records],
+                              [np.nan if record[2] is None else record[2] for record in records],
+                              [np.nan if record[3] is None else record[3] for record in records])
+        report('board_series synthetic deltas (%d levels)' % levels, vectorized(arrays, levels))
+        report('board_series synthetic deltas (1 level)', vectorized(arrays, 1))
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import tempfile
+
+from reader import compression
+from benchmark import synthetic
+
+
+
+# (compression, level) to compare, None is the default level of each method
+CANDIDATES = [
+    ('gzip', 1),
+    ('gzip', 6),
+    ('gzip', 9),
+    ('zlib', 1),
+    ('zlib', 6),
+    ('bz2', 1),
+    ('bz2', 9),
+    ('lzma', 0),
+    ('lzma', 6),
+    ('none', None),
+]
+# Lines are written in chunks of about this size, as FileWriteListener does
+WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def load_sample(paths: list):
+    text = []
+    for path in paths:
+        with compression.open_dump(path) as file:
+            text.append(file.read())
+    return ''.join(text)
+
+
+def _chunks(text: str):
+    for i in range(0, len(text), WRITE_CHUNK_SIZE):
+        yield text[i:i + WRITE_CHUNK_SIZE]
+
+
+def run(text: str, directory: str):
+    megabytes = len(text.encode('utf-8')) / (1024 * 1024)
+    print('sample: %.1f MB' % megabytes)
+    print('%-6s %5s %14s %13s %9s' % ('method', 'level', 'write CPU s/MB', 'read CPU s/MB', 'ratio'))
+
+    for name, level in CANDIDATES:
+        method = compression.COMPRESSION_BY_NAME[name]
+        path = os.path.join(directory, 'sample' + compression.DUMP_EXTENSION + method.extension)
+
+        start = time.process_time()
+        with compression.open_dump(path, 'wt', name, level) as file:
+            for chunk in _chunks(text):
+                file.write(chunk)
+        write_time = time.process_time() - start
+
+        start = time.process_time()
+        with compression.open_dump(path) as file:
+            while file.read(WRITE_CHUNK_SIZE) != '':
+                pass
+        read_time = time.process_time() - start
+
+        ratio = os.path.getsize(path) / (megabytes * 1024 * 1024)
+        print('%-6s %5s %14.4f %13.4f %9.4f' % (name, '-' if level is None else level,
+                                                write_time / megabytes, read_time / megabytes, ratio))
+        os.remove(path)
+
+
+
+if __name__ == '__main__':
+    # Recorded dump files can be given, otherwise a synthetic stream is used
+    with tempfile.TemporaryDirectory() as directory:
+        if len(sys.argv) > 1:
+            sample = load_sample(sys.argv[1:])
+        else:
+            path = os.path.join(directory, 'synthetic.json.lines.gz')
+            synthetic.write_dump(path, 50000)
+            sample = load_sample([path])
+        run(sample, directory)
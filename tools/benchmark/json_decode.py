@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import tempfile
+
+from reader import compression, json_backend
+from reader.line_reader import FileLineReader
+import reader.processor.protocols as protocols
+from benchmark import synthetic
+
+
+
+class CountingListener(protocols.Listener):
+    # Touches every record, only data types given are accepted (all if None)
+    def __init__(self, data_types: set = None):
+        self.data_types = data_types
+        self.records = 0
+
+    def accepts(self, pair_name: str, data_type: protocols.DataType) -> bool:
+        return self.data_types is None or data_type in self.data_types
+
+    def board_insert_batch(self, pair_name: str, type: protocols.TradeType, prices: list, sizes: list):
+        self.records += len(prices)
+
+    def ticker_insert(self, pair_name: str, ticker: protocols.Ticker):
+        self.records += 1
+
+    def execution_insert_batch(self, pair_name: str, executions: list):
+        self.records += len(executions)
+
+
+class _TextLines():
+    def __init__(self, text: str):
+        self._lines = iter(text.splitlines(keepends=True))
+
+    def readline(self) -> str:
+        return next(self._lines, '')
+
+
+def measure(text: str, data_types: set = None):
+    # Lines are read from memory so that only tokenizing, decoding and processing are measured
+    listener = CountingListener(data_types)
+    start = time.perf_counter()
+    reader = FileLineReader(_TextLines(text))
+    reader.setup(listener)
+    lines = 0
+    while reader.next_line():
+        lines += 1
+    return lines, listener.records, time.perf_counter() - start
+
+
+def run(text: str):
+    print('%-8s %-10s %10s %10s %12s' % ('backend', 'accepts', 'messages', 'records', 'messages/s'))
+    for name in json_backend.available_backends():
+        json_backend.set_backend(name)
+        for label, data_types in [('all', None), ('ticker', {protocols.DataType.TICKER})]:
+            lines, records, elapsed = measure(text, data_types)
+            print('%-8s %-10s %10d %10d %12.0f' % (name, label, lines, records, lines / elapsed))
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with compression.open_dump(sys.argv[1]) as file:
+            run(file.read())
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'synthetic.json.lines.gz')
+            synthetic.write_dump(path, 100000)
+            with compression.open_dump(path) as file:
+                run(file.read())
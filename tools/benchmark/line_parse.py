@@ -0,0 +1,61 @@
+import os
+import sys
+import gzip
+import time
+import datetime
+import tempfile
+
+from reader.line_reader import LINE_REGEX, DATETIME_FORMAT_DEFAULT, DATETIME_FORMAT_FALLBACK, MessageType,\
+    tokenize_line, datetime_to_timestamp
+from benchmark import synthetic
+
+
+
+def legacy_tokenize_line(line: str):
+    # The way FileLineReader parsed a line before tokenize_line
+    match_obj = LINE_REGEX.match(line)
+    type_str = match_obj.group('type')
+    datetime_str = match_obj.group('datetime')
+    msg = match_obj.group('msg')
+    try:
+        line_datetime = datetime.datetime.strptime(datetime_str, DATETIME_FORMAT_DEFAULT)
+    except ValueError:
+        line_datetime = datetime.datetime.strptime(datetime_str, DATETIME_FORMAT_FALLBACK)
+    return MessageType.from_str(type_str), line_datetime, msg
+
+
+def measure(func, lines: list):
+    start = time.perf_counter()
+    results = [func(line) for line in lines]
+    return time.perf_counter() - start, results
+
+
+def run(path: str):
+    with gzip.open(path, 'rt') as file:
+        # Skip a head line, it is not processed by the tokenizer
+        file.readline()
+        lines = file.readlines()
+
+    legacy_time, legacy_results = measure(legacy_tokenize_line, lines)
+    fast_time, fast_results = measure(tokenize_line, lines)
+
+    # Both must produce the same result
+    for legacy, fast in zip(legacy_results, fast_results):
+        if legacy[0] != fast[0] or datetime_to_timestamp(legacy[1]) != fast[1] or legacy[2] != fast[2]:
+            raise AssertionError('Results differ\n%s\n%s' % (legacy, fast))
+
+    print('lines: %d' % len(lines))
+    print('regex + strptime: %.3f us/line' % (legacy_time / len(lines) * 1e6))
+    print('tokenize_line:    %.3f us/line' % (fast_time / len(lines) * 1e6))
+    print('speedup:          %.1fx' % (legacy_time / fast_time))
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'synthetic.json.lines.gz')
+            synthetic.write_dump(path, 200000)
+            run(path)
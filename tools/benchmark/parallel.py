@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import tempfile
+
+from reader.blocks import open_reader
+from reader.dump_index import load_index
+from reader.parallel import ParallelFileLineReader
+import reader.processor.protocols as protocols
+from benchmark import synthetic
+
+
+
+# Messages of a synthetic dump when no dump file is given
+DEFAULT_MESSAGES = 200000
+
+
+def replay(reader) -> int:
+    # Whole reader with a processor, into a listener doing nothing
+    try:
+        reader.setup(protocols.Listener())
+        count = 0
+        while reader.next_line():
+            count += 1
+    finally:
+        reader.file.close()
+    return count
+
+def drain(reader) -> int:
+    # Decoded chunks only, how fast workers feed the processor at most
+    count = 0
+    try:
+        reader._read_head()
+        while True:
+            chunk = reader.file.next_chunk()
+            if chunk is None:
+                return count
+            count += len(chunk[0])
+    finally:
+        reader.file.close()
+
+
+def measure(name: str, func, *args):
+    start = time.perf_counter()
+    count = func(*args)
+    elapsed = time.perf_counter() - start
+    print('%-32s %9d lines %8.3f s %10.0f lines/s' % (name, count, elapsed, count / elapsed))
+
+def run(path: str, workers: list):
+    start = time.perf_counter()
+    index = load_index(path)
+    print('%d chunks, index made or loaded in %.3f s' % (len(index.points), time.perf_counter() - start))
+    measure('sequential replay', replay, open_reader(path))
+    for count in workers:
+        measure('decode, %d workers' % count, drain, ParallelFileLineReader(path, count))
+        measure('replay, %d workers' % count, replay, ParallelFileLineReader(path, count))
+
+
+
+if __name__ == '__main__':
+    # Usage: parallel.py [dump file or number of synthetic messages] [numbers of workers separated with ","]
+    source = sys.argv[1] if len(sys.argv) > 1 else str(DEFAULT_MESSAGES)
+    workers = [int(count) for count in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4]
+    with tempfile.TemporaryDirectory() as directory:
+        if source.isdecimal():
+            path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines.gz')
+            synthetic.write_dump(path, int(source))
+        else:
+            path = source
+        run(path, workers)
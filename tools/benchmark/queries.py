@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import logging
+import tempfile
+
+import database.database as database
+from database.database import BoardRecordType
+import litesqlize
+from benchmark import synthetic
+
+
+
+# Messages of a synthetic dump when no dump file is given
+DEFAULT_MESSAGES = 200000
+# Times each query runs with a different window
+REPEAT = 50
+
+# Typical lookups, (name, SQL, window in microseconds), parameters are the beginning and the end of a window, or
+# a time if a query has no window
+# Rows of a board for a short window, a ticker series, executions counted, and the last CLEAR_ALL before a time as
+# analytics.load_board_table does
+QUERIES = [
+    ('board rows in 1 s', 'SELECT timestamp, type, price, size FROM `{board}` WHERE timestamp >= ? AND timestamp < ?',
+     1000000),
+    ('board rows in 60 s', 'SELECT timestamp, type, price, size FROM `{board}` WHERE timestamp >= ? AND timestamp < ?',
+     60000000),
+    ('tickers in 60 s', 'SELECT * FROM `{ticker}` WHERE timestamp >= ? AND timestamp < ?', 60000000),
+    ('executions counted in 60 s', 'SELECT COUNT(*) FROM `{executions}` WHERE timestamp >= ? AND timestamp < ?',
+     60000000),
+    ('last clear before a time', 'SELECT MAX(rowid) FROM `{board}` WHERE type = %d AND timestamp <= ?'
+     % BoardRecordType.CLEAR_ALL.value, None),
+]
+
+
+def load(path: str, url: str, profile: str) -> float:
+    litesqlize.PROFILE = profile
+    start = time.perf_counter()
+    litesqlize.sqlize(path, url)
+    return time.perf_counter() - start
+
+def tables(url: str) -> dict:
+    # The largest table of each kind
+    connection = sqlite3.connect(url)
+    try:
+        names = [row[0] for row in connection.execute('SELECT name FROM sqlite_master WHERE type = \'table\'')]
+        counts = {name: connection.execute('SELECT COUNT(*) FROM `%s`' % name).fetchone()[0] for name in names}
+    finally:
+        connection.close()
+    result = {}
+    for kind, prefix in [('board', 'lightning_board_'), ('ticker', 'lightning_ticker_'),
+                         ('executions', 'lightning_executions_')]:
+        candidates = [name for name in names if name.startswith(prefix) and 'snapshot' not in name]
+        if len(candidates) > 0:
+            result[kind] = max(candidates, key=lambda name: counts[name])
+    return result
+
+def run_queries(url: str, label: str):
+    connection = sqlite3.connect(url)
+    try:
+        names = tables(url)
+        board = names['board']
+        begin, end = connection.execute('SELECT MIN(timestamp), MAX(timestamp) FROM `%s`' % board).fetchone()
+        for name, sql, window in QUERIES:
+            try:
+                sql = sql.format(**names)
+            except KeyError:
+                continue
+            # Windows start at the same times for each label
+            generator = random.Random(0)
+            rows = 0
+            start = time.perf_counter()
+            for i in range(REPEAT):
+                if window is None:
+                    parameters = (generator.randint(begin, end), )
+                else:
+                    window_begin = generator.randint(begin, max(begin, end - window))
+                    parameters = (window_begin, window_begin + window)
+                rows += len(connection.execute(sql, parameters).fetchall())
+            elapsed = time.perf_counter() - start
+            print('%-16s %-28s %10.3f ms/query %10.1f rows/query' % (label, name, elapsed / REPEAT * 1000,
+                                                                      rows / REPEAT))
+    finally:
+        connection.close()
+
+def run(path: str, directory: str):
+    urls = {}
+    for profile in ['default', 'bulk']:
+        urls[profile] = os.path.join(directory, profile + '.sqlite')
+        print('load with %-8s profile %8.3f s' % (profile, load(path, urls[profile], profile)))
+
+    url = urls['bulk']
+    run_queries(url, 'no index')
+    start = time.perf_counter()
+    database.create_indexes(url)
+    print('indexes made in %.3f s' % (time.perf_counter() - start))
+    run_queries(url, 'indexed')
+
+
+
+if __name__ == '__main__':
+    # Usage: queries.py [dump file or number of synthetic messages]
+    logging.disable(logging.INFO)
+    source = sys.argv[1] if len(sys.argv) > 1 else str(DEFAULT_MESSAGES)
+    with tempfile.TemporaryDirectory() as directory:
+        if source.isdecimal():
+            path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines.gz')
+            synthetic.write_dump(path, int(source))
+        else:
+            path = source
+        run(path, directory)
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+
+from reader import compression, json_backend
+from reader.line_reader import FileLineReader, MessageType, tokenize_line, timestamp_to_datetime
+import reader.processor.protocols as protocols
+import database.database as database
+import litesqlize
+from benchmark import synthetic
+
+
+
+# Messages of a synthetic dump when no dump file is given, the generator is seeded so runs are comparable
+DEFAULT_MESSAGES = 100000
+
+
+def peak_rss_mb() -> float:
+    # Peak resident set size of this process so far, ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Lines():
+    # File-like reader over lines in memory, so that stages after reading do not measure decompression
+    def __init__(self, lines: list):
+        self._lines = iter(lines)
+
+    def readline(self) -> str:
+        return next(self._lines, '')
+
+
+class _RecordingListener(protocols.Listener):
+    # Records listener calls with their message times, so that a database write can be replayed alone
+    def __init__(self, reader: FileLineReader):
+        self._reader = reader
+        self.calls = []
+
+    def _record(self, name: str, *args):
+        self.calls.append((self._reader.message_timestamp, name, args))
+
+    def board_start(self, pair_name: str):
+        self._record('board_start', pair_name)
+
+    def board_insert_batch(self, pair_name: str, type: protocols.TradeType, prices: list, sizes: list):
+        self._record('board_insert_batch', pair_name, type, prices, sizes)
+
+    def board_clear(self, pair_name: str):
+        self._record('board_clear', pair_name)
+
+    def ticker_start(self, pair_name: str):
+        self._record('ticker_start', pair_name)
+
+    def ticker_insert(self, pair_name: str, ticker: protocols.Ticker):
+        self._record('ticker_insert', pair_name, ticker)
+
+    def execution_start(self, pair_name: str):
+        self._record('execution_start', pair_name)
+
+    def execution_insert_batch(self, pair_name: str, executions: list):
+        self._record('execution_insert_batch', pair_name, executions)
+
+    def eos(self):
+        self._record('eos')
+
+
+class _ReplayedTime():
+    # Stands for FileLineReader in litesqlize.Listener, which only asks for the message time
+    message_time = None
+
+
+
+def stage_read(path: str):
+    with compression.open_dump(path) as file:
+        return file.readlines()
+
+def stage_parse(lines: list):
+    # Head line is processed once by FileLineReader.setup, not by the tokenizer
+    return [tokenize_line(line) for line in lines[1:]]
+
+def stage_decode(tokens: list):
+    # Decoded objects are dropped at once, as the processor drops them
+    loads = json_backend.loads
+    for message_type, timestamp, msg in tokens:
+        if message_type != MessageType.EOF:
+            loads(msg)
+
+def stage_dispatch(lines: list):
+    # Parse, decode and processor, into a listener doing nothing
+    reader = FileLineReader(_Lines(lines))
+    reader.setup(protocols.Listener())
+    while reader.next_line():
+        pass
+
+def stage_record(lines: list):
+    reader = FileLineReader(_Lines(lines))
+    listener = _RecordingListener(reader)
+    reader.setup(listener)
+    while reader.next_line():
+        pass
+    return listener.calls
+
+def stage_write(calls: list, url: str):
+    # Calls the processor made, replayed into the listener litesqlize uses
+    clock = _ReplayedTime()
+    with database.open(url) as db:
+        listener = litesqlize.Listener(db, clock)
+        for timestamp, name, args in calls:
+            clock.message_time = timestamp_to_datetime(timestamp)
+            getattr(listener, name)(*args)
+            db.checkpoint()
+
+def stage_sqlize(path: str, url: str):
+    litesqlize.sqlize(path, url)
+
+
+def measure(results: list, name: str, lines: int, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    results.append(dict(stage=name, seconds=elapsed, lines_per_second=lines / elapsed, peak_rss_mb=peak_rss_mb()))
+    return result
+
+def run(path: str) -> list:
+    # Each stage is timed alone on what the previous one produced, and the whole litesqlize run at last
+    results = []
+    lines = measure(results, 'read and decompress', 0, stage_read, path)
+    count = len(lines)
+    results[-1]['lines_per_second'] = count / results[-1]['seconds']
+    tokens = measure(results, 'line parse', count, stage_parse, lines)
+    measure(results, 'json decode (%s)' % json_backend.backend_name, count, stage_decode, tokens)
+    del tokens
+    measure(results, 'processor dispatch (incl. parse, decode)', count, stage_dispatch, lines)
+    calls = measure(results, 'listener calls recorded', count, stage_record, lines)
+    del lines
+
+    with tempfile.TemporaryDirectory() as directory:
+        measure(results, 'db write', count, stage_write, calls, os.path.join(directory, 'write.sqlite'))
+        del calls
+        measure(results, 'litesqlize end to end', count, stage_sqlize, path, os.path.join(directory, 'all.sqlite'))
+    return results
+
+def report(results: list):
+    print('%-42s %9s %12s %13s' % ('stage', 'seconds', 'lines/s', 'peak RSS MB'))
+    for result in results:
+        print('%-42s %9.3f %12.0f %13.1f' % (result['stage'], result['seconds'], result['lines_per_second'],
+                                            result['peak_rss_mb']))
+
+
+
+if __name__ == '__main__':
+    # Usage: replay.py [dump file or number of synthetic messages] [file to write results in JSON]
+    source = sys.argv[1] if len(sys.argv) > 1 else str(DEFAULT_MESSAGES)
+    with tempfile.TemporaryDirectory() as directory:
+        if source.isdecimal():
+            path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines.gz')
+            synthetic.write_dump(path, int(source))
+        else:
+            path = source
+        results = run(path)
+    report(results)
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as file:
+            json.dump(dict(source=source, python=sys.version.split()[0], results=results), file, indent=1)
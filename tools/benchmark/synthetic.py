@@ -0,0 +1,159 @@
+import sys
+import gzip
+import json
+import random
+import datetime
+
+
+
+# Same formats FileWriteListener and WebSocketDumper use when writing a dump
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+BITFLYER_URL = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+BITFLYER_CHANNEL_PREFIXES = [
+    'lightning_board_snapshot_',
+    'lightning_board_',
+    'lightning_ticker_',
+    'lightning_executions_',
+]
+DEFAULT_PRODUCT_CODES = ['BTC_JPY', 'FX_BTC_JPY', 'ETH_BTC']
+
+
+
+def _compact(obj: object):
+    # Messages from server do not have spaces
+    return json.dumps(obj, separators=(',', ':'))
+
+
+class BitflyerStreamGenerator():
+    def __init__(self, product_codes: list = None, channel_prefixes: list = None, seed: int = 0,
+                 start: datetime.datetime = datetime.datetime(2019, 5, 1), snapshot_depth: int = 300):
+        self._product_codes = product_codes if product_codes is not None else DEFAULT_PRODUCT_CODES
+        self._prefixes = channel_prefixes if channel_prefixes is not None else BITFLYER_CHANNEL_PREFIXES
+        self._random = random.Random(seed)
+        self._time = start
+        self._snapshot_depth = snapshot_depth
+        self._channels = ['%s%s' % (prefix, product_code)
+                          for product_code in self._product_codes for prefix in self._prefixes]
+        # Mid price for each product code
+        self._mid = {product_code: self._random.randint(5000, 1000000) for product_code in self._product_codes}
+        self._tick_id = 0
+        self._execution_id = 0
+
+    def _line(self, line_type: str, msg: str):
+        return '%s,%s,%s\n' % (line_type, self._time.strftime(DATETIME_FORMAT), msg)
+
+    def _advance(self):
+        # Roughly a few hundreds messages per second
+        self._time += datetime.timedelta(microseconds=int(self._random.expovariate(1 / 3000)))
+
+    def _levels(self, product_code: str, sign: int, count: int):
+        mid = self._mid[product_code]
+        return [dict(price=mid + sign * (i + 1 + self._random.randint(0, 3)),
+                     size=round(self._random.random() * 2, 8))
+                for i in range(count)]
+
+    def _board(self, product_code: str, depth: int):
+        return dict(
+            mid_price=self._mid[product_code],
+            bids=self._levels(product_code, -1, depth),
+            asks=self._levels(product_code, 1, depth),
+        )
+
+    def _ticker(self, product_code: str):
+        mid = self._mid[product_code]
+        self._tick_id += 1
+        return dict(
+            product_code=product_code,
+            timestamp=self._time.strftime('%Y-%m-%dT%H:%M:%S.%f') + '1Z',
+            tick_id=self._tick_id,
+            best_bid=mid - 1,
+            best_ask=mid + 1,
+            best_bid_size=round(self._random.random(), 8),
+            best_ask_size=round(self._random.random(), 8),
+            total_bid_depth=round(self._random.random() * 10000, 8),
+            total_ask_depth=round(self._random.random() * 10000, 8),
+            ltp=mid,
+            volume=round(self._random.random() * 100000, 8),
+            volume_by_product=round(self._random.random() * 100000, 8),
+        )
+
+    def _executions(self, product_code: str):
+        executions = []
+        for i in range(self._random.randint(1, 5)):
+            self._execution_id += 1
+            executions.append(dict(
+                id=self._execution_id,
+                side=self._random.choice(['BUY', 'SELL']),
+                price=self._mid[product_code],
+                size=round(self._random.random(), 8),
+                exec_date=self._time.strftime('%Y-%m-%dT%H:%M:%S.%f') + '1Z',
+                buy_child_order_acceptance_id='JRF20190501-000000-%06d' % self._execution_id,
+                sell_child_order_acceptance_id='JRF20190501-000001-%06d' % self._execution_id,
+            ))
+        return executions
+
+    def _channel_message(self, channel: str):
+        if channel.startswith('lightning_board_snapshot_'):
+            product_code = channel[len('lightning_board_snapshot_'):]
+            message = self._board(product_code, self._snapshot_depth)
+        elif channel.startswith('lightning_board_'):
+            product_code = channel[len('lightning_board_'):]
+            message = self._board(product_code, self._random.randint(1, 10))
+        elif channel.startswith('lightning_ticker_'):
+            message = self._ticker(channel[len('lightning_ticker_'):])
+        else:
+            message = self._executions(channel[len('lightning_executions_'):])
+        return _compact(dict(jsonrpc='2.0', method='channelMessage', params=dict(channel=channel, message=message)))
+
+    def lines(self, count: int):
+        # Yields lines of a dump having "count" data messages in between head and eos
+        yield 'head,0,%s,websocket,0,%s\n' % (self._time.strftime(DATETIME_FORMAT), BITFLYER_URL)
+
+        for i, channel in enumerate(self._channels):
+            yield self._line('emit', json.dumps(dict(method='subscribe', params=dict(channel=channel), id=i + 1)))
+        for i in range(len(self._channels)):
+            self._advance()
+            yield self._line('msg', _compact(dict(jsonrpc='2.0', id=i + 1, result=True)))
+
+        for i in range(count):
+            self._advance()
+            # Prices walk randomly
+            product_code = self._random.choice(self._product_codes)
+            self._mid[product_code] += self._random.randint(-2, 2)
+            # Snapshots are much rarer than the other messages
+            channel = self._random.choice(self._channels)
+            if channel.startswith('lightning_board_snapshot_') and self._random.random() > 0.02:
+                channel = 'lightning_board_' + channel[len('lightning_board_snapshot_'):]
+            yield self._line('msg', self._channel_message(channel))
+
+        yield 'eos,%s,None\n' % self._time
+
+
+# FileWriteListener starts a new gzip member after this many bytes of text, at a line boundary
+STREAM_SIZE = 4 * 1024 * 1024
+
+
+def write_dump(path: str, count: int, **kwargs):
+    generator = BitflyerStreamGenerator(**kwargs)
+    with open(path, 'wb') as raw:
+        member = []
+        member_size = 0
+        for line in generator.lines(count):
+            data = line.encode('utf-8')
+            member.append(data)
+            member_size += len(data)
+            if member_size >= STREAM_SIZE:
+                raw.write(gzip.compress(b''.join(member), 9))
+                member = []
+                member_size = 0
+        if len(member) > 0:
+            raw.write(gzip.compress(b''.join(member), 9))
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) <= 2:
+        print('Please specify a file to write and a number of messages')
+        exit(1)
+
+    write_dump(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,50 @@
+import sys
+import logging
+import sqlite3
+
+from reader.checkpoints import CheckpointStore, build_checkpoints, checkpoint_path
+import database.database as database
+from database.database import BoardTableSource
+
+
+
+# Set format for logger
+logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s', level=logging.INFO)
+# Initialize logger
+logger = logging.getLogger('Main')
+
+# Default interval of checkpoints in seconds
+DEFAULT_INTERVAL = 60
+
+
+
+def board_tables(url: str):
+    # Tables having the same columns as board table definition
+    connection = sqlite3.connect(url)
+    try:
+        names = [row[0] for row in connection.execute('SELECT name FROM sqlite_master WHERE type = \'table\'')]
+        columns = list(database.DEF_BOARD_TABLE.keys())
+        return [name for name in names
+                if [row[1] for row in connection.execute('PRAGMA table_info(`%s`)' % name)] == columns]
+    finally:
+        connection.close()
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) <= 1:
+        print('Please specify a database litesqlize wrote (and optionally an interval of checkpoints in seconds)')
+        exit(1)
+
+    url = sys.argv[1]
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_INTERVAL
+
+    store = CheckpointStore(checkpoint_path(url))
+    try:
+        for table_name in board_tables(url):
+            source = BoardTableSource(url, table_name)
+            count = build_checkpoints(store, table_name, float, source, interval=int(interval * 1000000))
+            source.close()
+            logger.info('Stored %d checkpoints for %s' % (count, table_name))
+    finally:
+        store.close()
@@ -0,0 +1,48 @@
+import sys
+import logging
+from contextlib import closing
+
+from reader.blocks import open_reader
+import database.columnar as columnar
+from litesqlize import Listener, find_files
+
+
+
+# Set format for logger
+logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s', level=logging.INFO)
+# Initialize logger
+logger = logging.getLogger('Main')
+
+
+
+# Process dump files in order and write tables as columns into a directory, returns False if a file ended unexpectedly
+def export(paths: list, directory: str):
+    with columnar.open_columns(directory) as db:
+        for path in paths:
+            reader = open_reader(path)
+            with closing(reader.file):
+                logger.info('Processing lines from file %s...' % path)
+                # Same listener as litesqlize, ColumnarWriter takes the same calls as DatabaseWrtier
+                reader.setup(Listener(db, reader))
+                try:
+                    while reader.next_line():
+                        pass
+                except EOFError as e:
+                    logger.exception('Reached EOF before explicit file terminal %s:\n%s' % (path, e))
+                    return False
+    return True
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) <= 2:
+        print('Please specify file, directory or glob pattern to process, and a directory to write columns to')
+        exit(1)
+
+    paths = find_files(sys.argv[1])
+    if len(paths) == 0:
+        logger.error('No file to process')
+        exit(1)
+
+    if not export(paths, sys.argv[2]):
+        exit(1)
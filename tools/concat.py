@@ -1,22 +1,45 @@
-import gzip
-import logging
-import os
 import sys
+import logging
+
+import reader.compression as compression
+from reader.merge import write_merged
+from litesqlize import find_files
+
+
+
+# Set format for logger
+logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s', level=logging.INFO)
+# Initialize logger
+logger = logging.getLogger('Main')
+
+
+
+# Write lines of dump files (of any exchanges and shards) into one merged stream in time order
+# Each line is tagged with its file, and heads of files are in a table at the beginning, so that
+# reader.merge.read_merged gives events of all files with the protocol of each file
+def concat(paths: list, output):
+    return write_merged(paths, output)
+
+
 
 if __name__ == '__main__':
-    if len(sys.argv) <= 2:
-        print('Please specify directory to process and output directory.')
+    if len(sys.argv) <= 1:
+        print('Please specify file, directory or glob pattern to merge, and optionally a file to write'
+              ' (standard output if omitted, compressed as its extension says)')
+        exit(1)
+
+    paths = find_files(sys.argv[1])
+    if len(paths) == 0:
+        logger.error('No file to process')
         exit(1)
 
-    logger = logging.getLogger('Main')
-
-    files = os.listdir(sys.argv[1])
-    files.sort()
-    for file in files:
-        path = os.path.join(sys.argv[1], file)
-        fo = gzip.open(path, 'rt')
-        try:
-            for line in fo:
-                print(line)
-        except EOFError as e:
-            logger.exception('Unexpected EOF\n %s' % e)
+    if len(sys.argv) > 2:
+        # Output does not exist yet, so only its extension tells a compression method
+        method = next((method for method in compression.COMPRESSIONS
+                       if method.extension != '' and sys.argv[2].endswith(method.extension)),
+                      compression.COMPRESSION_BY_NAME['none'])
+        with compression.open_dump(sys.argv[2], 'wt', method.name) as output:
+            count = concat(paths, output)
+    else:
+        count = concat(paths, sys.stdout)
+    logger.info('Merged %d lines of %d files' % (count, len(paths)))
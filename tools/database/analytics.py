@@ -0,0 +1,281 @@
+import sqlite3
+
+import numpy as np
+
+from .database import BoardRecordType
+
+# Samples are processed in blocks of this many, which bounds memory for a range of any length
+BLOCK_SIZE = 1 << 16
+
+# Record type values of each side, (insert, set, clears affecting the side)
+_BUY_TYPES = (BoardRecordType.INSERT_BUY.value, BoardRecordType.SET_BUY.value,
+              (BoardRecordType.CLEAR_ALL.value, BoardRecordType.CLEAR_BUYS.value))
+_SELL_TYPES = (BoardRecordType.INSERT_SELL.value, BoardRecordType.SET_SELL.value,
+               (BoardRecordType.CLEAR_ALL.value, BoardRecordType.CLEAR_SELLS.value))
+
+
+
+class BoardRecords(object):
+    # Records of a board table as arrays, timestamps in microseconds, NULL prices and sizes are NaN
+    def __init__(self, timestamps, types, prices, sizes):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.types = np.asarray(types, dtype=np.uint8)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.sizes = np.asarray(sizes, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @staticmethod
+    def from_columns(columns: dict):
+        # Columns columnar.read_table returned, arrays are wrapped without copying
+        return BoardRecords(*[np.frombuffer(columns[name], dtype=columns[name].typecode)
+                              for name in ['timestamp', 'type', 'price', 'size']])
+
+def load_board_table(url: str, table_name: str, begin: int = None, end: int = None) -> BoardRecords:
+    # Records of a board table before end, starting from the last CLEAR_ALL at or before begin so that
+    # the board is complete at begin
+    connection = sqlite3.connect(url)
+    try:
+        first = 0
+        if begin is not None:
+            row = connection.execute('SELECT MAX(rowid) FROM `%s` WHERE type = ? AND timestamp <= ?' % table_name,
+                                     (BoardRecordType.CLEAR_ALL.value, begin)).fetchone()
+            first = row[0] - 1 if row[0] is not None else 0
+        rows = connection.execute('SELECT timestamp, type, price, size FROM `%s` WHERE rowid > ? AND timestamp < ? '
+                                  'ORDER BY rowid' % table_name,
+                                  (first, end if end is not None else 2 ** 63 - 1)).fetchall()
+    finally:
+        connection.close()
+    if len(rows) == 0:
+        return BoardRecords([], [], [], [])
+    # Timestamps in microseconds are exact in float64, NULL becomes NaN
+    array = np.array(rows, dtype=np.float64)
+    return BoardRecords(array[:, 0], array[:, 1], array[:, 2], array[:, 3])
+
+
+class BoardSeries(object):
+    # Top levels of a board at sample times, prices are NaN and sizes are 0 where a side has fewer levels
+    # Column k of prices/sizes is the (k + 1)-th best level
+    def __init__(self, time, positions, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        self.time = time
+        # Position of the last record applied at each sample, -1 if none
+        self.positions = positions
+        self.bid_prices = bid_prices
+        self.bid_sizes = bid_sizes
+        self.ask_prices = ask_prices
+        self.ask_sizes = ask_sizes
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def best_bid(self):
+        return self.bid_prices[:, 0]
+
+    @property
+    def best_bid_size(self):
+        return self.bid_sizes[:, 0]
+
+    @property
+    def best_ask(self):
+        return self.ask_prices[:, 0]
+
+    @property
+    def best_ask_size(self):
+        return self.ask_sizes[:, 0]
+
+    @property
+    def spread(self):
+        return self.best_ask - self.best_bid
+
+    @property
+    def mid(self):
+        return (self.best_ask + self.best_bid) / 2
+
+    def bid_depth(self, levels: int):
+        # Total size of the best "levels" buy levels
+        return self.bid_sizes[:, :levels].sum(axis=1)
+
+    def ask_depth(self, levels: int):
+        return self.ask_sizes[:, :levels].sum(axis=1)
+
+
+
+def _segmented_cumsum(values, starts):
+    # Cumulative sum restarting at each True in starts (starts[0] must be True)
+    sums = np.cumsum(values)
+    bases = (sums - values)[starts]
+    result = sums - bases[np.cumsum(starts) - 1]
+    # Exact for segments of one record, as almost all of them are
+    result[starts] = values[starts]
+    return result
+
+def _level_values(ranks, is_set, amounts, epochs):
+    # Amount of a level after each record on it, records sorted by (rank, position)
+    # Amounts restart at a set, at a clear of the side (a new epoch), and at a new level
+    starts = np.ones(len(ranks), dtype=bool)
+    starts[1:] = (ranks[1:] != ranks[:-1]) | (epochs[1:] != epochs[:-1])
+    starts |= is_set
+    values = np.where(is_set, np.maximum(amounts, 0), amounts)
+    while True:
+        levels = _segmented_cumsum(values, starts)
+        # Insert making a level 0 or less removes it, following inserts start from 0 as Board does
+        removed = ~is_set & (levels <= 0) & (amounts < 0)
+        restarts = np.zeros(len(ranks), dtype=bool)
+        restarts[1:] = removed[:-1] & ~starts[1:]
+        if not restarts.any():
+            return levels
+        starts |= restarts
+
+def _node_pairs(begins, ends, values, size: int):
+    # Decompose intervals [begin, end) of leaves into nodes of a segment tree with "size" leaves, all at once
+    # Returns (node, value of the interval) pairs
+    nodes = []
+    node_values = []
+    low = begins + size
+    high = ends + size
+    while len(low) > 0:
+        take = low & 1 == 1
+        nodes.append(low[take])
+        node_values.append(values[take])
+        low += take
+        take = high & 1 == 1
+        high -= take
+        nodes.append(high[take])
+        node_values.append(values[take])
+        low >>= 1
+        high >>= 1
+        # Intervals done are dropped
+        active = low < high
+        if not active.all():
+            low = low[active]
+            high = high[active]
+            values = values[active]
+    return np.concatenate(nodes), np.concatenate(node_values)
+
+def _top_values(begins, ends, values, size: int, levels: int):
+    # For each leaf, the "levels" highest values of intervals containing it in descending order (-1 if fewer)
+    nodes, node_values = _node_pairs(begins, ends, values, size)
+    # Take the best value of each node one by one, most nodes have only one
+    columns = []
+    for slot in range(levels):
+        best = np.full(2 * size, -1, dtype=np.int64)
+        np.maximum.at(best, nodes, node_values)
+        columns.append(best)
+        rest = node_values != best[nodes]
+        nodes = nodes[rest]
+        node_values = node_values[rest]
+        if len(nodes) == 0:
+            break
+    table = np.full((2 * size, levels), -1, dtype=np.int64)
+    table[:, :len(columns)] = np.stack(columns, axis=1)
+
+    # A leaf is covered by intervals assigned to its ancestors, push the best values down level by level
+    depth_begin = 2
+    while depth_begin < 2 * size:
+        children = table[depth_begin:2 * depth_begin]
+        parents = np.repeat(table[depth_begin // 2:depth_begin], 2, axis=0)
+        if levels == 1:
+            np.maximum(children, parents, out=children)
+        else:
+            # Nodes with no interval of their own just take values of their parents
+            own = np.flatnonzero(children[:, 0] >= 0)
+            merged = np.concatenate([children[own], parents[own]], axis=1)
+            children[:] = parents
+            children[own] = np.partition(merged, levels, axis=1)[:, levels:]
+        depth_begin *= 2
+    if levels == 1:
+        return table[size:]
+    return np.sort(table[size:], axis=1)[:, ::-1]
+
+def _side_levels(records: BoardRecords, side_types: tuple, ascending: bool, samples, levels: int):
+    # Prices and sizes of the best levels of one side after records at sample positions (sorted)
+    insert_type, set_type, clear_types = side_types
+    types = records.types
+    count = len(records)
+    prices = np.full((len(samples), levels), np.nan)
+    sizes = np.zeros((len(samples), levels))
+
+    positions = np.flatnonzero((types == insert_type) | (types == set_type))
+    if len(positions) == 0:
+        return prices, sizes
+    # Records on one level are put together in position order
+    order = np.argsort(records.prices[positions], kind='stable')
+    positions = positions[order]
+    sorted_prices = records.prices[positions]
+    same_level = sorted_prices[1:] == sorted_prices[:-1]
+    level_ids = np.r_[0, np.cumsum(~same_level)]
+    level_prices = sorted_prices[np.r_[True, ~same_level]]
+    # Higher rank is better, the highest price for buys and the lowest for sells
+    ranks = len(level_prices) - 1 - level_ids if ascending else level_ids
+
+    # Number of clears at or before each position, which is also the index of the next clear after it
+    is_clear = np.isin(types, clear_types)
+    clears = np.flatnonzero(is_clear)
+    clears_before = np.cumsum(is_clear)[positions]
+    values = _level_values(ranks, types[positions] == set_type, records.sizes[positions], clears_before)
+
+    # A level keeps a value until the next record on it, or the next clear of the side
+    ends = np.full(len(positions), count, dtype=np.int64)
+    ends[:-1][same_level] = positions[1:][same_level]
+    cleared = clears_before < len(clears)
+    ends[cleared] = np.minimum(ends[cleared], clears[clears_before[cleared]])
+
+    # Only samples matter, so an interval becomes a range of samples, and one between samples is dropped
+    samples_before = np.searchsorted(samples, np.arange(count + 1))
+    sample_begins = samples_before[positions]
+    sample_ends = samples_before[ends]
+    present = np.flatnonzero((values > 0) & (sample_begins < sample_ends))
+    by_begin = present[np.argsort(sample_begins[present], kind='stable')]
+    begins_sorted = sample_begins[by_begin]
+    # Intervals are ordered by rank, and the record of an interval is found from the same number
+    encoded = ranks * len(positions) + np.arange(len(positions))
+
+    carried = np.zeros(0, dtype=np.int64)
+    for block_begin in range(0, len(samples), BLOCK_SIZE):
+        block_end = min(block_begin + BLOCK_SIZE, len(samples))
+        first, last = np.searchsorted(begins_sorted, [block_begin, block_end])
+        intervals = np.concatenate([carried, by_begin[first:last]])
+        intervals = intervals[sample_ends[intervals] > block_begin]
+        carried = intervals[sample_ends[intervals] > block_end]
+        if len(intervals) == 0:
+            continue
+
+        size = 1 << (block_end - block_begin - 1).bit_length()
+        top = _top_values(np.maximum(sample_begins[intervals], block_begin) - block_begin,
+                          np.minimum(sample_ends[intervals], block_end) - block_begin,
+                          encoded[intervals], size, levels)[:block_end - block_begin]
+        rows, columns = np.nonzero(top >= 0)
+        found = top[rows, columns] % len(positions)
+        rows += block_begin
+        prices[rows, columns] = level_prices[level_ids[found]]
+        sizes[rows, columns] = values[found]
+    return prices, sizes
+
+def board_series(records: BoardRecords, levels: int = 1, times=None, interval: int = None) -> BoardSeries:
+    # Replay records in vectorized passes, and take the best "levels" levels of each side
+    # Samples are after the last record of each timestamp by default, or at given times,
+    # or every "interval" microseconds from the first record
+    timestamps = records.timestamps
+    if times is None and interval is not None and len(timestamps) > 0:
+        first = -(-timestamps[0] // interval) * interval
+        times = np.arange(first, timestamps[-1] + 1, interval, dtype=np.int64)
+    if times is None:
+        samples = np.flatnonzero(np.r_[timestamps[1:] != timestamps[:-1], True]) if len(timestamps) > 0 \
+            else np.zeros(0, dtype=np.int64)
+        times = timestamps[samples]
+    else:
+        times = np.asarray(times, dtype=np.int64)
+        samples = np.searchsorted(timestamps, times, 'right') - 1
+
+    # Sides are computed for samples in position order
+    order = np.argsort(samples, kind='stable')
+    sorted_samples = samples[order]
+    results = []
+    for side_types, ascending in [(_BUY_TYPES, False), (_SELL_TYPES, True)]:
+        prices, sizes = _side_levels(records, side_types, ascending, sorted_samples, levels)
+        prices[order] = prices.copy()
+        sizes[order] = sizes.copy()
+        results.extend([prices, sizes])
+    return BoardSeries(times, samples, *results)
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import zlib
+import math
+import datetime
+import logging
+from array import array
+from bisect import bisect_left
+from enum import Enum
+
+from .database import _adapt_datetime
+
+_logger = logging.getLogger('Columnar')
+
+# A table is a directory having a manifest and column chunks, each chunk of a column is a zlib compressed
+# array of fixed size values, "<chunk number>.<column name>.zz"
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 0
+CHUNK_FILE_FORMAT = '%06d.%s.zz'
+
+# SQL type in table definitions of database vs array typecode of a column
+# Timestamps are int64 microseconds, board record types are uint8, prices and sizes are float64 (NULL is NaN)
+SQL_TYPECODES = [
+    ('INTEGER(3)', 'B'),
+    ('INTEGER', 'q'),
+    ('REAL', 'd'),
+]
+
+def _typecode(sql_type: str) -> str:
+    for prefix, typecode in SQL_TYPECODES:
+        if sql_type.startswith(prefix):
+            return typecode
+    raise ValueError('Column type %s can not be stored in columns' % sql_type)
+
+def _adapt_integer(value):
+    # Same values as sqlite3 adapters in database give
+    if isinstance(value, datetime.datetime):
+        return _adapt_datetime(value)
+    elif isinstance(value, Enum):
+        return value.value
+    return value
+
+def _adapt_real(value):
+    return math.nan if value is None else value
+
+_ADAPTERS = {
+    'B': _adapt_integer,
+    'q': _adapt_integer,
+    'd': _adapt_real,
+}
+
+
+
+class _Table(object):
+    def __init__(self, path: str, columns: list, chunks: list):
+        self.path = path
+        # List of (column name, typecode)
+        self.columns = columns
+        # List of chunk information in the manifest
+        self.chunks = chunks
+        self.arrays = [array(typecode) for name, typecode in columns]
+        self.appends = [column.append for column in self.arrays]
+        self.adapters = [_ADAPTERS[typecode] for name, typecode in columns]
+
+    def write_manifest(self):
+        manifest = dict(version=MANIFEST_VERSION, byteorder=sys.byteorder, columns=self.columns, chunks=self.chunks)
+        temp_path = os.path.join(self.path, MANIFEST_NAME + '.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(manifest, file)
+        # Readers never see a manifest naming a chunk not written yet
+        os.replace(temp_path, os.path.join(self.path, MANIFEST_NAME))
+
+
+class ColumnarWriter(object):
+    # Same interface as DatabaseWrtier, so that a listener writing to a database can write columns instead
+    # Rows of a table are kept in typed arrays and written as one chunk when this many rows are buffered
+    DEFAULT_CHUNK_ROWS = 1000000
+    DEFAULT_LEVEL = 6
+
+    def __init__(self, chunk_rows: int = DEFAULT_CHUNK_ROWS, level: int = DEFAULT_LEVEL):
+        self._directory = None
+        self._chunk_rows = chunk_rows
+        self._level = level
+        # Table name vs _Table
+        self._tables = {}
+
+    def open(self, directory: str):
+        if self._directory is not None:
+            raise RuntimeError('Directory not closed')
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+
+    def close(self):
+        self.commit()
+        self._tables = {}
+        self._directory = None
+
+    def create_table_if_not_exists(self, table_name: str, tdef: dict):
+        if table_name in self._tables:
+            return
+        path = os.path.join(self._directory, table_name)
+        columns = [[name, _typecode(sql_type)] for name, sql_type in tdef.items()]
+        chunks = []
+        if os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            # Append to an existing table
+            manifest = read_manifest(self._directory, table_name)
+            if manifest['columns'] != columns:
+                raise ValueError('Table %s exists with different columns' % table_name)
+            chunks = manifest['chunks']
+        else:
+            os.makedirs(path, exist_ok=True)
+        self._tables[table_name] = _Table(path, columns, chunks)
+
+    def insert(self, table_name: str, data: dict):
+        self.insert_row(table_name, tuple(data.values()))
+
+    def insert_row(self, table_name: str, row: tuple):
+        table = self._tables[table_name]
+        for append, adapt, value in zip(table.appends, table.adapters, row):
+            append(adapt(value))
+        if len(table.arrays[0]) >= self._chunk_rows:
+            self._write_chunk(table)
+
+    def insert_rows(self, table_name: str, rows: list):
+        if len(rows) == 0:
+            return
+        table = self._tables[table_name]
+        for column, adapt, values in zip(table.arrays, table.adapters, zip(*rows)):
+            column.extend(map(adapt, values))
+        if len(table.arrays[0]) >= self._chunk_rows:
+            self._write_chunk(table)
+
+    def _write_chunk(self, table: _Table):
+        rows = len(table.arrays[0])
+        if rows == 0:
+            return
+        number = len(table.chunks)
+        chunk = dict(rows=rows)
+        if table.columns[0][0] == 'timestamp':
+            # Readers skip chunks out of a time range without decompressing them
+            chunk.update(min_timestamp=min(table.arrays[0]), max_timestamp=max(table.arrays[0]))
+        for (name, typecode), column in zip(table.columns, table.arrays):
+            with open(os.path.join(table.path, CHUNK_FILE_FORMAT % (number, name)), 'wb') as file:
+                file.write(zlib.compress(column.tobytes(), self._level))
+            del column[:]
+        table.chunks.append(chunk)
+        table.write_manifest()
+
+    def flush(self):
+        # Rows are written in chunks, partial chunks are written only on commit
+        pass
+
+    def checkpoint(self):
+        return False
+
+    def commit(self):
+        for table in self._tables.values():
+            self._write_chunk(table)
+
+class open_columns():
+    def __init__(self, directory: str, **kwargs):
+        self._db = ColumnarWriter(**kwargs)
+        self._directory = directory
+
+    def __enter__(self):
+        self._db.open(self._directory)
+        return self._db
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._db.close()
+
+
+
+def read_manifest(directory: str, table_name: str) -> dict:
+    with open(os.path.join(directory, table_name, MANIFEST_NAME), 'r') as file:
+        manifest = json.load(file)
+    if manifest['version'] != MANIFEST_VERSION:
+        raise ValueError('Manifest version %d is not supported' % manifest['version'])
+    return manifest
+
+def read_chunk(path: str, column: list, number: int, byteorder: str) -> array:
+    name, typecode = column
+    values = array(typecode)
+    with open(os.path.join(path, CHUNK_FILE_FORMAT % (number, name)), 'rb') as file:
+        values.frombytes(zlib.decompress(file.read()))
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return values
+
+def list_tables(directory: str) -> list:
+    return sorted(name for name in os.listdir(directory) if os.path.exists(os.path.join(directory, name, MANIFEST_NAME)))
+
+def read_table(directory: str, table_name: str, columns: list = None, begin: int = None, end: int = None) -> dict:
+    # Read columns of a table into column name vs array, rows can be limited to timestamps in [begin, end)
+    # Arrays can be wrapped without copying, e.g. numpy.frombuffer(values, dtype=values.typecode)
+    manifest = read_manifest(directory, table_name)
+    path = os.path.join(directory, table_name)
+    table_columns = manifest['columns']
+    if columns is not None:
+        table_columns = [column for column in table_columns if column[0] in columns]
+    result = {name: array(typecode) for name, typecode in table_columns}
+    timestamp_column = manifest['columns'][0] if manifest['columns'][0][0] == 'timestamp' else None
+    if (begin is not None or end is not None) and timestamp_column is None:
+        raise ValueError('Table %s has no timestamp column' % table_name)
+
+    for number, chunk in enumerate(manifest['chunks']):
+        start = 0
+        stop = chunk['rows']
+        timestamps = None
+        if timestamp_column is not None and (begin is not None or end is not None):
+            if (begin is not None and chunk['max_timestamp'] < begin) or (end is not None and chunk['min_timestamp'] >= end):
+                continue
+            # Rows are in time order
+            timestamps = read_chunk(path, timestamp_column, number, manifest['byteorder'])
+            if begin is not None:
+                start = bisect_left(timestamps, begin)
+            if end is not None:
+                stop = bisect_left(timestamps, end)
+        for column in table_columns:
+            if column[0] == 'timestamp' and timestamps is not None:
+                values = timestamps
+            else:
+                values = read_chunk(path, column, number, manifest['byteorder'])
+            result[column[0]].extend(values if start == 0 and stop == chunk['rows'] else values[start:stop])
+    return result
@@ -1,8 +1,12 @@
+import os
 import sqlite3
 import datetime
 import time
+import logging
 from enum import Enum
 
+_logger = logging.getLogger('Database')
+
 # Table definition for common data
 DEF_TICKER_TABLE = dict(
     timestamp='INTEGER NOT NULL',
@@ -24,6 +28,45 @@ DEF_BOARD_TABLE = dict(
     size='REAL'
 )
 
+DEF_EXECUTION_TABLE = dict(
+    timestamp='INTEGER NOT NULL',
+    id='INTEGER NOT NULL',
+    side='INTEGER(3) NOT NULL',
+    price='REAL NOT NULL',
+    size='REAL NOT NULL',
+    exec_date='INTEGER NOT NULL',
+)
+
+# PRAGMAs of a profile, run when a database is opened for writing and when it is closed
+# bulk is for loading rows at once: WAL with synchronous = NORMAL does not sync at each commit, and a crash (even of
+# the system) loses only the last commits without corrupting a database, large caches and mmap save reads of pages
+# A database is turned back to a rollback journal when it is closed, so that it is a single file to read or copy
+SQLITE_PROFILES = {
+    'default': dict(open=[], close=[]),
+    'bulk': dict(
+        open=[
+            # Page size takes effect only on a new database, and before it is in WAL mode
+            'PRAGMA page_size = 65536',
+            'PRAGMA journal_mode = WAL',
+            'PRAGMA synchronous = NORMAL',
+            # 256MB, a negative size is in KiB
+            'PRAGMA cache_size = -262144',
+            'PRAGMA mmap_size = 1073741824',
+            'PRAGMA temp_store = MEMORY',
+        ],
+        close=[
+            'PRAGMA journal_mode = DELETE',
+        ]),
+}
+
+# Indexes made after loading as (name suffix, columns), on each table having all of the columns
+# Board tables are read by a range of rowid, and a range of timestamp needs an index
+# The last CLEAR_ALL before a time (load_board_table) is found in entries of its type
+POST_LOAD_INDEXES = [
+    ('timestamp', ('timestamp', )),
+    ('type_timestamp', ('type', 'timestamp')),
+]
+
 class BoardRecordType(Enum):
     CLEAR_ALL = 0
     CLEAR_SELLS = 1
@@ -33,51 +76,213 @@ class BoardRecordType(Enum):
     SET_SELL = 5
     SET_BUY = 6
 
+# Side of a taker of an execution
+class ExecutionSide(Enum):
+    BUY = 0
+    SELL = 1
+    UNKNOWN = 2
+
+# Source file of a database, all of its lines are written once it is DONE
+class FileState(Enum):
+    PARTIAL = 0
+    DONE = 1
+
+# Table recording progress of each source file, updated in the same transaction as rows from the file
+LEDGER_TABLE = 'ingested_files'
+DEF_LEDGER_TABLE = dict(
+    path='TEXT PRIMARY KEY',
+    size='INTEGER NOT NULL',
+    hash='TEXT NOT NULL',
+    hashed='INTEGER NOT NULL',
+    line='INTEGER NOT NULL',
+    state='INTEGER(3) NOT NULL',
+    updated='INTEGER NOT NULL',
+)
+
 def _adapt_board_record_type(type: BoardRecordType):
     return type.value
 
 sqlite3.register_adapter(BoardRecordType, _adapt_board_record_type)
+sqlite3.register_adapter(ExecutionSide, _adapt_board_record_type)
+sqlite3.register_adapter(FileState, _adapt_board_record_type)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
 
 def _adapt_datetime(dt: datetime.datetime):
     # [unix epch time] * 1000000 + microsecond
-    return int(dt.timestamp()) * 1000000 + dt.microsecond
+    # Naive datetime is regarded as UTC regardless of local time zone, as reader and structures.Board do
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // datetime.timedelta(microseconds=1)
 
 # For every input with datetime class, it will be converted using this function
 # datetime -> int
 sqlite3.register_adapter(datetime.datetime, _adapt_datetime)
 
+def _row_size(row: tuple):
+    # Rough estimation of memory a row takes, numbers are counted as 8 bytes
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
 class DatabaseWrtier(object):
-    def __init__(self):
+    # Rows are kept in memory and written with executemany when one of these thresholds is reached
+    DEFAULT_BATCH_ROWS = 10000
+    DEFAULT_BATCH_BYTES = 4 * 1024 * 1024
+    # Transaction is committed at a checkpoint when this many rows are written since last commit
+    DEFAULT_COMMIT_ROWS = 1000000
+
+    def __init__(self, batch_rows: int = DEFAULT_BATCH_ROWS, batch_bytes: int = DEFAULT_BATCH_BYTES,
+                 commit_rows: int = DEFAULT_COMMIT_ROWS, profile: str = 'default'):
+        if profile not in SQLITE_PROFILES:
+            raise ValueError('Unknown profile %s' % profile)
         self._connection = None
+        self._profile = SQLITE_PROFILES[profile]
         self._url = None
+        self._batch_rows = batch_rows
+        self._batch_bytes = batch_bytes
+        self._commit_rows = commit_rows
+        # Table name vs list of rows waiting to be written
+        self._buffers = {}
+        # Table name vs INSERT statement text for it
+        self._statements = {}
+        # Number of rows and approximate bytes in all buffers
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+        # Number of rows written since last commit
+        self._uncommitted_rows = 0
+        # Called before each commit, to write something which has to be committed with rows (e.g. a FileLedger)
+        self.before_commit = None
 
     def open(self, url: str):
         if self._connection is not None:
             raise RuntimeError('Database not closed')
         self._url = url
         self._connection = sqlite3.connect(url)
+        for pragma in self._profile['open']:
+            self._connection.execute(pragma)
 
     def close(self):
+        # Journal mode cannot be changed in a transaction, which is rolled back by closing
+        if not self._connection.in_transaction:
+            for pragma in self._profile['close']:
+                self._connection.execute(pragma)
         self._connection.close()
+        self._connection = None
 
     # tdef is table defnition
     def create_table_if_not_exists(self, table_name: str, tdef: dict):
         dt = ','.join(['`%s` %s' % (key, val) for key, val in tdef.items()])
         self._connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (table_name, dt))
-        
+
+    def execute(self, sql: str, parameters: tuple = ()):
+        return self._connection.execute(sql, parameters)
+
     def insert(self, table_name: str, data: dict):
-        self._connection.execute('INSERT INTO %s VALUES(%s)' % (table_name, ','.join(['?' for i in range(len(data))])), tuple(data.values()))
+        self.insert_row(table_name, tuple(data.values()))
+
+    def insert_row(self, table_name: str, row: tuple):
+        buffer = self._buffers.get(table_name)
+        if buffer is None:
+            buffer = self._buffers[table_name] = []
+            # Prepare statement text once for each table
+            self._statements[table_name] = 'INSERT INTO %s VALUES(%s)' % (table_name, ','.join('?' * len(row)))
+        buffer.append(row)
+
+        self._buffered_rows += 1
+        self._buffered_bytes += _row_size(row)
+        if self._buffered_rows >= self._batch_rows or self._buffered_bytes >= self._batch_bytes:
+            self.flush()
+
+    def insert_rows(self, table_name: str, rows: list):
+        # Rows of the same shape at once
+        if len(rows) == 0:
+            return
+        buffer = self._buffers.get(table_name)
+        if buffer is None:
+            buffer = self._buffers[table_name] = []
+            self._statements[table_name] = 'INSERT INTO %s VALUES(%s)' % (table_name, ','.join('?' * len(rows[0])))
+        buffer.extend(rows)
+
+        self._buffered_rows += len(rows)
+        self._buffered_bytes += _row_size(rows[0]) * len(rows)
+        if self._buffered_rows >= self._batch_rows or self._buffered_bytes >= self._batch_bytes:
+            self.flush()
+
+    def flush(self):
+        # Write all buffered rows, grouped by table
+        for table_name, buffer in self._buffers.items():
+            if len(buffer) == 0:
+                continue
+            self._connection.executemany(self._statements[table_name], buffer)
+            self._uncommitted_rows += len(buffer)
+            buffer.clear()
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+
+    def checkpoint(self):
+        # Commit if enough rows are written since last commit, call this where data is consistent
+        if self._uncommitted_rows + self._buffered_rows >= self._commit_rows:
+            self.commit()
+            return True
+        return False
 
     def commit(self):
+        self.flush()
+        if self.before_commit is not None:
+            self.before_commit()
         self._connection.commit()
+        self._uncommitted_rows = 0
 
     def __del__(self):
         if self._connection is not None:
             self._connection.close()
 
+class FileLedger(object):
+    # Progress of a source file in the ledger table of a database, line is the number of lines written
+    # hash is of the first hashed bytes of a file, a file being written grows, so a later run hashes as many bytes to
+    # tell if it is the same file
+    # It is written at every commit of the database, so that rows and progress are always committed together
+    def __init__(self, db: DatabaseWrtier, path: str, size: int):
+        self._db = db
+        self.path = path
+        self.size = size
+        db.create_table_if_not_exists(LEDGER_TABLE, DEF_LEDGER_TABLE)
+        row = db.execute('SELECT hash, hashed, line, state FROM `%s` WHERE path = ?' % LEDGER_TABLE,
+                         (path, )).fetchone()
+        # Hash an earlier run recorded, None if the file is new
+        self.hash = row[0] if row is not None else None
+        self.hashed = row[1] if row is not None else 0
+        self.line = row[2] if row is not None else 0
+        self.state = FileState(row[3]) if row is not None else FileState.PARTIAL
+        db.before_commit = self.write
+
+    def write(self):
+        self._db.execute('INSERT OR REPLACE INTO `%s` VALUES(?,?,?,?,?,?,?)' % LEDGER_TABLE,
+                         (self.path, self.size, self.hash, self.hashed, self.line, self.state,
+                          int(time.time() * 1000000)))
+
+def read_ledger(url: str) -> dict:
+    # Path vs (size, hash, line, state) of source files of a database, empty if nothing is written yet
+    if not os.path.exists(url):
+        return {}
+    connection = sqlite3.connect(url)
+    try:
+        if connection.execute('SELECT 1 FROM sqlite_master WHERE type = \'table\' AND name = ?',
+                              (LEDGER_TABLE, )).fetchone() is None:
+            return {}
+        return {path: (size, hash, line, FileState(state)) for path, size, hash, line, state
+                in connection.execute('SELECT path, size, hash, line, state FROM `%s`' % LEDGER_TABLE)}
+    finally:
+        connection.close()
+
 class open():
-    def __init__(self, url: str):
-        self._db = DatabaseWrtier()
+    def __init__(self, url: str, **kwargs):
+        self._db = DatabaseWrtier(**kwargs)
         self._url = url
 
     def __enter__(self):
@@ -85,4 +290,97 @@ class open():
         return self._db
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._db.close()
\ No newline at end of file
+        self._db.close()
+
+
+# Source of records in a board table for structures.Board, position of a record is its rowid
+class BoardTableSource(object):
+    def __init__(self, url: str, table_name: str):
+        self._connection = sqlite3.connect(url)
+        self._table_name = table_name
+
+    def records(self, after: int = None):
+        # Rows are inserted in time order, so rowid order is time order
+        return self._connection.execute('SELECT rowid, timestamp, type, price, size FROM `%s` WHERE rowid > ? ORDER BY rowid'
+                                        % self._table_name, (0 if after is None else after, ))
+
+    def close(self):
+        self._connection.close()
+
+def _table_columns(connection: sqlite3.Connection, schema: str, table_name: str):
+    return [row[1] for row in connection.execute('PRAGMA %s.table_info(`%s`)' % (schema, table_name))]
+
+# Append all tables in shard databases into a database at url in time order
+# Shards must be given in the order of their source files, rows having the same timestamp keep the order of shards
+# and the order they were inserted in a shard
+def merge_databases(url: str, shard_urls: list, profile: str = 'default'):
+    connection = sqlite3.connect(url)
+    for pragma in SQLITE_PROFILES[profile]['open']:
+        connection.execute(pragma)
+    try:
+        # Table name vs list of (shard index, min timestamp, max timestamp)
+        ranges = {}
+        for index, shard_url in enumerate(shard_urls):
+            connection.execute('ATTACH DATABASE ? AS shard', (shard_url, ))
+            for table_name, sql in connection.execute('SELECT name, sql FROM shard.sqlite_master WHERE type = \'table\'').fetchall():
+                # Create the same table in the destination
+                connection.execute(sql.replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+                if table_name == LEDGER_TABLE:
+                    # Progress of files, not rows in time order
+                    connection.execute('INSERT OR REPLACE INTO main.`%s` SELECT * FROM shard.`%s`' % (table_name, table_name))
+                    connection.commit()
+                    continue
+                min_time, max_time = connection.execute('SELECT MIN(timestamp), MAX(timestamp) FROM shard.`%s`' % table_name).fetchone()
+                if min_time is not None:
+                    ranges.setdefault(table_name, []).append((index, min_time, max_time))
+            connection.execute('DETACH DATABASE shard')
+
+        for table_name, table_ranges in ranges.items():
+            columns = ','.join('`%s`' % column for column in _table_columns(connection, 'main', table_name))
+
+            # Usually shards are from files following each other, then rows can be just appended in shard order
+            disjoint = all(table_ranges[i][2] <= table_ranges[i + 1][1] for i in range(len(table_ranges) - 1))
+            if disjoint:
+                for index, min_time, max_time in table_ranges:
+                    connection.execute('ATTACH DATABASE ? AS shard', (shard_urls[index], ))
+                    connection.execute('INSERT INTO main.`%s` SELECT %s FROM shard.`%s` ORDER BY rowid' % (table_name, columns, table_name))
+                    connection.commit()
+                    connection.execute('DETACH DATABASE shard')
+                continue
+
+            # Otherwise stage all rows with shard index and row order, then sort them at once
+            _logger.info('Shards overlap in time for table %s, sorting rows' % table_name)
+            connection.execute('CREATE TEMP TABLE `_merge` AS SELECT 0 AS `_shard`, 0 AS `_seq`, * FROM main.`%s` WHERE 0' % table_name)
+            for index, min_time, max_time in table_ranges:
+                connection.execute('ATTACH DATABASE ? AS shard', (shard_urls[index], ))
+                connection.execute('INSERT INTO temp.`_merge` SELECT ?, rowid, %s FROM shard.`%s`' % (columns, table_name), (index, ))
+                connection.commit()
+                connection.execute('DETACH DATABASE shard')
+            connection.execute('INSERT INTO main.`%s` SELECT %s FROM temp.`_merge` ORDER BY timestamp, `_shard`, `_seq`' % (table_name, columns))
+            connection.execute('DROP TABLE temp.`_merge`')
+            connection.commit()
+        for pragma in SQLITE_PROFILES[profile]['close']:
+            connection.execute(pragma)
+    finally:
+        connection.close()
+
+# Make indexes of POST_LOAD_INDEXES once all rows are loaded, which is faster than keeping them while inserting
+# Indexes already made are kept, and rows loaded later (e.g. an incremental load) update them
+def create_indexes(url: str, profile: str = 'default'):
+    connection = sqlite3.connect(url)
+    for pragma in SQLITE_PROFILES[profile]['open']:
+        connection.execute(pragma)
+    try:
+        table_names = [row[0] for row in connection.execute('SELECT name FROM sqlite_master WHERE type = \'table\'')]
+        for table_name in table_names:
+            columns = _table_columns(connection, 'main', table_name)
+            for suffix, index_columns in POST_LOAD_INDEXES:
+                if all(column in columns for column in index_columns):
+                    connection.execute('CREATE INDEX IF NOT EXISTS `%s_%s` ON `%s` (%s)'
+                                       % (table_name, suffix, table_name,
+                                          ','.join('`%s`' % column for column in index_columns)))
+            connection.commit()
+        for pragma in SQLITE_PROFILES[profile]['close']:
+            connection.execute(pragma)
+    finally:
+        connection.close()
@@ -0,0 +1,58 @@
+import sys
+import datetime
+import logging
+
+from reader.dump_index import load_index, open_dump_at, line_time
+from reader.line_reader import datetime_to_timestamp, DATETIME_FORMAT_FALLBACK
+from litesqlize import find_files
+
+
+
+# Set format for logger
+logging.basicConfig(format='[%(asctime)s][%(levelname)s] %(message)s', level=logging.INFO)
+# Initialize logger
+logger = logging.getLogger('Main')
+
+# Print lines in a time range instead of only indexing
+OPTION_FROM = '--from='
+OPTION_TO = '--to='
+
+
+
+def parse_time(time_str: str) -> int:
+    return datetime_to_timestamp(datetime.datetime.strptime(time_str, DATETIME_FORMAT_FALLBACK))
+
+def extract(path: str, begin: int, end: int):
+    # Write a head line and lines from begin to end (exclusive) to stdout
+    with open_dump_at(path, time=begin) as file:
+        sys.stdout.write(file.readline())
+        for line in file:
+            if end is not None and line_time(line) >= end:
+                break
+            sys.stdout.write(line)
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) <= 1:
+        print('Please specify file, directory or glob pattern to index'
+              ' (and optionally --from="%%Y-%%m-%%d %%H:%%M:%%S" and --to=... to print lines between them)')
+        exit(1)
+
+    begin = None
+    end = None
+    for option in sys.argv[2:]:
+        if option.startswith(OPTION_FROM):
+            begin = parse_time(option[len(OPTION_FROM):])
+        elif option.startswith(OPTION_TO):
+            end = parse_time(option[len(OPTION_TO):])
+        else:
+            logger.error('Invalid option %s' % option)
+            exit(1)
+
+    for path in find_files(sys.argv[1]):
+        if begin is None and end is None:
+            index = load_index(path)
+            logger.info('%s: %d access points' % (path, len(index.points)))
+        else:
+            extract(path, begin, end)
@@ -1,14 +1,27 @@
+import os
 import sys
+import glob
+import shutil
 import logging
-import gzip
+import tempfile
 import re
+import gzip
+import hashlib
+import time
+import unittest
+from itertools import repeat
 from datetime import datetime
 import sqlite3
 from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
 
 import reader.line_reader
 from reader.line_reader import FileLineReader, InvalidFormatError
 import reader.processor.protocols as protocols
+import reader.compression as compression
+from reader.blocks import open_reader
+from reader.parallel import open_parallel_reader
+from reader.structures import Board
 import database.database as database
 from database.database import DatabaseWrtier
 
@@ -21,36 +34,64 @@ logger = logging.getLogger('Main')
 
 
 
+# Side of a taker in protocols vs in database
+EXECUTION_SIDES = {
+    protocols.TradeType.BID: database.ExecutionSide.BUY,
+    protocols.TradeType.ASK: database.ExecutionSide.SELL,
+    None: database.ExecutionSide.UNKNOWN,
+}
+
+
 class Listener(protocols.Listener):
-    def __init__(self, db: DatabaseWrtier, lr: FileLineReader):
+    def __init__(self, db: DatabaseWrtier, lr: FileLineReader, data_types: set = None):
         self.db = db
         self.lr = lr
+        # Types of data written, all if None, messages of other types are not decoded
+        self.data_types = data_types
+
+    def accepts(self, pair_name: str, data_type: protocols.DataType) -> bool:
+        return self.data_types is None or data_type in self.data_types
 
     def board_start(self, pair_name: str):
         # Create new table
         self.db.create_table_if_not_exists(pair_name, database.DEF_BOARD_TABLE)
 
-    def board_insert(self, pair_name: str, data: dict):
-        data['timestamp'] = self.lr.message_time()
-        data['type'] = database.BoardRecordType.
-        self.db.insert(data.pair_name, data)
+    def board_insert(self, pair_name: str, type: protocols.TradeType, level: protocols.BoardLevel):
+        if type == protocols.TradeType.ASK:
+            record_type = database.BoardRecordType.INSERT_SELL
+        else:
+            record_type = database.BoardRecordType.INSERT_BUY
+        self.db.insert_row(pair_name, (self.lr.message_time, record_type, level.price, level.size))
+
+    def board_insert_batch(self, pair_name: str, type: protocols.TradeType, prices: list, sizes: list):
+        if type == protocols.TradeType.ASK:
+            record_type = database.BoardRecordType.INSERT_SELL
+        else:
+            record_type = database.BoardRecordType.INSERT_BUY
+        self.db.insert_rows(pair_name, list(zip(repeat(self.lr.message_time), repeat(record_type), prices, sizes)))
 
     def board_clear(self, pair_name: str):
         # Complete board snapshot will delete all state in board
-        inst = dict(
-            timestamp=self.lr.message_time(),
-            type=database.BoardRecordType.CLEAR_ALL,
-            price=None,
-            amount=None,
-        )
-        self.db.insert(pair_name, inst)
+        self.db.insert_row(pair_name, (self.lr.message_time, database.BoardRecordType.CLEAR_ALL, None, None))
 
     def ticker_start(self, pair_name: str):
         self.db.create_table_if_not_exists(pair_name, database.DEF_TICKER_TABLE)
 
-    def ticker_insert(self, pair_name: str, data: dict):
+    def ticker_insert(self, pair_name: str, ticker: protocols.Ticker):
         # Insert data
-        self.db.insert(pair_name, data)
+        self.db.insert_row(pair_name, ticker.astuple())
+
+    def execution_start(self, pair_name: str):
+        self.db.create_table_if_not_exists(pair_name, database.DEF_EXECUTION_TABLE)
+
+    def execution_insert(self, pair_name: str, execution: protocols.Execution):
+        self.db.insert_row(pair_name, (self.lr.message_time, execution.id, EXECUTION_SIDES[execution.side],
+                                       execution.price, execution.size, execution.exec_date))
+
+    def execution_insert_batch(self, pair_name: str, executions: list):
+        message_time = self.lr.message_time
+        self.db.insert_rows(pair_name, [(message_time, execution.id, EXECUTION_SIDES[execution.side], execution.price,
+                                         execution.size, execution.exec_date) for execution in executions])
 
     def eos(self):
         # Commit all to database
@@ -58,26 +99,248 @@ class Listener(protocols.Listener):
 
 
 
-if __name__ == '__main__':
-    if len(sys.argv) <= 2:
-        print('Please specify file to process, and a file name of datadase to write the result')
-        exit(1)
+# SQLite profile of databases being written, see database.SQLITE_PROFILES
+PROFILE = 'bulk'
+# Bytes at the beginning of a file hashed to tell if it is the file an earlier run wrote, without reading all of it
+HASH_BYTES = 1024 * 1024
+
 
-    # Open compressed file with gzip with read, text option
-    with gzip.open(sys.argv[1], 'rt') as file:
-        with database.open(sys.argv[2]) as db:
-            logger.info('Opening file...')
-            reader = FileLineReader(file)
-            reader.setup(Listener(db, reader))
+def file_hash(path: str, size: int) -> str:
+    # Hash of the first size bytes, a file shorter than that is hashed as it is
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read(size)).hexdigest()
+
+def ledger_key(path: str) -> str:
+    return os.path.abspath(path)
+
+
+# Process a dump file and write the result to a database, returns False if the file ended unexpectedly
+# Only channels and a time window a filter accepts are written if it is given
+# If a number of workers is given, a file is decompressed and its lines are parsed in that many processes
+# Progress is recorded in the ledger of the database, a file written to its end is skipped, and a file written
+# partially (e.g. a run was killed, or the file was being written) is resumed from the last commit
+def sqlize(path: str, url: str, stream_filter: protocols.StreamFilter = None, workers: int = None):
+    with database.open(url, profile=PROFILE) as db:
+        size = os.path.getsize(path)
+        ledger = database.FileLedger(db, ledger_key(path), size)
+        if ledger.hash is not None and file_hash(path, ledger.hashed) != ledger.hash:
+            # Rows of the file written before cannot be told from others
+            logger.error('File %s is not the one written before, its rows cannot be replaced' % path)
+            return False
+        # First bytes of a file grown since an earlier run are hashed again, up to HASH_BYTES
+        ledger.hashed = min(size, HASH_BYTES)
+        ledger.hash = file_hash(path, ledger.hashed)
+        if ledger.state == database.FileState.DONE:
+            logger.info('Skipping file %s, it is already written' % path)
+            return True
+
+        # Open a text file (compression method is detected from the file) or a block file
+        reader = open_reader(path) if workers is None else open_parallel_reader(path, workers)
+        with closing(reader.file):
+            logger.info('Opening file %s...' % path)
+            reader.setup(Listener(db, reader), stream_filter)
 
-            # Start reading
-            logger.info('Processing lines from file...')
             try:
+                if ledger.line > 0:
+                    # Lines written are processed again only for subscriptions, their data is not decoded
+                    logger.info('Resuming file %s from line %d...' % (path, ledger.line))
+                    if reader.skip_lines(ledger.line) < ledger.line:
+                        raise EOFError('File is shorter than written before')
+
+                # Start reading
+                logger.info('Processing lines from file %s...' % path)
                 while reader.next_line():
-                    pass
+                    ledger.line += 1
+                    # Commit at a message boundary if enough rows are written
+                    db.checkpoint()
             except EOFError as e:
-                logger.exception('Reached EOF before explicit file terminal:\n%s' % e)
-                exit(1)
+                # Rows of whole messages are kept, and the rest is written when the file is processed again
+                db.commit()
+                logger.exception('Reached EOF before explicit file terminal %s:\n%s' % (path, e))
+                return False
+
+        ledger.state = database.FileState.DONE
+        db.commit()
+    return True
+
+
+def _sqlize_shard(args: tuple):
+    path, shard_url = args
+    return sqlize(path, shard_url)
+
+
+# Process files in parallel, each into its own shard database, then merge shards into one database
+# Files already written are skipped, and files written partially are resumed directly in the database first
+def sqlize_files(paths: list, url: str, workers: int = None):
+    ledger = database.read_ledger(url)
+    results = []
+    new_paths = []
+    for path in paths:
+        if ledger_key(path) in ledger:
+            # Skipped or resumed
+            results.append(sqlize(path, url))
+        else:
+            new_paths.append(path)
+    if len(new_paths) == 0:
+        return all(results)
+    paths = new_paths
+
+    shard_directory = tempfile.mkdtemp(prefix='litesqlize.', dir=os.path.dirname(os.path.abspath(url)))
+    try:
+        shard_urls = [os.path.join(shard_directory, '%05d.sqlite' % i) for i in range(len(paths))]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results += executor.map(_sqlize_shard, zip(paths, shard_urls))
+
+        logger.info('Merging %d shards...' % len(shard_urls))
+        database.merge_databases(url, shard_urls, PROFILE)
+    finally:
+        shutil.rmtree(shard_directory)
 
+    return all(results)
 
 
+# Take dump files from a file path, a directory or a glob pattern, in the order of file names (which is time order)
+def find_files(pattern: str):
+    if os.path.isdir(pattern):
+        return sorted(os.path.join(pattern, name) for name in os.listdir(pattern) if compression.is_dump_file(name))
+    if glob.has_magic(pattern):
+        return sorted(glob.glob(pattern))
+    return [pattern]
+
+
+
+class TestSqlize(unittest.TestCase):
+    def _lines(self) -> list:
+        lines = ['head,0,2019-05-01 00:00:00.000000,websocket,0,wss://ws.lightstream.bitflyer.com/json-rpc\n',
+                 'emit,2019-05-01 00:00:00.000000,{"method":"subscribe","params":{"channel":"lightning_board_BTC_JPY"},'
+                 '"id":1}\n',
+                 'msg,2019-05-01 00:00:00.000000,{"jsonrpc":"2.0","id":1,"result":true}\n']
+        for i in range(6000):
+            lines.append('msg,2019-05-01 00:%02d:%02d.%06d,{"jsonrpc":"2.0","method":"channelMessage","params":'
+                         '{"channel":"lightning_board_BTC_JPY","message":{"mid_price":%d,"bids":[{"price":%d,'
+                         '"size":0.1},{"price":%d,"size":0.2}],"asks":[{"price":%d,"size":0.3}]}}}\n'
+                         % (i // 600, i // 10 % 60, i % 10, 500000 + i, 500000 + i, 499000 + i, 501000 + i))
+        lines.append('eos,2019-05-01 00:10:00.000000,None\n')
+        return lines
+
+    def _rows(self, url: str) -> list:
+        with closing(sqlite3.connect(url)) as connection:
+            return connection.execute('SELECT * FROM lightning_board_BTC_JPY ORDER BY rowid').fetchall()
+
+    def test_resume_growing_file(self):
+        data = ''.join(self._lines()).encode('utf-8')
+        self.assertGreater(len(data), HASH_BYTES)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines')
+            with open(path, 'wb') as file:
+                file.write(data)
+            expected_url = os.path.join(directory, 'expected.sqlite')
+            self.assertTrue(sqlize(path, expected_url))
+            expected = self._rows(expected_url)
+
+            # First half of a file being written, shorter than HASH_BYTES, is written and left partial
+            url = os.path.join(directory, 'grown.sqlite')
+            with open(path, 'wb') as file:
+                file.write(data[:data.rfind(b'\n', 0, len(data) // 3) + 1])
+            self.assertFalse(sqlize(path, url))
+            size, hash, line, state = database.read_ledger(url)[ledger_key(path)]
+            self.assertEqual(state, database.FileState.PARTIAL)
+            self.assertGreater(line, 0)
+
+            # The rest is resumed once the file grows
+            with open(path, 'wb') as file:
+                file.write(data)
+            self.assertTrue(sqlize(path, url))
+            self.assertEqual(database.read_ledger(url)[ledger_key(path)][3], database.FileState.DONE)
+            self.assertEqual(self._rows(url), expected)
+            # Written file is skipped
+            self.assertTrue(sqlize(path, url))
+            self.assertEqual(self._rows(url), expected)
+
+            # Another file at the same path is not written
+            with open(path, 'wb') as file:
+                file.write(data.replace(b'2019-05-01 00:00:00.000000,websocket', b'2019-05-02 00:00:00.000000,websocket'))
+            self.assertFalse(sqlize(path, url))
+
+    def test_resume_cut_file(self):
+        data = ''.join(self._lines()).encode('utf-8')
+        with tempfile.TemporaryDirectory() as directory:
+            for extension, stored in [('', data), ('.gz', gzip.compress(data))]:
+                path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines' + extension)
+                with open(path, 'wb') as file:
+                    file.write(stored)
+                expected_url = os.path.join(directory, 'expected%s.sqlite' % extension)
+                self.assertTrue(sqlize(path, expected_url))
+                expected = self._rows(expected_url)
+
+                # Gzip stream or a line cut by the end of a file being written
+                url = os.path.join(directory, 'cut%s.sqlite' % extension)
+                with open(path, 'wb') as file:
+                    file.write(stored[:len(stored) // 2 + 7])
+                self.assertFalse(sqlize(path, url))
+                self.assertEqual(database.read_ledger(url)[ledger_key(path)][3], database.FileState.PARTIAL)
+                self.assertGreater(len(self._rows(url)), 0)
+
+                with open(path, 'wb') as file:
+                    file.write(stored)
+                self.assertTrue(sqlize(path, url))
+                self.assertEqual(self._rows(url), expected)
+
+    def test_local_time_zone(self):
+        # Rows are stamped in UTC whatever the local time zone is, so a Board over a table finds times given as
+        # naive datetimes in UTC
+        lines = self._lines()[:3] + [
+            'msg,2019-05-01 00:00:%02d.000000,{"jsonrpc":"2.0","method":"channelMessage","params":'
+            '{"channel":"lightning_board_BTC_JPY","message":{"mid_price":%d,"bids":[{"price":%d,"size":0.1}],'
+            '"asks":[]}}}\n' % (second, second, second) for second in [1, 2, 3]] + ['eos,2019-05-01 00:00:04.000000,None\n']
+        time_zone = os.environ.get('TZ')
+        os.environ['TZ'] = 'Asia/Tokyo'
+        time.tzset()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines')
+                with open(path, 'w') as file:
+                    file.writelines(lines)
+                url = os.path.join(directory, 'tokyo.sqlite')
+                sqlize(path, url)
+                source = database.BoardTableSource(url, 'lightning_board_BTC_JPY')
+                try:
+                    board = Board(float, source)
+                    board.set_time(datetime(2019, 5, 1, 0, 0, 2))
+                    self.assertEqual(board.best_bid, (2.0, 0.1))
+                finally:
+                    source.close()
+        finally:
+            if time_zone is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = time_zone
+            time.tzset()
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) <= 2:
+        print('Please specify file, directory or glob pattern to process, and a file name of datadase to write the result'
+              ' (and optionally a number of processes)')
+        exit(1)
+
+    paths = find_files(sys.argv[1])
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    if len(paths) == 0:
+        logger.error('No file to process')
+        exit(1)
+
+    if len(paths) == 1:
+        succeeded = sqlize(paths[0], sys.argv[2], workers=workers)
+    else:
+        succeeded = sqlize_files(paths, sys.argv[2], workers)
+
+    if not succeeded:
+        exit(1)
+
+    # Indexes are made once all files are written
+    logger.info('Making indexes...')
+    database.create_indexes(sys.argv[2], PROFILE)
@@ -0,0 +1,384 @@
+import io
+import os
+import bz2
+import lzma
+import zlib
+import struct
+import unittest
+import tempfile
+
+from . import compression
+from .line_reader import FileLineReader, MmapFileLineReader, MappedFile, Head, InvalidFormatError, MessageType,\
+    LINE_MESSAGE_TYPES, tokenize_line, datetime_to_timestamp, timestamp_to_datetime
+from .processor.protocols import Listener, StreamFilter
+
+
+
+# Framing of dump files FileWriteListener of version 1 (BlockFileWriteListener) writes
+# A file header is followed by independently compressed blocks, a block has a header and whole records,
+# and a record is a header and a payload, which is a text of a message in UTF-8
+# All integers are little endian, times are microseconds from epoch
+BLOCK_FILE_MAGIC = b'DMPBLK'
+BLOCK_FILE_VERSION = 1
+# Magic, version
+BLOCK_FILE_HEADER = struct.Struct('<6sH')
+BLOCK_MAGIC = b'DMPB'
+# Magic, compression method, stored (compressed) size, raw size, number of records, first and last record times
+BLOCK_HEADER = struct.Struct('<4sBIIIqq')
+# Payload size, record type, time
+RECORD_HEADER = struct.Struct('<IBq')
+BLOCK_EXTENSION = compression.BLOCK_DUMP_EXTENSION
+
+RECORD_HEAD = 0
+# Record type vs MessageType of a line
+RECORD_MESSAGE_TYPES = {
+    1: MessageType.MSG,
+    2: MessageType.EMIT,
+    3: MessageType.ERR,
+    4: MessageType.EOF,
+}
+MESSAGE_RECORD_TYPES = {message_type: record_type for record_type, message_type in RECORD_MESSAGE_TYPES.items()}
+
+# Compression method number in a block header vs (name, compress with a level, decompress)
+BLOCK_METHODS = {
+    0: ('none', lambda data, level: data, lambda data: data),
+    1: ('zlib', lambda data, level: zlib.compress(data, zlib.Z_DEFAULT_COMPRESSION if level is None else level),
+        zlib.decompress),
+    2: ('bz2', lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.decompress),
+    3: ('lzma', lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+BLOCK_METHOD_BY_NAME = {name: method for method, (name, compress, decompress) in BLOCK_METHODS.items()}
+
+
+
+def is_block_file(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(BLOCK_FILE_MAGIC)) == BLOCK_FILE_MAGIC
+
+
+class BlockHeader():
+    __slots__ = ('offset', 'method', 'stored_size', 'raw_size', 'records', 'first_time', 'last_time')
+
+    def __init__(self, offset: int, method: int, stored_size: int, raw_size: int, records: int,
+                 first_time: int, last_time: int):
+        # Offset of the block header in a file
+        self.offset = offset
+        self.method = method
+        self.stored_size = stored_size
+        self.raw_size = raw_size
+        self.records = records
+        self.first_time = first_time
+        self.last_time = last_time
+
+    @property
+    def data_offset(self) -> int:
+        return self.offset + BLOCK_HEADER.size
+
+
+def read_file_header(file) -> int:
+    # Version of a block file, a file is at its beginning
+    header = file.read(BLOCK_FILE_HEADER.size)
+    if len(header) < BLOCK_FILE_HEADER.size:
+        raise EOFError('Unexpected EOF')
+    magic, version = BLOCK_FILE_HEADER.unpack(header)
+    if magic != BLOCK_FILE_MAGIC:
+        raise InvalidFormatError('Not a block dump file')
+    if version != BLOCK_FILE_VERSION:
+        raise InvalidFormatError('Block file version %d is not supported' % version)
+    return version
+
+def _read_block_header(file, offset: int) -> BlockHeader:
+    header = file.read(BLOCK_HEADER.size)
+    if len(header) == 0:
+        return None
+    if len(header) < BLOCK_HEADER.size:
+        raise EOFError('Unexpected EOF in a block header')
+    magic, method, stored_size, raw_size, records, first_time, last_time = BLOCK_HEADER.unpack(header)
+    if magic != BLOCK_MAGIC:
+        raise InvalidFormatError('Invalid block at %d' % offset)
+    if method not in BLOCK_METHODS:
+        raise InvalidFormatError('Unknown block compression method %d' % method)
+    return BlockHeader(offset, method, stored_size, raw_size, records, first_time, last_time)
+
+def iter_blocks(file):
+    # Yields (BlockHeader, stored data) of each block from the beginning, blocks are not decompressed here
+    # A block cut by the end of a file (a file being written or a killed dumper) raises EOFError
+    read_file_header(file)
+    offset = BLOCK_FILE_HEADER.size
+    while True:
+        header = _read_block_header(file, offset)
+        if header is None:
+            return
+        data = file.read(header.stored_size)
+        if len(data) < header.stored_size:
+            raise EOFError('Unexpected EOF in a block at %d' % offset)
+        yield header, data
+        offset = header.data_offset + header.stored_size
+
+def read_block_headers(path: str) -> list:
+    # Headers of all blocks, seeking over their data, e.g. to split a file for parallel decoding
+    headers = []
+    with open(path, 'rb') as file:
+        read_file_header(file)
+        offset = BLOCK_FILE_HEADER.size
+        size = os.path.getsize(path)
+        while True:
+            header = _read_block_header(file, offset)
+            if header is None or header.data_offset + header.stored_size > size:
+                return headers
+            headers.append(header)
+            offset = header.data_offset + header.stored_size
+            file.seek(offset)
+
+def decode_block(header: BlockHeader, data: bytes) -> memoryview:
+    raw = BLOCK_METHODS[header.method][2](data)
+    if len(raw) != header.raw_size:
+        raise InvalidFormatError('Block at %d has %d bytes, %d expected' % (header.offset, len(raw), header.raw_size))
+    return memoryview(raw)
+
+def iter_records(raw: memoryview):
+    # Yields (record type, time, payload) of a decoded block, payloads are slices of the block without copying
+    unpack_from = RECORD_HEADER.unpack_from
+    header_size = RECORD_HEADER.size
+    offset = 0
+    end = len(raw)
+    while offset < end:
+        size, record_type, timestamp = unpack_from(raw, offset)
+        offset += header_size
+        yield record_type, timestamp, raw[offset:offset + size]
+        offset += size
+
+def read_records(file):
+    for header, data in iter_blocks(file):
+        yield from iter_records(decode_block(header, data))
+
+
+
+class BlockWriter():
+    # Writes a block file as BlockFileWriteListener does, for converting text dumps and for tests
+    BLOCK_SIZE = 256 * 1024
+
+    def __init__(self, file, method: str = 'zlib', level: int = None):
+        self._file = file
+        self._method = BLOCK_METHOD_BY_NAME[method]
+        self._compress = BLOCK_METHODS[self._method][1]
+        self._level = level
+        self._buffer = bytearray()
+        self._records = 0
+        self._first_time = 0
+        self._last_time = 0
+        file.write(BLOCK_FILE_HEADER.pack(BLOCK_FILE_MAGIC, BLOCK_FILE_VERSION))
+
+    def write_record(self, record_type: int, timestamp: int, message: str):
+        payload = message.encode('utf-8')
+        if self._records == 0:
+            self._first_time = timestamp
+        self._last_time = timestamp
+        self._records += 1
+        self._buffer += RECORD_HEADER.pack(len(payload), record_type, timestamp)
+        self._buffer += payload
+        if len(self._buffer) >= self.BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._records > 0:
+            data = self._compress(bytes(self._buffer), self._level)
+            self._file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, self._method, len(data), len(self._buffer), self._records,
+                                               self._first_time, self._last_time))
+            self._file.write(data)
+            self._buffer = bytearray()
+            self._records = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+def convert_to_blocks(source: str, destination: str, method: str = 'zlib', level: int = None) -> int:
+    # Write a text dump file as a block file, returns the number of records
+    count = 0
+    with compression.open_dump(source) as file:
+        writer = BlockWriter(open(destination, 'wb'), method, level)
+        try:
+            head = Head(file.readline())
+            writer.write_record(RECORD_HEAD, datetime_to_timestamp(head.time), head.protocol_head)
+            count += 1
+            for line in file:
+                if not line.endswith('\n'):
+                    break
+                message_type, timestamp, msg = tokenize_line(line)
+                writer.write_record(MESSAGE_RECORD_TYPES[message_type], timestamp, msg)
+                count += 1
+        finally:
+            writer.close()
+    return count
+
+
+
+class BlockFileReader(FileLineReader):
+    # FileLineReader over a block file, a record is a message of a line without splitting a line and parsing its time
+    def __init__(self, file):
+        super().__init__(file)
+        self._records = read_records(file)
+        self._decode = True
+
+    def setup(self, listener: Listener, stream_filter: StreamFilter = None):
+        super().setup(listener, stream_filter)
+        # A processor taking bytes decodes only messages it does not skip
+        self._decode = not self._protocol.accepts_bytes
+
+    def _read_head(self) -> str:
+        record = next(self._records, None)
+        if record is None:
+            return ''
+        record_type, timestamp, payload = record
+        if record_type != RECORD_HEAD:
+            raise InvalidFormatError('Block file does not start with a head')
+        # Same head as a text file has, framing is the only difference
+        return 'head,0,%s,%s' % (timestamp_to_datetime(timestamp).isoformat(' ', 'microseconds'), str(payload, 'utf-8'))
+
+    def next_line(self):
+        record = next(self._records, None)
+        if record is None:
+            # File ending right after an explicit terminal is a normal end
+            self._current_line = ''
+            if self._message_type == MessageType.EOF:
+                return False
+            raise EOFError('File reached EOF')
+
+        record_type, timestamp, payload = record
+        message_type = RECORD_MESSAGE_TYPES.get(record_type)
+        if message_type is None:
+            raise InvalidFormatError('Record type %d is unknown' % record_type)
+        # Message of a record as a line has, line_str decodes it when it is asked
+        self._current_line = payload
+        self._process_message(message_type, timestamp, str(payload, 'utf-8') if self._decode else bytes(payload))
+        return True
+
+
+def open_reader(path: str) -> FileLineReader:
+    # Reader of a dump file of any format, its file is closed with reader.file.close()
+    # An uncompressed text file is mapped in memory
+    if is_block_file(path):
+        return BlockFileReader(io.BufferedReader(io.FileIO(path, 'rb'), 1024 * 1024))
+    if compression.detect_compression(path).name == 'none':
+        return MmapFileLineReader(MappedFile(path))
+    return FileLineReader(compression.open_dump(path))
+
+def read_head(path: str) -> Head:
+    # Head of a dump file of any format
+    reader = open_reader(path)
+    try:
+        return Head(reader._read_head())
+    finally:
+        reader.file.close()
+
+# MessageType vs the string a line of it starts with
+_MESSAGE_TYPE_STRINGS = {message_type: type_str for type_str, message_type in LINE_MESSAGE_TYPES.items()}
+
+def read_lines(path: str):
+    # Lines of a dump file of any format as a text file has them, head first, a partial last line is left out
+    # A file cut in a compressed stream or a block raises EOFError after the lines before the cut
+    if not is_block_file(path):
+        with compression.open_dump(path) as file:
+            for line in file:
+                if not line.endswith('\n'):
+                    return
+                yield line
+        return
+
+    with io.BufferedReader(io.FileIO(path, 'rb'), 1024 * 1024) as file:
+        for record_type, timestamp, payload in read_records(file):
+            time_str = timestamp_to_datetime(timestamp).isoformat(' ', 'microseconds')
+            if record_type == RECORD_HEAD:
+                yield 'head,0,%s,%s\n' % (time_str, str(payload, 'utf-8'))
+                continue
+            message_type = RECORD_MESSAGE_TYPES.get(record_type)
+            if message_type is None:
+                raise InvalidFormatError('Record type %d is unknown' % record_type)
+            yield '%s,%s,%s\n' % (_MESSAGE_TYPE_STRINGS[message_type], time_str, str(payload, 'utf-8'))
+
+
+
+class TestBlocks(unittest.TestCase):
+    def test_convert_and_read(self):
+        lines = ['head,0,2019-05-01 00:00:00.000000,websocket,0,wss://ws.lightstream.bitflyer.com/json-rpc\n',
+                 'emit,2019-05-01 00:00:00.000000,{"method": "subscribe", "params": {"channel": "x"}, "id": 1}\n']
+        for i in range(20000):
+            lines.append('msg,2019-05-01 00:%02d:%02d.%06d,{"i":%d,"s":"あ"}\n' % (i // 6000, i // 100 % 60, i, i))
+        lines.append('eos,2019-05-01 00:04:00.000000,None\n')
+
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines')
+            with open(source, 'w', encoding='utf-8') as file:
+                file.writelines(lines)
+            for method in ['zlib', 'none', 'lzma']:
+                path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00' + BLOCK_EXTENSION)
+                self.assertEqual(convert_to_blocks(source, path, method), len(lines))
+                self.assertTrue(is_block_file(path))
+                headers = read_block_headers(path)
+                self.assertGreater(len(headers), 1)
+                self.assertEqual(sum(header.records for header in headers), len(lines))
+
+                # Records decode to the same messages and times as lines
+                with open(path, 'rb') as file:
+                    records = list(read_records(file))
+                self.assertEqual(len(records), len(lines))
+                for line, (record_type, timestamp, payload) in zip(lines[1:], records[1:]):
+                    self.assertEqual(line.split(',', 2)[2][:-1], str(payload, 'utf-8'))
+
+                # Cut block is an unexpected EOF
+                size = os.path.getsize(path)
+                with open(path, 'r+b') as file:
+                    file.truncate(size - 10)
+                with open(path, 'rb') as file:
+                    with self.assertRaises(EOFError):
+                        list(read_records(file))
+                self.assertEqual(len(read_block_headers(path)), len(headers) - 1)
+
+    def test_mapped_reader(self):
+        lines = ['head,0,2019-05-01 00:00:00.000000,websocket,0,wss://ws.lightstream.bitflyer.com/json-rpc\n',
+                 'emit,2019-05-01 00:00:00.000000,{"method":"subscribe","params":{"channel":"lightning_ticker_BTC_JPY"},'
+                 '"id":1}\n',
+                 'emit,2019-05-01 00:00:00.000000,{"method":"subscribe","params":{"channel":"lightning_board_BTC_JPY"},'
+                 '"id":2}\n',
+                 'msg,2019-05-01 00:00:00.000000,{"jsonrpc":"2.0","id":1,"result":true}\n',
+                 'msg,2019-05-01 00:00:00.000000,{"jsonrpc":"2.0","id":2,"result":true}\n']
+        for i in range(1000):
+            lines.append('msg,2019-05-01 00:00:%02d.%06d,{"jsonrpc":"2.0","method":"channelMessage","params":'
+                         '{"channel":"lightning_board_BTC_JPY","message":{"mid_price":%d,"bids":[{"price":%d,'
+                         '"size":0.1}],"asks":[]}}}\n' % (i // 100, i, i, i))
+            if i % 100 == 0:
+                # Skipped without being decoded, an invalid message would raise if it were decoded
+                lines.append('msg,2019-05-01 00:00:%02d.%06d,{"jsonrpc":"2.0","method":"channelMessage","params":'
+                             '{"channel":"lightning_ticker_BTC_JPY","message":{\n' % (i // 100, i))
+        lines.append('eos,2019-05-01 00:01:00.000000,None\n')
+
+        class BoardListener(Listener):
+            def __init__(self):
+                self.boards = []
+
+            def accepts(self, pair_name, data_type):
+                return pair_name != 'lightning_ticker_BTC_JPY'
+
+            def board_insert_batch(self, pair_name, type, prices, sizes):
+                self.boards.append((pair_name, type, prices, sizes))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.writelines(lines)
+
+            # Processor is given bytes and makes the same calls, lines are the same
+            results = []
+            for reader in [FileLineReader(compression.open_dump(path)), open_reader(path)]:
+                listener = BoardListener()
+                reader.setup(listener)
+                read = []
+                while reader.next_line():
+                    read.append((reader.message_timestamp, reader.line_str))
+                reader.file.close()
+                results.append((read, listener.boards))
+            self.assertIsInstance(reader, MmapFileLineReader)
+            self.assertEqual(len(results[0][1]), 2000)
+            self.assertEqual(results[0], results[1])
+            self.assertEqual([line for timestamp, line in results[1][0]], lines[1:])
@@ -0,0 +1,154 @@
+import sqlite3
+import unittest
+from array import array
+
+from .structures import Board, BoardState, OrderMap, RecordListSource, RECORD_CLEAR_ALL,\
+    RECORD_SET_BUY, RECORD_SET_SELL
+
+
+
+# Checkpoints of a dump file or a database are kept in a file next to it with this suffix
+CHECKPOINT_SUFFIX = '.checkpoints'
+
+DEF_CHECKPOINT_TABLE = '''CREATE TABLE IF NOT EXISTS checkpoints (
+    name TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    sell_prices BLOB NOT NULL,
+    sell_amounts BLOB NOT NULL,
+    buy_prices BLOB NOT NULL,
+    buy_amounts BLOB NOT NULL,
+    PRIMARY KEY (name, time, position)
+)'''
+
+
+
+def checkpoint_path(path: str) -> str:
+    """Return a path of a checkpoint file for a dump file or a database at path."""
+    return path + CHECKPOINT_SUFFIX
+
+def _pack(orders: OrderMap):
+    # Prices are sorted, and stored as float64 as well as amounts
+    prices = array('d')
+    amounts = array('d')
+    for price, amount in orders.items():
+        prices.append(price)
+        amounts.append(amount)
+    return prices.tobytes(), amounts.tobytes()
+
+def _unpack(price_type: type, prices_bytes: bytes, amounts_bytes: bytes):
+    prices = array('d')
+    prices.frombytes(prices_bytes)
+    amounts = array('d')
+    amounts.frombytes(amounts_bytes)
+    prices = [price_type(price) for price in prices] if price_type is not float else prices.tolist()
+    return OrderMap(price_type, dict(zip(prices, amounts.tolist())), prices)
+
+
+class Checkpoint(object):
+    """Full board state at a point of a source.\n
+    State is as all records up to \"position\" are applied, \"time\" is a timestamp of the record at position."""
+    def __init__(self, time: int, position: int, state: BoardState):
+        self.time = time
+        self.position = position
+        self.state = state
+
+class CheckpointStore(object):
+    """Stores checkpoints of boards in a SQLite file, each board is identified by a name (ex. a table name)."""
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(DEF_CHECKPOINT_TABLE)
+
+    def close(self):
+        self._connection.close()
+
+    def add(self, name: str, checkpoint: Checkpoint):
+        sell_prices, sell_amounts = _pack(checkpoint.state.sells)
+        buy_prices, buy_amounts = _pack(checkpoint.state.buys)
+        self._connection.execute('INSERT OR REPLACE INTO checkpoints VALUES(?,?,?,?,?,?,?)',
+                                 (name, checkpoint.time, checkpoint.position,
+                                  sell_prices, sell_amounts, buy_prices, buy_amounts))
+
+    def remove(self, name: str):
+        self._connection.execute('DELETE FROM checkpoints WHERE name = ?', (name, ))
+
+    def commit(self):
+        self._connection.commit()
+
+    def points(self, name: str):
+        """Return list of (time, position) of checkpoints in time order."""
+        return self._connection.execute('SELECT time, position FROM checkpoints WHERE name = ? ORDER BY time, position',
+                                        (name, )).fetchall()
+
+    def load(self, name: str, price_type: type, time: int, position: int) -> Checkpoint:
+        row = self._connection.execute('SELECT sell_prices, sell_amounts, buy_prices, buy_amounts FROM checkpoints '
+                                       'WHERE name = ? AND time = ? AND position = ?', (name, time, position)).fetchone()
+        if row is None:
+            raise KeyError('Checkpoint of %s at %d does not exist' % (name, time))
+        return Checkpoint(time, position, BoardState(price_type, _unpack(price_type, row[0], row[1]),
+                                                     _unpack(price_type, row[2], row[3]), time))
+
+    def find(self, name: str, price_type: type, time: int) -> Checkpoint:
+        """Return the latest checkpoint at or before time, None if there is no such one."""
+        row = self._connection.execute('SELECT time, position FROM checkpoints WHERE name = ? AND time <= ? '
+                                       'ORDER BY time DESC, position DESC LIMIT 1', (name, time)).fetchone()
+        if row is None:
+            return None
+        return self.load(name, price_type, row[0], row[1])
+
+
+def build_checkpoints(store: CheckpointStore, name: str, price_type: type, source,
+                      interval: int = None, updates: int = None):
+    """Replay all records of a source, and store a checkpoint every \"interval\" microseconds of records
+    and/or every \"updates\" records. Existing checkpoints of the name are replaced.
+    Returns the number of checkpoints stored."""
+    if interval is None and updates is None:
+        raise ValueError('Either interval or updates must be given')
+
+    store.remove(name)
+    board = Board(price_type)
+    apply = board.apply
+    count = 0
+    last_time = None
+    since_last = 0
+    for position, record_time, record_type, price, amount in source.records():
+        if last_time is None:
+            last_time = record_time
+        apply(record_type, price, amount)
+        since_last += 1
+
+        if (interval is not None and record_time - last_time >= interval) or\
+                (updates is not None and since_last >= updates):
+            store.add(name, Checkpoint(record_time, position, board.take_snapshot()))
+            count += 1
+            last_time = record_time
+            since_last = 0
+
+    store.commit()
+    return count
+
+
+
+class TestCheckpoints(unittest.TestCase):
+    def test_set_time_from_checkpoint(self):
+        records = [(0, RECORD_CLEAR_ALL, None, None)]
+        for i in range(1, 1000):
+            records.append((i * 10, RECORD_SET_BUY, 100 + i % 7, i))
+            records.append((i * 10, RECORD_SET_SELL, 200 + i % 5, i))
+        source = RecordListSource(records)
+        store = CheckpointStore(':memory:')
+        self.assertEqual(build_checkpoints(store, 'board', int, source, interval=1000), 9)
+
+        # Results must be the same as replaying from the beginning
+        replayed = Board(int, source)
+        board = Board(int, source, store, 'board')
+        for time in [9995, 5000, 5001, 123, 9000, 0, 10000]:
+            replayed.set_time(time)
+            board.set_time(time)
+            self.assertEqual(list(board.take_snapshot().buys.items()), list(replayed.take_snapshot().buys.items()))
+            self.assertEqual(list(board.take_snapshot().sells.items()), list(replayed.take_snapshot().sells.items()))
+
+        # Checkpoint nearest to the time is used instead of replaying from the beginning
+        board.set_time(5005)
+        self.assertEqual(board.position, 1000)
+        store.close()
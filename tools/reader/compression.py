@@ -0,0 +1,152 @@
+import io
+import gzip
+import zlib
+import bz2
+import lzma
+
+
+
+class ZlibReader(io.RawIOBase):
+    # Reads (possibly concatenated) zlib streams, as gzip/bz2/lzma modules do for their formats
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, file):
+        self._file = file
+        # Decompressor for a current stream, None before the first stream
+        self._decompressor = None
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self._pending) == 0:
+            if self._decompressor is None or self._decompressor.eof:
+                # Next stream might follow
+                data = self._decompressor.unused_data if self._decompressor is not None else b''
+                if len(data) == 0:
+                    data = self._file.read(self.CHUNK_SIZE)
+                if len(data) == 0:
+                    return 0
+                self._decompressor = zlib.decompressobj()
+            else:
+                data = self._decompressor.unconsumed_tail
+                if len(data) == 0:
+                    data = self._file.read(self.CHUNK_SIZE)
+                if len(data) == 0:
+                    raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            self._pending = self._decompressor.decompress(data, max(len(buffer), self.CHUNK_SIZE))
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class ZlibWriter(io.RawIOBase):
+    # Writes a zlib stream
+    def __init__(self, file, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self._file = file
+        self._compressor = zlib.compressobj(level)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._file.write(self._compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._file.write(self._compressor.flush())
+            self._file.close()
+        super().close()
+
+
+
+def _open_zlib(path: str, mode: str, level: int):
+    if 'r' in mode:
+        binary = io.BufferedReader(ZlibReader(open(path, 'rb')))
+    else:
+        binary = io.BufferedWriter(ZlibWriter(open(path, mode.replace('t', '').replace('b', '') + 'b'),
+                                              zlib.Z_DEFAULT_COMPRESSION if level is None else level))
+    if 'b' in mode:
+        return binary
+    return io.TextIOWrapper(binary, encoding='utf-8')
+
+def _open_plain(path: str, mode: str, level: int):
+    if 'b' in mode:
+        return open(path, mode.replace('t', ''))
+    return open(path, mode, encoding='utf-8')
+
+
+class Compression():
+    def __init__(self, name: str, extension: str, magic: bytes, opener):
+        self.name = name
+        self.extension = extension
+        # First bytes of a compressed file
+        self.magic = magic
+        # Function like gzip.open, taking (path, mode, level)
+        self.open = opener
+
+
+# Compression methods FileWriteListener writes dump files in, level None means default level of each method
+COMPRESSIONS = [
+    Compression('gzip', '.gz', b'\x1f\x8b', lambda path, mode, level: gzip.open(
+        path, mode, compresslevel=9 if level is None else level, encoding=None if 'b' in mode else 'utf-8')),
+    Compression('bz2', '.bz2', b'BZh', lambda path, mode, level: bz2.open(
+        path, mode, compresslevel=9 if level is None else level, encoding=None if 'b' in mode else 'utf-8')),
+    Compression('lzma', '.xz', b'\xfd7zXZ\x00', lambda path, mode, level: lzma.open(
+        path, mode, preset=level, encoding=None if 'b' in mode else 'utf-8')),
+    Compression('zlib', '.zz', None, _open_zlib),
+    Compression('none', '', None, _open_plain),
+]
+
+COMPRESSION_BY_NAME = {compression.name: compression for compression in COMPRESSIONS}
+
+# Every dump file name has this before the extension of its compression
+DUMP_EXTENSION = '.json.lines'
+# Dump files in the block format (reader.blocks) have this, blocks are compressed inside
+BLOCK_DUMP_EXTENSION = '.json.blocks'
+
+
+def _is_zlib_header(head: bytes):
+    # CMF byte says deflate with window size, and CMF * 256 + FLG is a multiple of 31
+    return len(head) >= 2 and (head[0] & 0x0f) == 8 and (head[0] >> 4) <= 7 and (head[0] * 256 + head[1]) % 31 == 0
+
+def is_dump_file(path: str):
+    return any(path.endswith(DUMP_EXTENSION + compression.extension) for compression in COMPRESSIONS) or\
+        path.endswith(BLOCK_DUMP_EXTENSION)
+
+def detect_compression(path: str) -> Compression:
+    # File extension decides first
+    for compression in COMPRESSIONS:
+        if compression.extension != '' and path.endswith(DUMP_EXTENSION + compression.extension):
+            return compression
+    if path.endswith(DUMP_EXTENSION):
+        return COMPRESSION_BY_NAME['none']
+
+    # Otherwise look at its first bytes
+    with open(path, 'rb') as file:
+        head = file.read(8)
+    for compression in COMPRESSIONS:
+        if compression.magic is not None and head.startswith(compression.magic):
+            return compression
+    if _is_zlib_header(head):
+        return COMPRESSION_BY_NAME['zlib']
+    return COMPRESSION_BY_NAME['none']
+
+def open_dump(path: str, mode: str = 'rt', compression: str = None, level: int = None):
+    # Open a dump file, compression method is detected from the file if not given
+    if compression is None:
+        if 'r' not in mode:
+            raise ValueError('Compression must be given to write')
+        method = detect_compression(path)
+    else:
+        method = COMPRESSION_BY_NAME[compression]
+    return method.open(path, mode, level)
@@ -0,0 +1,56 @@
+import os
+import re
+import datetime
+
+from .compression import COMPRESSIONS, DUMP_EXTENSION, BLOCK_DUMP_EXTENSION
+
+
+
+# FileWriteListener names a file "<prefix>.<time opened>.json.lines<compression extension>", or
+# "<prefix>.<time opened>.json.blocks" in the block format, which compresses blocks inside
+# A prefix is an exchange name, optionally tagged with a shard or a connection as "<exchange>-<tag>"
+DUMP_FILE_NAME_REGEX = re.compile(r'^(?P<exchange>[^.\-]+)(-(?P<tag>[^.]+))?\.(?P<time>\d{4}_\d{2}_\d{2}_\d{2}_\d{2}_\d{2})'
+                                  + r'(' + re.escape(DUMP_EXTENSION) + r'(?P<extension>(\.\w+)?)|'
+                                  + re.escape(BLOCK_DUMP_EXTENSION) + r')$')
+FILE_TIME_FORMAT = '%Y_%m_%d_%H_%M_%S'
+
+
+
+class DumpFileName():
+    def __init__(self, path: str):
+        match_obj = DUMP_FILE_NAME_REGEX.match(os.path.basename(path))
+        if match_obj is None:
+            raise ValueError('Not a name of a dump file: %s' % path)
+        self._path = path
+        self._exchange = match_obj.group('exchange')
+        self._tag = match_obj.group('tag')
+        self._time = datetime.datetime.strptime(match_obj.group('time'), FILE_TIME_FORMAT)
+        # A block file is not compressed as a whole
+        extension = match_obj.group('extension') or ''
+        compressions = [compression for compression in COMPRESSIONS if compression.extension == extension]
+        if len(compressions) == 0:
+            raise ValueError('Unknown compression extension: %s' % path)
+        self._compression = compressions[0]
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def exchange(self) -> str:
+        return self._exchange
+
+    @property
+    def tag(self) -> str:
+        # Shard or connection tag, None if not tagged
+        return self._tag
+
+    @property
+    def time(self) -> datetime.datetime:
+        # Time the file was opened
+        return self._time
+
+    @property
+    def compression(self):
+        return self._compression
+
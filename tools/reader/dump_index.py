@@ -0,0 +1,329 @@
+import io
+import os
+import gzip
+import zlib
+import bz2
+import lzma
+import unittest
+import tempfile
+from bisect import bisect_left, bisect_right
+
+from .compression import COMPRESSION_BY_NAME, ZlibReader, detect_compression
+from .line_reader import parse_line_time
+
+
+
+# Index of a dump file is kept in a file next to it with this suffix
+INDEX_SUFFIX = '.index'
+INDEX_VERSION = 0
+# Uncompressed dump files get an access point at a line start every this many bytes
+DEFAULT_PLAIN_INTERVAL = 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+# Decompressor of one stream of each compression method, all of them have "eof" and "unused_data"
+# Streams of a file written by FileWriteListener start at line boundaries, where reading can start
+_STREAM_DECOMPRESSORS = {
+    'gzip': lambda: zlib.decompressobj(zlib.MAX_WBITS | 16),
+    'zlib': zlib.decompressobj,
+    'bz2': bz2.BZ2Decompressor,
+    'lzma': lzma.LZMADecompressor,
+}
+
+# Function wrapping a raw file at an access point into a binary stream of decompressed data
+_STREAM_READERS = {
+    'gzip': lambda raw: gzip.GzipFile(fileobj=raw, mode='rb'),
+    'zlib': lambda raw: io.BufferedReader(ZlibReader(raw)),
+    'bz2': lambda raw: bz2.BZ2File(raw, 'rb'),
+    'lzma': lambda raw: lzma.LZMAFile(raw, 'rb'),
+    'none': lambda raw: raw,
+}
+
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+def line_time(line) -> int:
+    # Time of a line in bytes or str, a head line has its time in the third field
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    fields = line.split(',', 3)
+    if fields[0] == 'head':
+        return parse_line_time(fields[2])
+    return parse_line_time(fields[1])
+
+
+class IndexPoint():
+    def __init__(self, offset: int, line: int, time: int):
+        # Offset in a (compressed) file where reading can start
+        self.offset = offset
+        # Number of lines before this point, a head line is line 0
+        self.line = line
+        # Time of the line at this point in microseconds from epoch, never less than times of earlier points
+        self.time = time
+
+
+class DumpIndex():
+    def __init__(self, compression: str, size: int, points: list):
+        self.compression = compression
+        # Size of a file when it was indexed, index of a file still being written is extended later
+        self.size = size
+        self.points = points
+        self._times = [point.time for point in points]
+        self._lines = [point.line for point in points]
+
+    def find_time(self, time: int) -> IndexPoint:
+        # Last point before time, lines at time can be in a stream before a point at the same time
+        return self.points[max(bisect_left(self._times, time) - 1, 0)]
+
+    def find_line(self, line: int) -> IndexPoint:
+        return self.points[max(bisect_right(self._lines, line) - 1, 0)]
+
+    def save(self, path: str):
+        with open(path, 'w') as file:
+            file.write('index,%d,%s,%d\n' % (INDEX_VERSION, self.compression, self.size))
+            for point in self.points:
+                file.write('%d,%d,%d\n' % (point.offset, point.line, point.time))
+
+    @staticmethod
+    def load(path: str):
+        with open(path, 'r') as file:
+            head = file.readline().rstrip('\n').split(',')
+            if len(head) != 4 or head[0] != 'index' or head[1] != str(INDEX_VERSION):
+                raise ValueError('Not an index of version %d: %s' % (INDEX_VERSION, path))
+            points = []
+            for line in file:
+                offset, line_number, time = line.split(',')
+                points.append(IndexPoint(int(offset), int(line_number), int(time)))
+        return DumpIndex(head[2], int(head[3]), points)
+
+
+
+def _index_streams(raw, compression: str, start: IndexPoint, points: list):
+    # Walk compressed streams from an access point, and add a point for each stream starting at a line start
+    new_decompressor = _STREAM_DECOMPRESSORS[compression]
+    decompressor = new_decompressor()
+    offset = start.offset
+    line = start.line
+    last_time = start.time
+    # Point waiting for its first line to be decompressed, and bytes of the line so far
+    pending = None
+    pending_head = b''
+    at_line_start = True
+    raw.seek(offset)
+    data = b''
+    while True:
+        if len(data) == 0:
+            data = raw.read(CHUNK_SIZE)
+            if len(data) == 0:
+                break
+        output = decompressor.decompress(data)
+        if decompressor.eof:
+            consumed = len(data) - len(decompressor.unused_data)
+            data = decompressor.unused_data
+        else:
+            consumed = len(data)
+            data = b''
+        offset += consumed
+
+        if pending is not None:
+            pending_head += output[:output.find(b'\n') + 1] if b'\n' in output else output
+            if pending_head.endswith(b'\n'):
+                last_time = max(last_time, line_time(pending_head))
+                pending.time = last_time
+                points.append(pending)
+                pending = None
+                pending_head = b''
+        if len(output) > 0:
+            line += output.count(b'\n')
+            at_line_start = output.endswith(b'\n')
+
+        if decompressor.eof:
+            # Stream ended, next one can follow, but only a stream starting at a line start is an access point
+            decompressor = new_decompressor()
+            pending = IndexPoint(offset, line, None) if at_line_start else None
+            pending_head = b''
+
+def _index_lines(raw, start: IndexPoint, points: list, interval: int):
+    # Uncompressed file can be read from any line start, place a point every interval bytes
+    raw.seek(start.offset)
+    offset = start.offset
+    line = start.line
+    last_time = start.time
+    next_offset = offset + interval
+    for text in raw:
+        if offset >= next_offset and text.endswith(b'\n'):
+            last_time = max(last_time, line_time(text))
+            points.append(IndexPoint(offset, line, last_time))
+            next_offset = offset + interval
+        offset += len(text)
+        line += 1
+
+def build_index(path: str, previous: DumpIndex = None, interval: int = DEFAULT_PLAIN_INTERVAL) -> DumpIndex:
+    # Walk a dump file once and make its index, if an index of the file when it was shorter is given, it is extended
+    compression = detect_compression(path).name
+    size = os.path.getsize(path)
+    if previous is not None and previous.compression == compression and previous.size <= size:
+        points = list(previous.points)
+    else:
+        # The first point is the head line
+        with COMPRESSION_BY_NAME[compression].open(path, 'rb', None) as file:
+            head = file.readline()
+        if not head.endswith(b'\n'):
+            raise EOFError('Unexpected EOF')
+        points = [IndexPoint(0, 0, line_time(head))]
+
+    start = points[-1]
+    with open(path, 'rb') as raw:
+        if compression == 'none':
+            _index_lines(raw, start, points, interval)
+        else:
+            _index_streams(raw, compression, start, points)
+    return DumpIndex(compression, size, points)
+
+def load_index(path: str, save: bool = True) -> DumpIndex:
+    # Index of a dump file, made or extended if an index file does not exist or it is older than the file
+    saved_path = index_path(path)
+    index = None
+    if os.path.exists(saved_path):
+        try:
+            index = DumpIndex.load(saved_path)
+        except ValueError:
+            index = None
+        if index is not None and index.size == os.path.getsize(path):
+            return index
+    index = build_index(path, index)
+    if save:
+        index.save(saved_path)
+    return index
+
+
+
+class SeekedDumpFile():
+    # Text file returning a head line of a dump file first, and then lines from the first line at or after
+    # a given time or line number, FileLineReader can read it as if lines in between did not exist
+    def __init__(self, path: str, time: int = None, line: int = None, index: DumpIndex = None):
+        if index is None:
+            index = load_index(path)
+        self._index = index
+        stream_reader = _STREAM_READERS[index.compression]
+
+        with open(path, 'rb') as raw:
+            self._head = stream_reader(raw).readline().decode('utf-8')
+
+        if time is not None:
+            point = index.find_time(time)
+        elif line is not None:
+            point = index.find_line(line)
+        else:
+            point = index.points[0]
+        self._raw = open(path, 'rb')
+        self._raw.seek(point.offset)
+        self._file = io.TextIOWrapper(stream_reader(self._raw), encoding='utf-8')
+
+        self._line = point.line
+        self._target_time = time
+        self._target_line = max(line if line is not None else 0, 1)
+        self._head_returned = False
+        self._skipped = False
+
+    @property
+    def line_number(self) -> int:
+        # Number of the line readline returned last
+        return self._line - 1
+
+    def _next_line(self) -> str:
+        text = self._file.readline()
+        if text != '':
+            self._line += 1
+        return text
+
+    def readline(self) -> str:
+        if not self._head_returned:
+            self._head_returned = True
+            return self._head
+        text = self._next_line()
+        if not self._skipped:
+            # Lines from the access point up to the target are dropped
+            self._skipped = True
+            while text != '' and (self._line - 1 < self._target_line or
+                                  (self._target_time is not None and line_time(text) < self._target_time)):
+                text = self._next_line()
+        return text
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        text = self.readline()
+        if text == '':
+            raise StopIteration
+        return text
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def open_dump_at(path: str, time: int = None, line: int = None, index: DumpIndex = None) -> SeekedDumpFile:
+    # Open a dump file to read from a time (microseconds from epoch) or a line number, decompressing only
+    # from the nearest access point before it
+    return SeekedDumpFile(path, time, line, index)
+
+
+
+class TestDumpIndex(unittest.TestCase):
+    def _write_dump(self, path: str, compression: str, lines: list, stream_lines: int):
+        # Each stream has stream_lines lines, as FileWriteListener starts a new stream at a line boundary
+        with open(path, 'wb') as raw:
+            for i in range(0, len(lines), stream_lines):
+                data = ''.join(lines[i:i + stream_lines]).encode('utf-8')
+                if compression == 'gzip':
+                    raw.write(gzip.compress(data))
+                elif compression == 'bz2':
+                    raw.write(bz2.compress(data))
+                else:
+                    raw.write(data)
+
+    def test_seek(self):
+        lines = ['head,0,2019-05-01 00:00:00.000000,websocket,0,wss://ws.lightstream.bitflyer.com/json-rpc\n']
+        for i in range(1, 1000):
+            lines.append('msg,2019-05-01 00:%02d:%02d.%06d,{"i":%d}\n' % (i // 600, i // 10 % 60, i % 10, i))
+        lines.append('eos,2019-05-01 00:01:40.000000,None\n')
+
+        with tempfile.TemporaryDirectory() as directory:
+            for compression, extension in [('gzip', '.gz'), ('bz2', '.bz2'), ('none', '')]:
+                path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines' + extension)
+                self._write_dump(path, compression, lines, 64)
+                # Plain file gets a point every 1000 bytes
+                index = load_index(path) if compression != 'none' else build_index(path, interval=1000)
+                self.assertGreater(len(index.points), 10)
+                self.assertEqual(DumpIndex.load(index_path(path)).size if compression != 'none' else index.size,
+                                 os.path.getsize(path))
+
+                # Head line, and lines from the target
+                for target in [0, 1, 63, 64, 65, 500, 999, 1000, 1001]:
+                    with open_dump_at(path, line=target, index=index) as file:
+                        self.assertEqual(list(file), lines[:1] + lines[max(target, 1):])
+                for second in [0, 5, 37, 99, 100, 101]:
+                    time = 1556668800000000 + second * 1000000
+                    with open_dump_at(path, time=time, index=index) as file:
+                        expected = [line for line in lines[1:] if line_time(line) >= time]
+                        self.assertEqual(list(file), lines[:1] + expected)
+
+                # Index of a file being written is extended
+                self._write_dump(path, compression, lines[:500], 64)
+                short = build_index(path, interval=1000)
+                self._write_dump(path, compression, lines, 64)
+                extended = build_index(path, short, interval=1000)
+                self.assertEqual([(point.offset, point.line, point.time) for point in extended.points],
+                                 [(point.offset, point.line, point.time) for point in index.points])
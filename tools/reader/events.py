@@ -0,0 +1,184 @@
+import os
+import logging
+import unittest
+import tempfile
+from collections import deque
+from contextlib import closing
+
+from .line_reader import FileLineReader
+from .blocks import open_reader, read_head
+from .processor import protocols
+from .processor.protocols import TradeType, DataType, StreamFilter, Ticker
+
+_logger = logging.getLogger('Events')
+
+
+
+# Events yielded from dump files, each has a timestamp of its message in microseconds from epoch
+# Slotted as records passed to listeners are, a consumer tells them apart by class
+
+class ChannelStart():
+    # Subscription to a channel succeeded, data of it follows
+    __slots__ = ('timestamp', 'pair_name', 'data_type')
+
+    def __init__(self, timestamp: int, pair_name: str, data_type: DataType):
+        self.timestamp = timestamp
+        self.pair_name = pair_name
+        self.data_type = data_type
+
+class BoardClear():
+    __slots__ = ('timestamp', 'pair_name')
+
+    def __init__(self, timestamp: int, pair_name: str):
+        self.timestamp = timestamp
+        self.pair_name = pair_name
+
+class BoardLevels():
+    # Levels of one side in a message, a size of 0 removes a level
+    __slots__ = ('timestamp', 'pair_name', 'side', 'prices', 'sizes')
+
+    def __init__(self, timestamp: int, pair_name: str, side: TradeType, prices: list, sizes: list):
+        self.timestamp = timestamp
+        self.pair_name = pair_name
+        self.side = side
+        self.prices = prices
+        self.sizes = sizes
+
+class TickerEvent():
+    __slots__ = ('timestamp', 'pair_name', 'ticker')
+
+    def __init__(self, timestamp: int, pair_name: str, ticker: Ticker):
+        self.timestamp = timestamp
+        self.pair_name = pair_name
+        self.ticker = ticker
+
+class Executions():
+    # Executions in a message
+    __slots__ = ('timestamp', 'pair_name', 'executions')
+
+    def __init__(self, timestamp: int, pair_name: str, executions: list):
+        self.timestamp = timestamp
+        self.pair_name = pair_name
+        self.executions = executions
+
+class EndOfStream():
+    # Explicit terminal of a file
+    __slots__ = ('timestamp', 'path')
+
+    def __init__(self, timestamp: int, path: str):
+        self.timestamp = timestamp
+        self.path = path
+
+
+
+class _EventQueue(protocols.Listener):
+    # Turns listener calls of one line into events, a generator takes them before the next line is read
+    def __init__(self, reader: FileLineReader, path: str, data_types: set):
+        self._reader = reader
+        self._path = path
+        self._data_types = data_types
+        self.events = deque()
+
+    def accepts(self, pair_name: str, data_type: DataType) -> bool:
+        return self._data_types is None or data_type in self._data_types
+
+    def board_start(self, pair_name: str):
+        self.events.append(ChannelStart(self._reader.message_timestamp, pair_name, DataType.BOARD))
+
+    def board_insert_batch(self, pair_name: str, type: TradeType, prices: list, sizes: list):
+        self.events.append(BoardLevels(self._reader.message_timestamp, pair_name, type, prices, sizes))
+
+    def board_clear(self, pair_name: str):
+        self.events.append(BoardClear(self._reader.message_timestamp, pair_name))
+
+    def ticker_start(self, pair_name: str):
+        self.events.append(ChannelStart(self._reader.message_timestamp, pair_name, DataType.TICKER))
+
+    def ticker_insert(self, pair_name: str, ticker: Ticker):
+        self.events.append(TickerEvent(self._reader.message_timestamp, pair_name, ticker))
+
+    def execution_start(self, pair_name: str):
+        self.events.append(ChannelStart(self._reader.message_timestamp, pair_name, DataType.EXECUTION))
+
+    def execution_insert_batch(self, pair_name: str, executions: list):
+        self.events.append(Executions(self._reader.message_timestamp, pair_name, executions))
+
+    def eos(self):
+        self.events.append(EndOfStream(self._reader.message_timestamp, self._path))
+
+
+
+def file_events(file, stream_filter: StreamFilter = None, data_types: set = None, path: str = None):
+    # Events of an opened dump file, read lazily line by line, so that memory is bounded by one message
+    # EOFError is raised if the file ends without an explicit terminal
+    return reader_events(FileLineReader(file), stream_filter, data_types, path)
+
+def reader_events(reader: FileLineReader, stream_filter: StreamFilter = None, data_types: set = None,
+                  path: str = None):
+    # Same as file_events for a reader not set up yet, e.g. BlockFileReader
+    queue = _EventQueue(reader, path, data_types)
+    events = queue.events
+    reader.setup(queue, stream_filter)
+    while reader.next_line():
+        while events:
+            yield events.popleft()
+    while events:
+        yield events.popleft()
+
+def dump_events(paths: list, stream_filter: StreamFilter = None, data_types: set = None, strict: bool = False):
+    # Events of dump files one after another in order of time they started, only one file is open at a time
+    # A file ended unexpectedly (e.g. a dumper was killed) is logged and the next file follows, unless strict
+    for path in sorted(paths, key=lambda path: read_head(path).time):
+        reader = open_reader(path)
+        with closing(reader.file):
+            try:
+                yield from reader_events(reader, stream_filter, data_types, path)
+            except EOFError:
+                if strict:
+                    raise
+                _logger.warning('Reached EOF before explicit file terminal %s' % path)
+
+
+
+def _sample_lines(start: int, seconds: list, channel: str, terminal: bool = True) -> list:
+    # Lines of a dump opened at a second of 2019-05-01 00:00, with a board message at each of seconds, for tests
+    time = '2019-05-01 00:00:%02d.000000'
+    lines = ['head,0,%s,websocket,0,wss://ws.lightstream.bitflyer.com/json-rpc\n' % (time % start),
+             'emit,%s,{"method":"subscribe","params":{"channel":"%s"},"id":1}\n' % (time % start, channel),
+             'msg,%s,{"jsonrpc":"2.0","id":1,"result":true}\n' % (time % start)]
+    for i, second in enumerate(seconds):
+        lines.append('msg,%s,{"jsonrpc":"2.0","method":"channelMessage","params":{"channel":"%s","message":'
+                     '{"mid_price":%d,"bids":[{"price":%d,"size":0.1}],"asks":[]}}}\n'
+                     % (time % second, channel, i, 1000 * start + i))
+    if terminal:
+        lines.append('eos,%s,None\n' % (time % (seconds[-1] if len(seconds) > 0 else start)))
+    return lines
+
+
+class TestEvents(unittest.TestCase):
+    def test_dump_events(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines')
+            second = os.path.join(directory, 'bitflyer.2019_05_01_00_00_05.json.lines')
+            with open(first, 'w') as file:
+                file.writelines(_sample_lines(0, [1, 2, 3], 'lightning_board_BTC_JPY'))
+            with open(second, 'w') as file:
+                file.writelines(_sample_lines(5, [6, 7], 'lightning_board_BTC_JPY', terminal=False))
+
+            # Files are read in order of their heads, a file without its terminal ends its events
+            events = list(dump_events([second, first]))
+            self.assertEqual([event.prices for event in events
+                              if isinstance(event, BoardLevels) and event.side == TradeType.BID],
+                             [[0], [1], [2], [5000], [5001]])
+            self.assertEqual([type(event) for event in events if isinstance(event, (ChannelStart, EndOfStream))],
+                             [ChannelStart, EndOfStream, ChannelStart])
+            self.assertEqual([event.path for event in events if isinstance(event, EndOfStream)], [first])
+            timestamps = [event.timestamp for event in events]
+            self.assertEqual(timestamps, sorted(timestamps))
+
+            with self.assertRaises(EOFError):
+                list(dump_events([first, second], strict=True))
+
+            # Data types a consumer does not take make no events
+            self.assertEqual([type(event) for event in dump_events([first], data_types={DataType.TICKER})],
+                             [EndOfStream])
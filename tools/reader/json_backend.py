@@ -0,0 +1,39 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+
+# Name of a JSON decoder vs its loads, only installed ones are listed
+JSON_BACKENDS = {'json': json.loads}
+if ujson is not None:
+    JSON_BACKENDS['ujson'] = ujson.loads
+if orjson is not None:
+    # orjson takes str as well as bytes
+    JSON_BACKENDS['orjson'] = orjson.loads
+
+# The first one installed is used by default, all of them raise a subclass of ValueError on an invalid document
+BACKEND_PREFERENCE = ['orjson', 'ujson', 'json']
+
+backend_name = next(name for name in BACKEND_PREFERENCE if name in JSON_BACKENDS)
+loads = JSON_BACKENDS[backend_name]
+
+
+
+def set_backend(name: str):
+    # Processors set up after this call decode messages with the backend
+    global backend_name, loads
+    if name not in JSON_BACKENDS:
+        raise ValueError('JSON backend %s is not installed' % name)
+    backend_name = name
+    loads = JSON_BACKENDS[name]
+
+def available_backends() -> list:
+    return [name for name in BACKEND_PREFERENCE if name in JSON_BACKENDS]
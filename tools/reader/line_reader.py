@@ -1,4 +1,6 @@
 from enum import Enum
+import os
+import mmap
 import datetime
 import re
 import logging
@@ -48,6 +50,101 @@ class MessageType(Enum):
         else:
             return None
 
+# Message type string at the head of a line vs its MessageType
+LINE_MESSAGE_TYPES = {
+    'msg': MessageType.MSG,
+    'emit': MessageType.EMIT,
+    'error': MessageType.ERR,
+    'eos': MessageType.EOF,
+}
+LINE_MESSAGE_TYPE_BYTES = {type_str.encode('ascii'): message_type for type_str, message_type in LINE_MESSAGE_TYPES.items()}
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_EPOCH_DATETIME = datetime.datetime(1970, 1, 1)
+# "%Y-%m-%d %H:%M:%S" string vs microseconds from epoch, lines in a second share the same entry
+_second_cache = {}
+_SECOND_CACHE_SIZE = 4096
+
+def datetime_to_timestamp(dt: datetime.datetime) -> int:
+    # Naive datetime is regarded as UTC, returns microseconds from epoch
+    return ((dt.toordinal() - _EPOCH_ORDINAL) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second) * 1000000 + dt.microsecond
+
+def timestamp_to_datetime(timestamp: int) -> datetime.datetime:
+    return _EPOCH_DATETIME + datetime.timedelta(microseconds=timestamp)
+
+def _parse_line_time_slow(datetime_str: str) -> int:
+    try:
+        line_datetime = datetime.datetime.strptime(datetime_str, DATETIME_FORMAT_DEFAULT)
+    except ValueError:
+        # Wierd, but if nanosecond is entirely 0, it is ommited
+        line_datetime = datetime.datetime.strptime(datetime_str, DATETIME_FORMAT_FALLBACK)
+    return datetime_to_timestamp(line_datetime)
+
+def _parse_second(second_str: str):
+    # Parse "%Y-%m-%d %H:%M:%S" into microseconds from epoch, returns None if it is not exactly in this shape
+    if second_str[4] != '-' or second_str[7] != '-' or second_str[10] != ' ' or second_str[13] != ':'\
+            or second_str[16] != ':':
+        return None
+    digits = second_str[:4] + second_str[5:7] + second_str[8:10] + second_str[11:13] + second_str[14:16] + second_str[17:]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    try:
+        dt = datetime.datetime(int(digits[:4]), int(digits[4:6]), int(digits[6:8]),
+                               int(digits[8:10]), int(digits[10:12]), int(digits[12:]))
+    except ValueError:
+        return None
+    return datetime_to_timestamp(dt)
+
+def parse_line_time(datetime_str: str) -> int:
+    # Parse "%Y-%m-%d %H:%M:%S.%f" (or without ".%f") into microseconds from epoch by slicing fixed width fields
+    # Anything not in exactly this shape goes to strptime so that results and errors are the same as it
+    length = len(datetime_str)
+    if length == 26:
+        microsecond_str = datetime_str[20:]
+        if datetime_str[19] != '.' or not (microsecond_str.isascii() and microsecond_str.isdigit()):
+            return _parse_line_time_slow(datetime_str)
+        microsecond = int(microsecond_str)
+    elif length == 19:
+        microsecond = 0
+    else:
+        return _parse_line_time_slow(datetime_str)
+
+    second_str = datetime_str[:19]
+    second = _second_cache.get(second_str)
+    if second is None:
+        second = _parse_second(second_str)
+        if second is None:
+            return _parse_line_time_slow(datetime_str)
+        if len(_second_cache) >= _SECOND_CACHE_SIZE:
+            _second_cache.clear()
+        _second_cache[second_str] = second
+
+    return second + microsecond
+
+def tokenize_line(line: str):
+    # Split a line into (MessageType, microseconds from epoch, message), equivalent to LINE_REGEX + strptime
+    first = line.find(',')
+    second = line.find(',', first + 1)
+    if first < 0 or second < 0 or second == first + 1:
+        raise InvalidFormatError('Invalid line format')
+
+    type_str = line[:first]
+    message_type = LINE_MESSAGE_TYPES.get(type_str)
+    if message_type is None:
+        if type_str == 'head':
+            raise InvalidFormatError('Line message type %s is unknown' % type_str)
+        raise InvalidFormatError('Invalid line format')
+
+    # Message is the rest of the line without its line terminator
+    if line[-1] == '\n':
+        msg = line[second + 1:-1]
+    else:
+        msg = line[second + 1:]
+    if msg == '' or '\n' in msg:
+        raise InvalidFormatError('Invalid line format')
+
+    return message_type, parse_line_time(line[first + 1:second]), msg
+
 class Head():
     def __init__(self, head_line: str):
         self._head = head_line
@@ -92,7 +189,7 @@ class Head():
 
 
 from .processor import protocols
-from .processor.protocols import ProtocolProcessor, Listener
+from .processor.protocols import ProtocolProcessor, Listener, StreamFilter
 
 
 
@@ -102,13 +199,19 @@ class FileLineReader():
         self._head = None
         self._current_line = None
         self._current_time = None
+        self._current_timestamp = None
         self._protocol = None
+        self._message_type = None
+        # Time window of a filter, lines out of it are only processed for states of a stream
+        self._windowed = False
+        self._begin = None
+        self._end = None
 
-    def setup(self, listener: Listener):
+    def setup(self, listener: Listener, stream_filter: StreamFilter = None):
         if self._head is not None:
             raise ProcessingError('Already setup')
         
-        head_str = self.file.readline()
+        head_str = self._read_head()
 
         if head_str == '':
             raise EOFError('Unexpected EOF')
@@ -118,33 +221,63 @@ class FileLineReader():
 
         # Set current time to head time
         self._current_time = self._head.time
+        self._current_timestamp = datetime_to_timestamp(self._head.time)
 
         # Initializing a protocol processor for an acquired information
         _logger.debug('Initializing a protocol instance: %s' % self._head._protocol_name)
         protocol_class = protocols.get_protocol_class(self._head.protocol_name, self._head.protocol_version)
         self._protocol = protocol_class()
 
+        if stream_filter is not None and stream_filter.has_window:
+            self._windowed = True
+            self._begin = stream_filter.begin if stream_filter.begin is not None else -1
+            self._end = stream_filter.end if stream_filter.end is not None else 2 ** 63
+
         # Let a protocol interpreter process its head
-        self._protocol.setup(self._head.protocol_head, self._current_time, listener)
+        self._protocol.setup(self._head.protocol_head, self._current_time, listener, stream_filter)
+
+    def _read_head(self) -> str:
+        return self.file.readline()
 
     def next_line(self):
         try:
             self._current_line = self.file.readline()
-        except EOFError as e:
-            # Set message type as EOS
-            self._message_type = MessageType.EOF
-            # Do not update _pointed_datetime
-            # Call protocol processor
-            self._protocol.process_line('None')
-            raise e
-            
+        except EOFError:
+            # Compressed stream cut by the end of a file being written or of a killed dumper
+            self._current_line = ''
+            raise
+
+        # Partial last line of a file being written or cut is not processed, the file ends before it
+        if self._current_line != '' and self._current_line[-1] != '\n':
+            self._current_line = ''
+
+        # File ending right after an explicit terminal is a normal end
+        if self._current_line == '' and self._message_type == MessageType.EOF:
+            return False
+
         # Process line
         self._process_line()
         # Check if EOF or not
         return self._current_line != ''
 
+    def skip_lines(self, count: int) -> int:
+        # Process lines only for states of a stream as lines out of a time window are, e.g. lines an earlier run wrote
+        # Returns the number of lines skipped, which is less than count if the file ends
+        windowed, begin, end = self._windowed, self._begin, self._end
+        self._windowed, self._begin, self._end = True, 0, 0
+        try:
+            skipped = 0
+            while skipped < count and self.next_line():
+                skipped += 1
+        finally:
+            self._windowed, self._begin, self._end = windowed, begin, end
+        return skipped
+
     @property
     def line_str(self) -> str:
+        # Readers over bytes keep a line undecoded until it is asked
+        if not isinstance(self._current_line, str):
+            return str(self._current_line, 'utf-8')
         return self._current_line
 
     def is_EOF(self) -> bool:
@@ -155,39 +288,31 @@ class FileLineReader():
             raise EOFError('File reached EOF')
 
         # Get message and its attributes
-        match_obj = LINE_REGEX.match(self._current_line)
-        if match_obj is None:
-            raise InvalidFormatError('Invalid line format')
-        type_str = match_obj.group('type')
-        datetime_str = match_obj.group('datetime')
-        msg = match_obj.group('msg')
+        message_type, line_timestamp, msg = tokenize_line(self._current_line)
+        self._process_message(message_type, line_timestamp, msg)
 
-        # Convert datetime string to actual datetime instance
-        try:
-            line_datetime = datetime.datetime.strptime(datetime_str, DATETIME_FORMAT_DEFAULT)
-        except ValueError:
-            # Wierd, but if nanosecond is entirely 0, it is ommited
-            line_datetime = datetime.datetime.strptime(datetime_str, DATETIME_FORMAT_FALLBACK)
-        self._raw_message_time = line_datetime
-        # Update current current datetime only if this line is AHEAD of last time recorded
-        if (line_datetime - self._current_time) / datetime.timedelta(microseconds=1) < 0:
+    def _process_message(self, message_type: MessageType, line_timestamp: int, msg: str):
+        self._raw_message_timestamp = line_timestamp
+        # Update current current time only if this line is AHEAD of last time recorded
+        if line_timestamp < self._current_timestamp:
             # Time recorded in this line is behind of last line or whatever, but time must not rewind itself?!
-            # Do not update current datetime so that result will be ordered with datetime
+            # Do not update current time so that result will be ordered with time
             # This and further lines with time behind of last recorded time will be regarded as all happened at the same
             # time
             _logger.warn('Recorded time is going back, maybe because of system clock change?')
-        else:
-            # Update current datetime
-            self._current_time = line_datetime
+        elif line_timestamp != self._current_timestamp:
+            # Update current time, datetime instance is made when it is asked
+            self._current_timestamp = line_timestamp
+            self._current_time = None
 
         # Set current line message type
-        message_type = MessageType.from_str(type_str)
-        if message_type is None:
-            raise InvalidFormatError('Line message type %s is unknown' % type_str)
         self._message_type = message_type
 
         # Let protocol process a message
-        self._protocol.process(self._message_type, msg)
+        if self._windowed and not (self._begin <= self._current_timestamp < self._end):
+            self._protocol.process_control(self._message_type, msg)
+        else:
+            self._protocol.process(self._message_type, msg)
 
     @property
     def message_type(self) -> MessageType:
@@ -195,10 +320,92 @@ class FileLineReader():
 
     @property
     def message_time(self) -> datetime:
+        if self._current_time is None:
+            self._current_time = timestamp_to_datetime(self._current_timestamp)
         return self._current_time
 
+    @property
+    def message_timestamp(self) -> int:
+        # Current message time in microseconds from epoch
+        return self._current_timestamp
+
     @property
     def protocol(self) -> ProtocolProcessor:
         return self._protocol
 
 
+
+class MappedFile():
+    # Uncompressed file mapped in memory, an empty file has an empty map as mmap does not map it
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self.map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        self.size = size
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self._file.close()
+
+
+class MmapFileLineReader(FileLineReader):
+    # FileLineReader over an uncompressed file mapped in memory, lines are found by searching bytes and only the type
+    # and the time of a line are decoded, its message is given to a processor as bytes if the processor takes them,
+    # so that messages it skips are never decoded
+    def __init__(self, file: MappedFile):
+        super().__init__(file)
+        self._position = 0
+        self._line_start = 0
+        self._line_end = 0
+        self._decode = True
+
+    def setup(self, listener: Listener, stream_filter: StreamFilter = None):
+        super().setup(listener, stream_filter)
+        self._decode = not self._protocol.accepts_bytes
+
+    def _read_head(self) -> str:
+        data = self.file.map
+        end = data.find(b'\n')
+        self._position = len(data) if end < 0 else end + 1
+        return str(data[:self._position], 'utf-8')
+
+    def next_line(self):
+        data = self.file.map
+        start = self._position
+        self._line_start = start
+        # Partial last line is not processed as FileLineReader does
+        end = data.find(b'\n', start) if start < self.file.size else -1
+        if end < 0:
+            # File ending right after an explicit terminal is a normal end
+            self._line_end = start
+            if self._message_type == MessageType.EOF:
+                return False
+            raise EOFError('File reached EOF')
+        self._position = end + 1
+        self._line_end = self._position
+
+        # Same as tokenize_line, on bytes
+        first = data.find(b',', start, end)
+        second = data.find(b',', first + 1, end) if first >= 0 else -1
+        if first < 0 or second < 0 or second == first + 1 or second + 1 == end:
+            raise InvalidFormatError('Invalid line format')
+        message_type = LINE_MESSAGE_TYPE_BYTES.get(data[start:first])
+        if message_type is None:
+            raise InvalidFormatError('Invalid line format')
+        timestamp = parse_line_time(str(data[first + 1:second], 'ascii'))
+        msg = data[second + 1:end]
+
+        self._process_message(message_type, timestamp, str(msg, 'utf-8') if self._decode else msg)
+        return True
+
+    @property
+    def line_str(self) -> str:
+        return str(self.file.map[self._line_start:self._line_end], 'utf-8')
+
+    def is_EOF(self) -> bool:
+        return self._line_start == self._line_end
@@ -0,0 +1,232 @@
+import os
+import io
+import heapq
+import logging
+import unittest
+import tempfile
+from collections import deque
+from contextlib import closing
+
+from . import compression
+from .dump_files import DumpFileName
+from .dump_index import line_time
+from .events import reader_events, _EventQueue, _sample_lines, BoardLevels, EndOfStream
+from .blocks import open_reader, read_lines, convert_to_blocks
+from .line_reader import FileLineReader, InvalidFormatError, MessageType
+from .processor.protocols import StreamFilter, TradeType
+
+_logger = logging.getLogger('Merge')
+
+
+
+def dump_series(paths: list) -> list:
+    # Split files into series of consecutive files, a series is files of one exchange and one shard tag
+    # Files in a series do not overlap in time, so they are read one after another and only a series is merged
+    # A file not named as FileWriteListener does is a series by itself
+    groups = {}
+    singles = []
+    for path in paths:
+        try:
+            name = DumpFileName(path)
+        except ValueError:
+            singles.append([path])
+            continue
+        groups.setdefault((name.exchange, name.tag or ''), []).append(name)
+    series = [[name.path for name in sorted(names, key=lambda name: name.time)]
+              for key, names in sorted(groups.items())]
+    return series + singles
+
+
+
+def _keyed_lines(paths: list, source: int, first_file: int = 0):
+    # Lines of a series as (time, source, line number, file number, line), time never goes back within a source as
+    # FileLineReader assumes, files of a series are numbered from first_file
+    last_time = None
+    number = 0
+    for file_number, path in enumerate(paths, first_file):
+        try:
+            for line in read_lines(path):
+                time = line_time(line)
+                if last_time is not None and time < last_time:
+                    time = last_time
+                last_time = time
+                yield time, source, number, file_number, line
+                number += 1
+        except EOFError:
+            _logger.warning('Reached EOF before explicit file terminal %s' % path)
+
+def merge_lines(paths: list):
+    # Lines of all dump files in time order as (time in microseconds from epoch, source number, line)
+    # Sources are series of dump_series, lines at the same time keep the order of sources and of lines in a source
+    # One line of each source is held at a time, so memory does not grow with lengths of files
+    merged = heapq.merge(*[_keyed_lines(series, source) for source, series in enumerate(dump_series(paths))])
+    for time, source, number, file_number, line in merged:
+        yield time, source, line
+
+def _keyed_events(paths: list, source: int, stream_filter: StreamFilter, data_types: set):
+    last_time = None
+    number = 0
+    for path in paths:
+        reader = open_reader(path)
+        with closing(reader.file):
+            try:
+                for event in reader_events(reader, stream_filter, data_types, path):
+                    time = event.timestamp
+                    if last_time is not None and time < last_time:
+                        time = last_time
+                    last_time = time
+                    yield time, source, number, event
+                    number += 1
+            except EOFError:
+                _logger.warning('Reached EOF before explicit file terminal %s' % path)
+
+def merge_events(paths: list, stream_filter: StreamFilter = None, data_types: set = None):
+    # Events of all files in time order, e.g. boards and executions of several exchanges in one timeline
+    merged = heapq.merge(*[_keyed_events(series, source, stream_filter, data_types)
+                           for source, series in enumerate(dump_series(paths))])
+    for time, source, number, event in merged:
+        yield event
+
+
+
+# Merged file of lines of many dump files, which a reader can route back to the protocol of each file
+# "merged,<version>,<number of files>" is followed by a table of files, "file,<file number>,<file name>" and
+# "<file number>,<head line>" for each, and then lines of all files other than heads in time order, as
+# "<file number>,<line>"
+MERGED_VERSION = 0
+
+
+def write_merged(paths: list, output) -> int:
+    # Write lines of dump files of any format in time order into a text stream, returns the number of lines written
+    series = dump_series(paths)
+    files = [path for paths in series for path in paths]
+    output.write('merged,%d,%d\n' % (MERGED_VERSION, len(files)))
+    for file_number, path in enumerate(files):
+        # Head of a block file is written as a text file has it, as are its records
+        with closing(read_lines(path)) as lines:
+            head = next(lines, None)
+        if head is None:
+            raise EOFError('Unexpected EOF in the head of %s' % path)
+        output.write('file,%d,%s\n%d,%s' % (file_number, os.path.basename(path), file_number, head))
+
+    first_files = [sum(len(paths) for paths in series[:source]) for source in range(len(series))]
+    merged = heapq.merge(*[_keyed_lines(paths, source, first_files[source]) for source, paths in enumerate(series)])
+    count = 0
+    for time, source, number, file_number, line in merged:
+        if line.startswith('head,'):
+            continue
+        output.write('%d,%s' % (file_number, line))
+        count += 1
+    return count
+
+
+class _PushedLines():
+    # File a FileLineReader reads, a line is pushed before the reader is asked to read it
+    def __init__(self):
+        self.lines = deque()
+
+    def readline(self) -> str:
+        return self.lines.popleft() if self.lines else ''
+
+    def close(self):
+        pass
+
+
+def _read_merged_head(file) -> list:
+    # (file name, head line) of each file of a merged file
+    head = file.readline().rstrip('\n').split(',')
+    if len(head) != 3 or head[0] != 'merged' or head[1] != str(MERGED_VERSION) or not head[2].isdecimal():
+        raise InvalidFormatError('Not a merged file of version %d' % MERGED_VERSION)
+    files = []
+    for file_number in range(int(head[2])):
+        name_line = file.readline()
+        head_line = file.readline()
+        prefix = '%d,' % file_number
+        if not name_line.startswith('file,' + prefix) or not head_line.startswith(prefix):
+            raise InvalidFormatError('Invalid table of files in a merged file')
+        files.append((name_line[len('file,' + prefix):].rstrip('\n'), head_line[len(prefix):]))
+    return files
+
+def merged_events(file, stream_filter: StreamFilter = None, data_types: set = None):
+    # Events of a merged text stream in time order, each line is processed by the protocol of its file
+    # Only files with lines not processed yet have readers, a file is done with its explicit terminal
+    files = _read_merged_head(file)
+    readers = {}
+    for line in file:
+        if not line.endswith('\n'):
+            break
+        comma = line.find(',')
+        if comma < 0 or not line[:comma].isdecimal() or int(line[:comma]) >= len(files):
+            raise InvalidFormatError('Line without a file number in a merged file')
+        file_number = int(line[:comma])
+        entry = readers.get(file_number)
+        if entry is None:
+            name, head = files[file_number]
+            reader = FileLineReader(_PushedLines())
+            reader.file.lines.append(head)
+            queue = _EventQueue(reader, name, data_types)
+            reader.setup(queue, stream_filter)
+            entry = readers[file_number] = (reader, queue.events)
+        reader, events = entry
+
+        reader.file.lines.append(line[comma + 1:])
+        reader.next_line()
+        while events:
+            yield events.popleft()
+        if reader.message_type == MessageType.EOF:
+            del readers[file_number]
+
+    for file_number in sorted(readers):
+        _logger.warning('Reached EOF before explicit file terminal %s' % files[file_number][0])
+
+def read_merged(path: str, stream_filter: StreamFilter = None, data_types: set = None):
+    # Same as merged_events for a merged file, compressed as its extension says
+    with compression.open_dump(path) as file:
+        yield from merged_events(file, stream_filter, data_types)
+
+
+
+class TestMerge(unittest.TestCase):
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Two files of one series, the later without its terminal and with a cut line, and another shard
+            paths = [os.path.join(directory, name) for name in ['bitflyer.2019_05_01_00_00_00.json.lines',
+                                                                 'bitflyer.2019_05_01_00_00_02.json.lines',
+                                                                 'bitflyer-b.2019_05_01_00_00_00.json.lines']]
+            contents = [_sample_lines(0, [0, 1, 1, 2], 'lightning_board_BTC_JPY'),
+                        _sample_lines(2, [3, 4], 'lightning_board_BTC_JPY', terminal=False) + ['msg,2019-05-01'],
+                        _sample_lines(0, [1, 1, 3], 'lightning_board_FX_BTC_JPY')]
+            for path, lines in zip(paths, contents):
+                with open(path, 'w') as file:
+                    file.writelines(lines)
+            self.assertEqual(dump_series(paths), [paths[:2], paths[2:]])
+
+            merged = list(merge_lines(paths))
+            # All whole lines, in time order, lines at the same time keep the order of sources and in a source
+            self.assertEqual(len(merged), sum(len(lines) for lines in contents) - 1)
+            self.assertEqual([(time, source) for time, source, line in merged],
+                             sorted((time, source) for time, source, line in merged))
+            for source, series in enumerate([contents[0] + contents[1][:-1], contents[2]]):
+                self.assertEqual([line for time, s, line in merged if s == source], series)
+
+            # Events of a merged file are those of the files merged
+            events = list(merge_events(paths))
+            self.assertEqual(sum(isinstance(event, EndOfStream) for event in events), 2)
+            self.assertEqual([event.prices for event in events
+                              if isinstance(event, BoardLevels) and event.side == TradeType.BID],
+                             [[0], [1], [2], [0], [1], [3], [2000], [2], [2001]])
+            output = io.StringIO()
+            self.assertEqual(write_merged(paths, output), len(merged) - 3)
+            output.seek(0)
+            self.assertEqual([(type(event), event.timestamp) for event in merged_events(output)],
+                             [(type(event), event.timestamp) for event in events])
+
+            # A block file is in the series of the text files of its exchange, and is merged as the text file
+            block_path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_02' + compression.BLOCK_DUMP_EXTENSION)
+            block_paths = [paths[0], block_path, paths[2]]
+            convert_to_blocks(paths[1], block_paths[1], 'zlib')
+            self.assertEqual(dump_series(block_paths), [block_paths[:2], block_paths[2:]])
+            self.assertEqual(list(merge_lines(block_paths)), merged)
+            block_output = io.StringIO()
+            self.assertEqual(write_merged(block_paths, block_output), len(merged) - 3)
+            self.assertEqual(block_output.getvalue().replace('.json.blocks', '.json.lines'), output.getvalue())
@@ -0,0 +1,254 @@
+import os
+import gzip
+import unittest
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from . import compression
+from .line_reader import FileLineReader, InvalidFormatError, MessageType, tokenize_line
+from .dump_index import _STREAM_DECOMPRESSORS, load_index
+from .blocks import RECORD_HEAD, RECORD_MESSAGE_TYPES, MESSAGE_RECORD_TYPES, BLOCK_HEADER, BlockHeader, is_block_file,\
+    read_block_headers, decode_block, iter_records, read_head, convert_to_blocks, open_reader
+from .processor import protocols
+
+
+
+# Decoding a dump file in chunks across processes, a chunk is one or more compressed streams (gzip members) or
+# blocks, which start at line boundaries and are decoded without the rest of a file
+# Workers decompress, split lines and parse times, and messages are processed in order of a file in this process
+# Stored bytes of a chunk of an uncompressed file or a block file, a stream of a compressed file is a chunk by itself
+CHUNK_SIZE = 4 * 1024 * 1024
+# Chunks decoded ahead of processing per worker, bounding memory of decoded messages waiting
+PREFETCH_PER_WORKER = 2
+# A file having a chunk of more stored bytes than this (e.g. a whole day in one gzip stream written before streams
+# were split) is read sequentially, since a worker holds a whole chunk and its messages in memory
+MAX_CHUNK_SIZE = 4 * CHUNK_SIZE
+
+
+
+def _text_chunks(path: str) -> list:
+    # (start, end) offsets of chunks of a text file, from access points of its index
+    # An index is made by walking a file once, it is saved next to the file if possible so that it is made only once
+    save = os.access(os.path.dirname(os.path.abspath(path)), os.W_OK)
+    index = load_index(path, save)
+    starts = []
+    for point in index.points:
+        if len(starts) == 0 or index.compression != 'none' or point.offset - starts[-1] >= CHUNK_SIZE:
+            starts.append(point.offset)
+    ends = starts[1:] + [os.path.getsize(path)]
+    return index.compression, list(zip(starts, ends))
+
+def _block_chunks(path: str) -> list:
+    # (offset of the first block, number of blocks, raw bytes) of chunks of a block file, a cut last block is left out
+    chunks = []
+    for header in read_block_headers(path):
+        if len(chunks) == 0 or chunks[-1][2] >= CHUNK_SIZE:
+            chunks.append([header.offset, 0, 0])
+        chunks[-1][1] += 1
+        chunks[-1][2] += header.raw_size
+    return [tuple(chunk) for chunk in chunks]
+
+def _chunk_tasks(path: str) -> list:
+    # (task, size) of each chunk of a file, a task is a decoding function and its arguments
+    # Size is stored bytes of a text chunk, and decompressed bytes of blocks
+    if is_block_file(path):
+        return [((_decode_block_chunk, path, offset, blocks), size) for offset, blocks, size in _block_chunks(path)]
+    compression, chunks = _text_chunks(path)
+    return [((_decode_text_chunk, path, compression, start, end), end - start) for start, end in chunks]
+
+
+def _decode_text_chunk(path: str, compression: str, start: int, end: int) -> tuple:
+    # Messages of a chunk as (record type, time, message), and an error at a line if the chunk has an invalid one
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    if compression == 'none':
+        text = data
+    else:
+        outputs = []
+        while len(data) > 0:
+            decompressor = _STREAM_DECOMPRESSORS[compression]()
+            outputs.append(decompressor.decompress(data))
+            if not decompressor.eof:
+                # Stream cut by the end of a file being written or of a killed dumper
+                break
+            data = decompressor.unused_data
+        text = b''.join(outputs)
+
+    # Bytes after the last line terminator are a partial line, which is not processed as FileLineReader does
+    # They are cut before decoding, since a stream cut in the middle of a character can not be decoded
+    lines = str(text[:text.rfind(b'\n') + 1], 'utf-8').split('\n')
+    lines.pop()
+    if start == 0:
+        # Head line is read by setup
+        lines = lines[1:]
+
+    messages = []
+    try:
+        for line in lines:
+            message_type, timestamp, msg = tokenize_line(line)
+            messages.append((MESSAGE_RECORD_TYPES[message_type], timestamp, msg))
+    except InvalidFormatError as e:
+        return messages, e
+    return messages, None
+
+def _decode_block_chunk(path: str, offset: int, blocks: int) -> tuple:
+    messages = []
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        for i in range(blocks):
+            header = file.read(BLOCK_HEADER.size)
+            magic, method, stored_size, raw_size, records, first_time, last_time = BLOCK_HEADER.unpack(header)
+            block = BlockHeader(offset, method, stored_size, raw_size, records, first_time, last_time)
+            for record_type, timestamp, payload in iter_records(decode_block(block, file.read(stored_size))):
+                if record_type != RECORD_HEAD:
+                    messages.append((record_type, timestamp, str(payload, 'utf-8')))
+            offset = block.data_offset + stored_size
+    return messages, None
+
+
+
+class _ParallelDump():
+    # Chunks of a file being decoded, in order of the file, closing it stops decoding
+    def __init__(self, path: str, workers: int = None, executor: ProcessPoolExecutor = None, tasks: list = None):
+        self.path = path
+        self._own_executor = executor is None
+        self._executor = ProcessPoolExecutor(max_workers=workers) if executor is None else executor
+        self._prefetch = PREFETCH_PER_WORKER * self._executor._max_workers
+        tasks = _chunk_tasks(path) if tasks is None else tasks
+        self._tasks = deque(task for task, size in tasks)
+        self._futures = deque()
+        self.closed = False
+
+    def next_chunk(self) -> tuple:
+        # Messages of the next chunk and an error in it, None after the last chunk
+        while len(self._tasks) > 0 and len(self._futures) < self._prefetch:
+            self._futures.append(self._executor.submit(*self._tasks.popleft()))
+        if len(self._futures) == 0:
+            return None
+        return self._futures.popleft().result()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for future in self._futures:
+            future.cancel()
+        self._futures.clear()
+        self._tasks.clear()
+        if self._own_executor:
+            self._executor.shutdown()
+
+
+class ParallelFileLineReader(FileLineReader):
+    # FileLineReader decoding chunks of a file in worker processes, processing of messages is the same and in order
+    def __init__(self, path: str, workers: int = None, executor: ProcessPoolExecutor = None, tasks: list = None):
+        super().__init__(_ParallelDump(path, workers, executor, tasks))
+        self._messages = iter(())
+        self._error = None
+
+    def _read_head(self) -> str:
+        return read_head(self.file.path).head
+
+    def next_line(self):
+        message = next(self._messages, None)
+        while message is None:
+            if self._error is not None:
+                raise self._error
+            chunk = self.file.next_chunk()
+            if chunk is None:
+                # File ending right after an explicit terminal is a normal end
+                self._current_line = ''
+                if self._message_type == MessageType.EOF:
+                    return False
+                raise EOFError('File reached EOF')
+            messages, self._error = chunk
+            self._messages = iter(messages)
+            message = next(self._messages, None)
+
+        record_type, timestamp, self._current_line = message
+        self._process_message(RECORD_MESSAGE_TYPES[record_type], timestamp, self._current_line)
+        return True
+
+
+def open_parallel_reader(path: str, workers: int = None) -> FileLineReader:
+    # Same as open_reader, a file of a single chunk or of a chunk too large for a worker to hold is read sequentially
+    tasks = _chunk_tasks(path)
+    if len(tasks) <= 1 or any(size > MAX_CHUNK_SIZE for task, size in tasks):
+        return open_reader(path)
+    return ParallelFileLineReader(path, workers, tasks=tasks)
+
+
+
+class _ListListener(protocols.Listener):
+    def __init__(self, reader: FileLineReader):
+        self._reader = reader
+        self.calls = []
+
+    def board_insert_batch(self, pair_name: str, type: protocols.TradeType, prices: list, sizes: list):
+        self.calls.append((self._reader.message_timestamp, pair_name, type, prices, sizes))
+
+    def board_clear(self, pair_name: str):
+        self.calls.append((self._reader.message_timestamp, pair_name))
+
+
+class TestParallel(unittest.TestCase):
+    def _read(self, reader: FileLineReader) -> list:
+        listener = _ListListener(reader)
+        try:
+            reader.setup(listener)
+            while reader.next_line():
+                pass
+        finally:
+            reader.file.close()
+        return listener.calls
+
+    def test_same_as_sequential(self):
+        lines = ['head,0,2019-05-01 00:00:00.000000,websocket,0,wss://ws.lightstream.bitflyer.com/json-rpc\n',
+                 'emit,2019-05-01 00:00:00.000000,{"method":"subscribe","params":{"channel":"lightning_board_BTC_JPY"},'
+                 '"id":1}\n',
+                 'msg,2019-05-01 00:00:00.000000,{"jsonrpc":"2.0","id":1,"result":true}\n']
+        for i in range(3000):
+            lines.append('msg,2019-05-01 00:%02d:%02d.%06d,{"jsonrpc":"2.0","method":"channelMessage","params":'
+                         '{"channel":"lightning_board_BTC_JPY","message":{"mid_price":%d,"bids":[{"price":%d,'
+                         '"size":0.1}],"asks":[]}}}\n' % (i // 600, i // 10 % 60, i % 10 + 1, i, i))
+        lines.append('eos,2019-05-01 00:05:00.000000,None\n')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines.gz')
+            with open(path, 'wb') as file:
+                for i in range(0, len(lines), 500):
+                    file.write(gzip.compress(''.join(lines[i:i + 500]).encode('utf-8')))
+            block_path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00' + compression.BLOCK_DUMP_EXTENSION)
+            convert_to_blocks(path, block_path, 'none')
+
+            expected = self._read(open_reader(path))
+            self.assertGreaterEqual(len(expected), 3000)
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                self.assertEqual(self._read(ParallelFileLineReader(path, executor=executor)), expected)
+                self.assertEqual(self._read(ParallelFileLineReader(block_path, executor=executor)), expected)
+
+                # File without its terminal raises EOFError after all of its messages
+                with open(path, 'wb') as file:
+                    file.write(gzip.compress(''.join(lines[:-1]).encode('utf-8')))
+                reader = ParallelFileLineReader(path, executor=executor)
+                with self.assertRaises(EOFError):
+                    self._read(reader)
+                self.assertEqual(reader.message_type, MessageType.MSG)
+
+            # A file of a single stream is read sequentially
+            self.assertNotIsInstance(open_parallel_reader(path, 2), ParallelFileLineReader)
+
+    def test_cut_character(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bitflyer.2019_05_01_00_00_00.json.lines')
+            data = ('head,0,2019-05-01 00:00:00.000000,websocket,0,wss://ws.lightstream.bitflyer.com/json-rpc\n'
+                    'msg,2019-05-01 00:00:00.000000,{"message":"\u3042"}\n'
+                    'msg,2019-05-01 00:00:01.000000,{"message":"\u3042"}\n').encode('utf-8')
+            with open(path, 'wb') as file:
+                # Cut after the first byte of a character of 3 bytes
+                file.write(data[:-4])
+            messages, error = _decode_text_chunk(path, 'none', 0, len(data) - 4)
+            self.assertIsNone(error)
+            self.assertEqual([message for record_type, timestamp, message in messages], ['{"message":"\u3042"}'])
@@ -1,17 +1,26 @@
 import logging
-import json
 import datetime
 import re
 from enum import Enum, unique
 
 from ..line_reader import InvalidFormatError, MessageType
+from .. import json_backend
 from . import websocket
 from .websocket import WSServiceProcessor, WebSocketProcessor
+from .protocols import TradeType, DataType, Ticker, Execution
 
 _logger = logging.getLogger('Bitflyer')
 
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+DATETIME_FORMAT_FALLBACK = '%Y-%m-%dT%H:%M:%S'
+# Side of a taker in an execution
+EXECUTION_SIDES = {'BUY': TradeType.BID, 'SELL': TradeType.ASK, '': None}
 CHANNEL_NAME_REGEX = re.compile(r'^(lightning_board_snapshot|lightning_board|lightning_ticker|lightning_executions)_(?P<product_code>\w+)$')
+# A channel message has its channel name near the head, before its (possibly large) body
+CHANNEL_KEY = '"channel":"'
+# Same key for a message given as UTF-8 bytes
+CHANNEL_KEY_BYTES = CHANNEL_KEY.encode('ascii')
+CHANNEL_SEARCH_LIMIT = 128
 
 @unique
 class ChannelType(Enum):
@@ -33,8 +42,27 @@ class ChannelType(Enum):
         else:
             raise InvalidFormatError('Unknown channel "%s"' % name)
 
+    def data_type(self) -> DataType:
+        if self == ChannelType.EXECUTIONS:
+            return DataType.EXECUTION
+        elif self == ChannelType.TICKER:
+            return DataType.TICKER
+        return DataType.BOARD
+
+
+def _parse_exec_date(exec_date: str) -> datetime.datetime:
+    # Like "2019-05-01T00:00:00.1234567Z", fraction has up to 7 digits or is omitted, it is cut to microseconds
+    time_str = exec_date.rstrip('Z')
+    if '.' not in time_str:
+        return datetime.datetime.strptime(time_str, DATETIME_FORMAT_FALLBACK)
+    second_str, fraction_str = time_str.split('.', 1)
+    return datetime.datetime.strptime('%s.%s' % (second_str, fraction_str[:6]), DATETIME_FORMAT)
+
 
 class WSSBitflyerProcessor(WSServiceProcessor):
+    # Messages are decoded by a JSON backend, which takes bytes as well
+    accepts_bytes = True
+
     def setup(self, wsp: WebSocketProcessor, url: str):
         super().setup(wsp, url)
         # id vs channel map with which subscribe message it emitted
@@ -44,6 +72,11 @@ class WSSBitflyerProcessor(WSServiceProcessor):
         self._subscribed_channels = []
         # Statuses for each channnel
         self._status = {}
+        # Subscribed channels the listener or a filter does not accept, their messages are not decoded
+        # Names are in str and in bytes, as a message is either of them
+        self._skipped_channels = set()
+        # Backend is taken at setup, json_backend.set_backend affects processors set up later
+        self._loads = json_backend.loads
 
     def process(self, msg_type: MessageType, msg: str):
         # If message type is EOS, messge is not in json format
@@ -53,8 +86,11 @@ class WSSBitflyerProcessor(WSServiceProcessor):
         elif msg_type == MessageType.ERR:
             return
 
+        if msg_type == MessageType.MSG and len(self._skipped_channels) > 0 and self._is_skipped(msg):
+            return
+
         # Otherwise, message should be in json format
-        res_obj = json.loads(msg)
+        res_obj = self._loads(msg)
 
         if msg_type == MessageType.EMIT:
             self._process_subscribe_emit(res_obj)
@@ -65,6 +101,26 @@ class WSSBitflyerProcessor(WSServiceProcessor):
             else:
                 self._process_subscribe_response(res_obj)
 
+    def process_control(self, msg_type: MessageType, msg: str):
+        # Out of a time window, channel messages are data and dropped, subscriptions and EOS are processed
+        key = CHANNEL_KEY if isinstance(msg, str) else CHANNEL_KEY_BYTES
+        if msg_type == MessageType.MSG and msg.find(key, 0, CHANNEL_SEARCH_LIMIT) >= 0:
+            return
+        self.process(msg_type, msg)
+
+    def _is_skipped(self, msg: str) -> bool:
+        # Only looks for a channel name, a message is decoded (and validated) unless it names a skipped channel
+        if isinstance(msg, str):
+            key, quote = CHANNEL_KEY, '"'
+        else:
+            key, quote = CHANNEL_KEY_BYTES, b'"'
+        start = msg.find(key, 0, CHANNEL_SEARCH_LIMIT)
+        if start < 0:
+            return False
+        start += len(key)
+        end = msg.find(quote, start)
+        return msg[start:end] in self._skipped_channels
+
     def _process_subscribe_emit(self, res_obj: object):
         # Must be subscribe message
         # Check if it is
@@ -114,13 +170,18 @@ class WSSBitflyerProcessor(WSServiceProcessor):
 
         # Fire an event
         ch_type = ChannelType.from_channel_name(subject_channel)
-        if ch_type == ChannelType.BOARD or ch_type == ChannelType.BOARD_SNAPSHOT:
+        match_object = CHANNEL_NAME_REGEX.match(subject_channel)
+        product_code = match_object.group('product_code') if match_object is not None else None
+        if not self._wsp.stream_filter.accepts_channel(subject_channel, product_code, ch_type.data_type()) or\
+                not self._wsp.listener.accepts(subject_channel, ch_type.data_type()):
+            self._skipped_channels.add(subject_channel)
+            self._skipped_channels.add(subject_channel.encode('utf-8'))
+        elif ch_type == ChannelType.BOARD or ch_type == ChannelType.BOARD_SNAPSHOT:
             self._wsp.listener.board_start(subject_channel)
         elif ch_type == ChannelType.TICKER:
             self._wsp.listener.ticker_start(subject_channel)
         else:
-            #TODO
-            pass
+            self._wsp.listener.execution_start(subject_channel)
 
         _logger.debug('Successfully subscribed to channel %s' % subject_channel)
 
@@ -157,6 +218,8 @@ class WSSBitflyerProcessor(WSServiceProcessor):
             raise InvalidFormatError('"message" attribute did not found')
 
         message = params['message']
+        if channel in self._skipped_channels:
+            return
 
         ch_type = ChannelType.from_channel_name(channel)
         if ch_type == ChannelType.BOARD or ch_type == ChannelType.BOARD_SNAPSHOT:
@@ -165,7 +228,7 @@ class WSSBitflyerProcessor(WSServiceProcessor):
         elif ch_type == ChannelType.TICKER:
             self._process_ticker_response(channel, message)
         elif ch_type == ChannelType.EXECUTIONS:
-            self._process_execution_response(message)
+            self._process_execution_response(channel, message)
         else:
             raise InvalidFormatError('Response of unknown channel "%s"' % channel)
 
@@ -180,19 +243,14 @@ class WSSBitflyerProcessor(WSServiceProcessor):
         asks = msg['asks']
         bids = msg['bids']
 
-        for ask in asks:
-            if 'price' not in ask:
-                raise InvalidFormatError('"price" attribute did not found')
-            if 'size' not in ask:
-                raise InvalidFormatError('"size" attribute did not found')
-            self._wsp.listener.board_insert(channel_name, 'ask', dict(price=ask['price'], size=ask['size']) )
-
-        for bid in bids:
-            if 'price' not in bid:
-                raise InvalidFormatError('"price" attribute did not found')
-            if 'size' not in bid:
-                raise InvalidFormatError('"size" attribute did not found')
-            self._wsp.listener.board_insert(channel_name, 'bid', dict(price=bid['price'], size=bid['size']) )
+        # Each side is passed as one batch
+        for trade_type, levels in ((TradeType.ASK, asks), (TradeType.BID, bids)):
+            try:
+                prices = [level['price'] for level in levels]
+                sizes = [level['size'] for level in levels]
+            except KeyError as e:
+                raise InvalidFormatError('"%s" attribute did not found' % e.args[0])
+            self._wsp.listener.board_insert_batch(channel_name, trade_type, prices, sizes)
 
     def _process_ticker_response(self, channel_name: str, msg: object):
         if 'product_code' not in msg:
@@ -201,22 +259,39 @@ class WSSBitflyerProcessor(WSServiceProcessor):
         ts = datetime.datetime.strptime(msg['timestamp'][:-2], DATETIME_FORMAT)
         
         self._wsp.listener.ticker_insert(channel_name,
-            dict(
-                timestamp=ts,
-                best_bid=msg['best_bid'],
-                best_ask=msg['best_ask'],
-                best_bid_size=msg['best_bid_size'],
-                best_ask_size=msg['best_ask_size'],
-                total_bid_depth=msg['total_bid_depth'],
-                total_ask_depth=msg['total_ask_depth'],
-                last_traded_price=msg['ltp'],
-                volume=msg['volume'],
-                volume_by_product=msg['volume_by_product'],
+            Ticker(
+                ts,
+                msg['best_bid'],
+                msg['best_ask'],
+                msg['best_bid_size'],
+                msg['best_ask_size'],
+                msg['total_bid_depth'],
+                msg['total_ask_depth'],
+                msg['ltp'],
+                msg['volume'],
+                msg['volume_by_product'],
             )
         )
 
-    def _process_execution_response(self, msg: object):
-        self._wsp.listener.trade_insert()
+    def _process_execution_response(self, channel_name: str, msg: object):
+        # A message is a list of executions
+        if not isinstance(msg, list):
+            raise InvalidFormatError('Executions must be a list')
+        executions = []
+        for execution in msg:
+            for key in ('id', 'side', 'price', 'size', 'exec_date'):
+                if key not in execution:
+                    raise InvalidFormatError('"%s" attribute did not found' % key)
+            if execution['side'] not in EXECUTION_SIDES:
+                raise InvalidFormatError('Unknown side "%s"' % execution['side'])
+            executions.append(Execution(
+                execution['id'],
+                EXECUTION_SIDES[execution['side']],
+                execution['price'],
+                execution['size'],
+                _parse_exec_date(execution['exec_date']),
+            ))
+        self._wsp.listener.execution_insert_batch(channel_name, executions)
 
 
 
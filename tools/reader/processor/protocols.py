@@ -12,36 +12,145 @@ class TradeType(Enum):
     BID = 0
     ASK = 1
 
+class DataType(Enum):
+    BOARD = 0
+    TICKER = 1
+    EXECUTION = 2
+
+
+
+# Records passed to a listener, slotted so that a snapshot of thousands of levels does not make thousands of dicts
+
+class BoardLevel():
+    __slots__ = ('price', 'size')
+
+    def __init__(self, price: float, size: float):
+        self.price = price
+        self.size = size
+
+class Ticker():
+    # Same order as database.DEF_TICKER_TABLE
+    FIELDS = ('timestamp', 'best_bid', 'best_ask', 'best_bid_size', 'best_ask_size', 'total_bid_depth',
+              'total_ask_depth', 'last_traded_price', 'volume', 'volume_by_product')
+    __slots__ = FIELDS
+
+    def __init__(self, timestamp: datetime.datetime, best_bid: float, best_ask: float, best_bid_size: float,
+                 best_ask_size: float, total_bid_depth: float, total_ask_depth: float, last_traded_price: float,
+                 volume: float, volume_by_product: float):
+        self.timestamp = timestamp
+        self.best_bid = best_bid
+        self.best_ask = best_ask
+        self.best_bid_size = best_bid_size
+        self.best_ask_size = best_ask_size
+        self.total_bid_depth = total_bid_depth
+        self.total_ask_depth = total_ask_depth
+        self.last_traded_price = last_traded_price
+        self.volume = volume
+        self.volume_by_product = volume_by_product
+
+    def astuple(self) -> tuple:
+        return (self.timestamp, self.best_bid, self.best_ask, self.best_bid_size, self.best_ask_size,
+                self.total_bid_depth, self.total_ask_depth, self.last_traded_price, self.volume, self.volume_by_product)
+
+class Execution():
+    # Side is a side of a taker, BID if it bought, ASK if it sold, None if unknown (e.g. itayose)
+    __slots__ = ('id', 'side', 'price', 'size', 'exec_date')
+
+    def __init__(self, id: int, side: TradeType, price: float, size: float, exec_date: datetime.datetime):
+        self.id = id
+        self.side = side
+        self.price = price
+        self.size = size
+        self.exec_date = exec_date
+
+
+
 class Listener():
+    def accepts(self, pair_name: str, data_type: DataType) -> bool:
+        # Messages of a channel not accepted are skipped without being decoded, nor its *_start is called
+        return True
+
     def board_start(self, pair_name: str):
         pass
 
-    def board_insert(self, pair_name: str, type: TradeType, data: dict):
+    def board_insert(self, pair_name: str, type: TradeType, level: BoardLevel):
         pass
 
+    def board_insert_batch(self, pair_name: str, type: TradeType, prices: list, sizes: list):
+        # All levels of one side in a message at once, a listener taking levels one by one gets board_insert calls
+        board_insert = self.board_insert
+        for price, size in zip(prices, sizes):
+            board_insert(pair_name, type, BoardLevel(price, size))
+
     def board_clear(self, pair_name: str):
         pass
 
     def ticker_start(self, pair_name: str):
         pass
 
-    def ticker_insert(self, pair_name: str, data: dict):
+    def ticker_insert(self, pair_name: str, ticker: Ticker):
         pass
 
+    def execution_start(self, pair_name: str):
+        pass
+
+    def execution_insert(self, pair_name: str, execution: Execution):
+        pass
+
+    def execution_insert_batch(self, pair_name: str, executions: list):
+        # All executions in a message at once
+        execution_insert = self.execution_insert
+        for execution in executions:
+            execution_insert(pair_name, execution)
+
     def eos(self):
         pass
 
 
 
+class StreamFilter():
+    # Data a reader passes to a listener, a field of None does not restrict anything
+    # Times are microseconds from epoch, data messages at [begin, end) are processed
+    def __init__(self, channels: set = None, product_codes: set = None, data_types: set = None,
+                 begin: int = None, end: int = None):
+        self.channels = set(channels) if channels is not None else None
+        self.product_codes = set(product_codes) if product_codes is not None else None
+        self.data_types = set(data_types) if data_types is not None else None
+        self.begin = begin
+        self.end = end
+
+    def accepts_channel(self, channel_name: str, product_code: str, data_type: DataType) -> bool:
+        return (self.channels is None or channel_name in self.channels) and\
+            (self.product_codes is None or product_code in self.product_codes) and\
+            (self.data_types is None or data_type in self.data_types)
+
+    @property
+    def has_window(self) -> bool:
+        return self.begin is not None or self.end is not None
+
+
+
 class ProtocolProcessor():
-    def setup(self, protocol_head: str, ref_time: datetime.datetime, listener: Listener):
+    # Whether process and process_control take a message as UTF-8 bytes as well as str
+    # A reader over bytes (e.g. a memory-mapped file) then leaves decoding to a processor, which skips messages it
+    # does not need without decoding them
+    accepts_bytes = False
+
+    def setup(self, protocol_head: str, ref_time: datetime.datetime, listener: Listener,
+              stream_filter: StreamFilter = None):
         self._protocol_head = protocol_head
         self._ref_time = ref_time
         self._listener = listener
+        self._stream_filter = stream_filter if stream_filter is not None else StreamFilter()
 
     def process(self, line: str):
         pass
 
+    def process_control(self, msg_type, line: str):
+        # Line out of the time window of a filter, only messages changing a state of a stream (e.g. subscriptions)
+        # have to be processed, data messages can be dropped
+        self.process(msg_type, line)
+
     @property
     def protocol_head(self) -> str:
         return self._protocol_head
@@ -54,6 +163,10 @@ class ProtocolProcessor():
     def listener(self) -> Listener:
         return self._listener
 
+    @property
+    def stream_filter(self) -> StreamFilter:
+        return self._stream_filter
+
 
 
 # Map of protocol processor for its name and version
@@ -2,7 +2,7 @@ import re
 import datetime
 
 from . import protocols 
-from .protocols import ProtocolProcessor, RegistryError, Listener
+from .protocols import ProtocolProcessor, RegistryError, Listener, StreamFilter
 from ..line_reader import InvalidFormatError, Head, MessageType
 
 
@@ -13,8 +13,9 @@ URL_REGEX = re.compile(r'^(http|https|ws|wss)://.+\.(?P<host>.+?\..+?)/.*$')
 
 
 class WebSocketProcessor(ProtocolProcessor):
-    def setup(self, protocol_head: str, ref_time: datetime.datetime, listener: Listener):
-        super().setup(protocol_head, ref_time, listener)
+    def setup(self, protocol_head: str, ref_time: datetime.datetime, listener: Listener,
+              stream_filter: StreamFilter = None):
+        super().setup(protocol_head, ref_time, listener, stream_filter)
 
         # Retrive parameters from head
         match_obj = HEAD_REGEX.match(protocol_head)
@@ -33,10 +34,19 @@ class WebSocketProcessor(ProtocolProcessor):
     def process(self, msg_type: MessageType, line: str):
         self._service_processor.process(msg_type, line)
 
+    def process_control(self, msg_type: MessageType, line: str):
+        self._service_processor.process_control(msg_type, line)
+
+    @property
+    def accepts_bytes(self) -> bool:
+        return self._service_processor.accepts_bytes
+
 
 
 
 class WSServiceProcessor:
+    accepts_bytes = False
+
     def setup(self, wsp: WebSocketProcessor, url: str):
         self._wsp = wsp
         self._url = url
@@ -44,6 +54,9 @@ class WSServiceProcessor:
     def process(self, msg_type: MessageType, msg: str):
         pass
 
+    def process_control(self, msg_type: MessageType, msg: str):
+        self.process(msg_type, msg)
+
     @property
     def url(self):
         return self._url
@@ -1,4 +1,6 @@
 from enum import Enum
+from bisect import bisect_left, bisect_right, insort
+import random
 import datetime
 import unittest
 
@@ -8,13 +10,36 @@ class OrderType(Enum):
     BUY = 0
     SELL = 1
 
+# Values of database.BoardRecordType, Board.apply takes records in these types
+RECORD_CLEAR_ALL = 0
+RECORD_CLEAR_SELLS = 1
+RECORD_CLEAR_BUYS = 2
+RECORD_INSERT_SELL = 3
+RECORD_INSERT_BUY = 4
+RECORD_SET_SELL = 5
+RECORD_SET_BUY = 6
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _to_timestamp(abs_time):
+    """Convert datetime (naive, in UTC) or int to microseconds from epoch."""
+    if isinstance(abs_time, datetime.datetime):
+        return (abs_time - _EPOCH) // datetime.timedelta(microseconds=1)
+    elif isinstance(abs_time, int):
+        return abs_time
+    else:
+        raise TypeError('"int" or "datetime.datetime" type is supported as a time.')
+
 class OrderMap(object):
     """Price vs Amount map.\n
     Type of price can be any, and it can be retrived from getter price_type.\n
+    Prices are kept sorted, so the lowest and the highest price can be taken in O(1).\n
     Immutable.
     """
-    def __init__(self, price_type: type):
-        self._orders = dict()
+    def __init__(self, price_type: type, orders: dict = None, prices: list = None):
+        # orders and prices are shared with Board which made this map, Board never modifies them afterwards
+        self._orders = orders if orders is not None else dict()
+        self._prices = prices if prices is not None else sorted(self._orders)
         self._price_type = price_type
 
     @property
@@ -35,22 +60,222 @@ class OrderMap(object):
         cmp_func = getattr(key, '__le__', None)
         if cmp_func is not None and callable(cmp_func) and key <= 0:
             raise KeyError('key must be an positive number')
-        
+
         if key not in self._orders:
             return 0
         else:
             return self._orders[key]
 
+    def __len__(self):
+        """Return number of price levels."""
+        return len(self._prices)
+
+    def __iter__(self):
+        """Iterate prices from the lowest to the highest."""
+        return iter(self._prices)
+
+    def __contains__(self, price):
+        return price in self._orders
+
+    def items(self):
+        """Iterate (price, amount) from the lowest price to the highest."""
+        orders = self._orders
+        for price in self._prices:
+            yield price, orders[price]
+
+    def lowest(self):
+        """Return (price, amount) of the lowest price, or None if empty."""
+        if len(self._prices) == 0:
+            return None
+        price = self._prices[0]
+        return price, self._orders[price]
+
+    def highest(self):
+        """Return (price, amount) of the highest price, or None if empty."""
+        if len(self._prices) == 0:
+            return None
+        price = self._prices[-1]
+        return price, self._orders[price]
+
+class _SortedPrices(object):
+    """Sorted prices kept in chunks of at most 2 * LOAD prices, and the highest price of each chunk.\n
+    Adding or removing a price bisects the chunks and moves prices of one chunk only, instead of every price after it
+    in a single list (e.g. all sells behind the best ask), so it stays O(log n) for a deep board
+    (a chunk rarely splits or joins, moving a list of chunks of n / LOAD).\n
+    Indexed and iterated as a sorted list is."""
+    __slots__ = ('_lists', '_maxes', '_len')
+    LOAD = 512
+
+    def __init__(self, prices: list = ()):
+        # prices must be sorted
+        prices = list(prices)
+        self._lists = [prices[i:i + self.LOAD] for i in range(0, len(prices), self.LOAD)]
+        self._maxes = [chunk[-1] for chunk in self._lists]
+        self._len = len(prices)
+
+    def copy(self):
+        copied = _SortedPrices()
+        copied._lists = [list(chunk) for chunk in self._lists]
+        copied._maxes = list(self._maxes)
+        copied._len = self._len
+        return copied
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._lists:
+            yield from chunk
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('index out of range')
+        # The lowest and the highest, which boards ask for, are taken directly
+        if index == 0:
+            return self._lists[0][0]
+        if index == self._len - 1:
+            return self._lists[-1][-1]
+        for chunk in self._lists:
+            if index < len(chunk):
+                return chunk[index]
+            index -= len(chunk)
+
+    def add(self, price):
+        lists = self._lists
+        maxes = self._maxes
+        self._len += 1
+        if len(maxes) == 0:
+            lists.append([price])
+            maxes.append(price)
+            return
+        i = bisect_left(maxes, price)
+        if i == len(maxes):
+            i -= 1
+            lists[i].append(price)
+            maxes[i] = price
+        else:
+            insort(lists[i], price)
+        if len(lists[i]) > 2 * self.LOAD:
+            self._split(i)
+
+    def _split(self, i: int):
+        chunk = self._lists[i]
+        self._lists.insert(i + 1, chunk[self.LOAD:])
+        del chunk[self.LOAD:]
+        self._maxes.insert(i + 1, self._maxes[i])
+        self._maxes[i] = chunk[-1]
+
+    def remove(self, price):
+        # price must be in prices
+        lists = self._lists
+        maxes = self._maxes
+        i = bisect_left(maxes, price)
+        chunk = lists[i]
+        del chunk[bisect_left(chunk, price)]
+        self._len -= 1
+        if len(chunk) == 0:
+            del lists[i]
+            del maxes[i]
+            return
+        maxes[i] = chunk[-1]
+        if len(chunk) < self.LOAD // 2 and len(lists) > 1:
+            # Join a small chunk into its neighbour, splitting it again if it gets too large
+            if i == len(lists) - 1:
+                i -= 1
+            lists[i].extend(lists[i + 1])
+            del lists[i + 1]
+            del maxes[i]
+            if len(lists[i]) > 2 * self.LOAD:
+                self._split(i)
+
+class _Side(object):
+    """Mutable orders of one side of a board: price vs amount dict and its sorted prices.\n
+    Containers are copied on the first write after a snapshot shared them."""
+    __slots__ = ('orders', 'prices', 'shared')
+
+    def __init__(self):
+        self.orders = dict()
+        self.prices = _SortedPrices()
+        self.shared = False
+
+    def _own(self):
+        if self.shared:
+            self.orders = dict(self.orders)
+            self.prices = self.prices.copy()
+            self.shared = False
+
+    def clear(self):
+        # New containers, shared ones are left for snapshots as they are
+        self.orders = dict()
+        self.prices = _SortedPrices()
+        self.shared = False
+
+    def insert(self, price, amount):
+        if self.shared:
+            self._own()
+        orders = self.orders
+        current = orders.get(price)
+        if current is None:
+            if amount > 0:
+                orders[price] = amount
+                self.prices.add(price)
+            return
+        amount += current
+        if amount > 0:
+            orders[price] = amount
+        else:
+            del orders[price]
+            self.prices.remove(price)
+
+    def set(self, price, amount):
+        if self.shared:
+            self._own()
+        orders = self.orders
+        if price in orders:
+            if amount > 0:
+                orders[price] = amount
+            else:
+                del orders[price]
+                self.prices.remove(price)
+        elif amount > 0:
+            orders[price] = amount
+            self.prices.add(price)
+
+    def share(self, price_type):
+        self.shared = True
+        return OrderMap(price_type, self.orders, self.prices)
+
 class Board(object):
     """Represents board state with time.\n
     Board state is, which is a combination of sell orders and buy orders.
-    Board state can not be accessed externally before taking a snapshot of one.
+    Board state can not be accessed externally before taking a snapshot of one,
+    except for the best orders.\n
+    Changes are given by calling clear/insert/set/apply directly, or read from a \"source\" when time is set.
+    A source is an object with a function records(after) which returns an iterator of records
+    (position, timestamp, record type, price, amount) in time order, starting from the next of position \"after\",
+    or from the beginning if after is None. Timestamps are in microseconds.\n
+    If \"checkpoints\" (checkpoints.CheckpointStore) is given with a \"name\" of the board in it,
+    set_time starts from the nearest checkpoint before the time instead of replaying a source from the beginning.
     """
 
-    def __init__(self, price_type):
-        self._sells = dict()
-        self._buys = dict()
+    def __init__(self, price_type, source=None, checkpoints=None, name: str = None):
+        self._sells = _Side()
+        self._buys = _Side()
         self._price_type = price_type
+        self._source = source
+        # Iterator of records from a source, and a record taken from it but not yet applied
+        self._records = None
+        self._next_record = None
+        # Time of current state, and position of a record lastly applied
+        self._time = None
+        self._position = None
+        # Checkpoints and their times and positions, in time order
+        self._checkpoints = checkpoints
+        self._name = name
+        self._checkpoint_points = checkpoints.points(name) if checkpoints is not None else []
+        self._checkpoint_times = [point[0] for point in self._checkpoint_points]
 
     @property
     def price_type(self):
@@ -59,35 +284,167 @@ class Board(object):
         """
         return self._price_type
 
+    @property
+    def time(self):
+        """Return time of current state in microseconds, None if time has never been set."""
+        return self._time
+
+    @property
+    def position(self):
+        """Return position of a record from a source which is lastly applied, None if none is applied."""
+        return self._position
+
+    def clear(self, order_type: OrderType = None):
+        """Remove all orders of given type, or both types if None."""
+        if order_type is None or order_type == OrderType.SELL:
+            self._sells.clear()
+        if order_type is None or order_type == OrderType.BUY:
+            self._buys.clear()
+
+    def insert(self, order_type: OrderType, price, amount):
+        """Add amount to orders at price. Price level is removed if amount of it becomes 0 or less."""
+        if order_type == OrderType.SELL:
+            self._sells.insert(price, amount)
+        else:
+            self._buys.insert(price, amount)
+
+    def set(self, order_type: OrderType, price, amount):
+        """Set amount of orders at price. Price level is removed if amount is 0 or less."""
+        if order_type == OrderType.SELL:
+            self._sells.set(price, amount)
+        else:
+            self._buys.set(price, amount)
+
+    def apply(self, record_type: int, price, amount):
+        """Apply a record in database.BoardRecordType (its value or itself)."""
+        record_type = getattr(record_type, 'value', record_type)
+        if record_type == RECORD_INSERT_SELL:
+            self._sells.insert(price, amount)
+        elif record_type == RECORD_INSERT_BUY:
+            self._buys.insert(price, amount)
+        elif record_type == RECORD_SET_SELL:
+            self._sells.set(price, amount)
+        elif record_type == RECORD_SET_BUY:
+            self._buys.set(price, amount)
+        elif record_type == RECORD_CLEAR_ALL:
+            self._sells.clear()
+            self._buys.clear()
+        elif record_type == RECORD_CLEAR_SELLS:
+            self._sells.clear()
+        elif record_type == RECORD_CLEAR_BUYS:
+            self._buys.clear()
+        else:
+            raise ValueError('Unknown record type: %s' % record_type)
+
+    @property
+    def best_bid(self):
+        """Return (price, amount) of the highest buy order, or None if there is no buy order."""
+        # Chunks are read directly, this is asked at every step of a replay
+        chunks = self._buys.prices._lists
+        if len(chunks) == 0:
+            return None
+        price = chunks[-1][-1]
+        return price, self._buys.orders[price]
+
+    @property
+    def best_ask(self):
+        """Return (price, amount) of the lowest sell order, or None if there is no sell order."""
+        chunks = self._sells.prices._lists
+        if len(chunks) == 0:
+            return None
+        price = chunks[0][0]
+        return price, self._sells.orders[price]
+
+    def reset(self):
+        """Remove all orders and forget time, source will be read from the beginning."""
+        self.clear()
+        self._records = None
+        self._next_record = None
+        self._time = None
+        self._position = None
+
     def progress(self, time_delta):
         """Change board state as progressing/rewinding time by as much as given on a \"time_delta\" parameter.\n
         time_delta can be \"int\" as well as \"datetime.timedelta\".
-        If int value is given, time_delta nanosecond time progresses/rewinds.
+        If int value is given, time_delta microsecond time progresses/rewinds.
         If datetime.timedelta value is given, time as much as timedelta represents progresses/rewinds.\n
         More detail about progressing/rewinding time is explained at set_time function.
         """
         if isinstance(time_delta, datetime.timedelta):
             # Type of time_delta is datetime.timedelta
-            pass
+            time_delta = time_delta // datetime.timedelta(microseconds=1)
         elif isinstance(time_delta, int):
             # Or int
             pass
         else:
             # Otherwise, it is not supported
             raise TypeError('"int" or "datetime.timedelta" type is supported as a "time_delta" parameter.')
+        if self._time is None:
+            raise ValueError('Time is not set yet')
+        self.set_time(self._time + time_delta)
 
-    def set_time(self, abs_time :datetime.datetime):
+    def set_time(self, abs_time):
         """Change board state as setting absolute time to what is given on a \"abs_time\" parameter.\n
+        abs_time can be \"datetime.datetime\" (in UTC) as well as \"int\" in microseconds from epoch.
         After calling this function, board state will be set as if it is exactly at abs_time and passed it,
-        but before abs_time + (1 nanosecond).\n
+        but before abs_time + (1 microsecond).\n
         ex. set_time(datetime.datetime(2019, 2, 7, 10, 43, 30, 567890)) will set this board state to
         exactly when at 2 Feb 2019 10:43:30.567890 but before 10:43:30.567891 .
-        This means changes having timestamp of 10:43:30.567890 will be applied to the state, but not at 567891.
+        This means changes having timestamp of 10:43:30.567890 will be applied to the state, but not at 567891.\n
+        Rewinding time replays a source from the beginning.
         """
-        pass
+        if self._source is None:
+            raise ValueError('Board has no source to read changes from')
+        timestamp = _to_timestamp(abs_time)
+        rewind = self._time is not None and timestamp < self._time
+
+        # Jump to the nearest checkpoint if it is ahead of current state, or if rewinding
+        index = bisect_right(self._checkpoint_times, timestamp) - 1
+        if index >= 0:
+            checkpoint_time, checkpoint_position = self._checkpoint_points[index]
+            if rewind or self._position is None or checkpoint_position > self._position:
+                self._load_checkpoint(checkpoint_time, checkpoint_position)
+                rewind = False
+
+        if rewind:
+            # Changes can not be undone, start over
+            self.reset()
+
+        if self._records is None:
+            self._records = iter(self._source.records(self._position))
+
+        record = self._next_record
+        self._next_record = None
+        apply = self.apply
+        while True:
+            if record is None:
+                record = next(self._records, None)
+                if record is None:
+                    break
+            position, record_time, record_type, price, amount = record
+            if record_time > timestamp:
+                # Keep it for the next time
+                self._next_record = record
+                break
+            apply(record_type, price, amount)
+            self._position = position
+            record = None
+
+        self._time = timestamp
+
+    def _load_checkpoint(self, time: int, position: int):
+        checkpoint = self._checkpoints.load(self._name, self._price_type, time, position)
+        for side, orders in ((self._sells, checkpoint.state.sells), (self._buys, checkpoint.state.buys)):
+            side.orders = orders._orders
+            side.prices = _SortedPrices(orders._prices)
+            side.shared = False
+        self._records = None
+        self._next_record = None
+        self._time = checkpoint.time
+        self._position = checkpoint.position
 
     def tick(self):
-        """Change board state as progress time by a time unit, which is 1 nanosecond."""
+        """Change board state as progress time by a time unit, which is 1 microsecond."""
         self.progress(1)
 
     def take_snapshot(self):
@@ -95,32 +452,53 @@ class Board(object):
         Both sell/buy orders that this instance of board has
         will be copied in newly created BoardState instance.
         The instance won't be changed after the creation
-        even if a state of board which snapshot taken from changes."""
-        pass
+        even if a state of board which snapshot taken from changes.\n
+        Orders are copied lazily, taking a snapshot costs O(1) and the board copies its orders
+        when it is changed for the first time after the snapshot."""
+        return BoardState(self._price_type, self._sells.share(self._price_type),
+                          self._buys.share(self._price_type), self._time)
 
     def __add__(self, delta):
         """Perform self + \"delta\". An result is a new BoardState instance,
         which represents this board state but delta applied to it."""
-        pass
+        return self.take_snapshot() + delta
 
     def __sub__(self, subtrahend):
         """Perform self - \"subtrahend\". An result is a new BoardState instance,
         which represents delta(change) of board state from subtrahend."""
-        pass
+        if isinstance(subtrahend, Board):
+            subtrahend = subtrahend.take_snapshot()
+        return self.take_snapshot() - subtrahend
 
 
+def _add_orders(a: OrderMap, b: OrderMap, sign: int, keep_negative: bool):
+    orders = dict(a._orders)
+    for price, amount in b._orders.items():
+        amount = orders.get(price, 0) + sign * amount
+        if amount > 0 or (keep_negative and amount != 0):
+            orders[price] = amount
+        else:
+            orders.pop(price, None)
+    return OrderMap(a.price_type, orders)
+
 class BoardState(object):
     """Snapshot of an board state. Immutable."""
-    def __init__(self, price_type: type):
+    def __init__(self, price_type: type, sells: OrderMap = None, buys: OrderMap = None, time: int = None):
         self._price_type = price_type
-        self._sells = OrderMap(price_type)
-        self._buys = OrderMap(price_type)
+        self._sells = sells if sells is not None else OrderMap(price_type)
+        self._buys = buys if buys is not None else OrderMap(price_type)
+        self._time = time
 
     @property
     def price_type(self):
         """See #Board.price_type."""
         return self._price_type
 
+    @property
+    def time(self):
+        """Return time of this state in microseconds, None if unknown."""
+        return self._time
+
     @property
     def sells(self):
         """Return sell order price vs amount map."""
@@ -131,6 +509,16 @@ class BoardState(object):
         """Return buy order price vs amount map."""
         return self._buys
 
+    @property
+    def best_bid(self):
+        """See #Board.best_bid."""
+        return self._buys.highest()
+
+    @property
+    def best_ask(self):
+        """See #Board.best_ask."""
+        return self._sells.lowest()
+
     def __getitem__(self, key):
         """Return order list of given OrderType"""
         if not isinstance(key, OrderType):
@@ -142,6 +530,36 @@ class BoardState(object):
         else:
             raise KeyError('Unknown key: %s' % key)
 
+    def __add__(self, delta):
+        """Perform self + \"delta\". Price levels whose amount becomes 0 or less are removed."""
+        if not isinstance(delta, BoardState):
+            return NotImplemented
+        return BoardState(self._price_type,
+                          _add_orders(self._sells, delta.sells, 1, False),
+                          _add_orders(self._buys, delta.buys, 1, False),
+                          self._time)
+
+    def __sub__(self, subtrahend):
+        """Perform self - \"subtrahend\". An result is a delta, which can have negative amounts."""
+        if not isinstance(subtrahend, BoardState):
+            return NotImplemented
+        return BoardState(self._price_type,
+                          _add_orders(self._sells, subtrahend.sells, -1, True),
+                          _add_orders(self._buys, subtrahend.buys, -1, True),
+                          self._time)
+
+
+class RecordListSource(object):
+    """Source of board records kept in a list of (timestamp, record type, price, amount).
+    Position of a record is its index."""
+    def __init__(self, records: list):
+        self._records = records
+
+    def records(self, after: int = None):
+        start = 0 if after is None else after + 1
+        for i in range(start, len(self._records)):
+            yield (i, ) + tuple(self._records[i])
+
 class TestStructures(unittest.TestCase):
     def test_board_snapshot(self):
         board = BoardState(int)
@@ -157,7 +575,7 @@ class TestStructures(unittest.TestCase):
         # board[OrderType.SELL/BUY] is an alternative to board.buys/board.sells for each
         self.assertEqual(board[OrderType.BUY], board.buys)
         self.assertEqual(board[OrderType.SELL], board.sells)
-    
+
     def test_order_list(self):
         ol = OrderMap(int)
 
@@ -169,7 +587,96 @@ class TestStructures(unittest.TestCase):
             ol[None]
         # Amount of inititialized order price must be reported as 0
         self.assertEqual(ol[1], 0)
-        
+
+    def test_board_orders(self):
+        board = Board(int)
+        board.insert(OrderType.BUY, 100, 1)
+        board.insert(OrderType.BUY, 99, 2)
+        board.insert(OrderType.BUY, 100, 1)
+        board.set(OrderType.SELL, 102, 3)
+        board.set(OrderType.SELL, 101, 1)
+        self.assertEqual(board.best_bid, (100, 2))
+        self.assertEqual(board.best_ask, (101, 1))
+
+        # Levels having no amount are removed
+        board.insert(OrderType.BUY, 100, -2)
+        board.set(OrderType.SELL, 101, 0)
+        self.assertEqual(board.best_bid, (99, 2))
+        self.assertEqual(board.best_ask, (102, 3))
+
+        board.clear(OrderType.SELL)
+        self.assertIsNone(board.best_ask)
+        board.apply(RECORD_CLEAR_ALL, None, None)
+        self.assertIsNone(board.best_bid)
+
+    def test_board_copy_on_write(self):
+        board = Board(int)
+        board.insert(OrderType.SELL, 101, 1)
+        snapshot = board.take_snapshot()
+        board.insert(OrderType.SELL, 101, 1)
+        board.insert(OrderType.SELL, 103, 1)
+        board.clear(OrderType.BUY)
+
+        # Snapshot must not change after it is taken
+        self.assertEqual(snapshot.sells[101], 1)
+        self.assertEqual(len(snapshot.sells), 1)
+        self.assertEqual(board.take_snapshot().sells[101], 2)
+        self.assertEqual(list(board.take_snapshot().sells.items()), [(101, 2), (103, 1)])
+
+        # Delta between states, and applying it
+        delta = board - snapshot
+        self.assertEqual(list(delta.sells.items()), [(101, 1), (103, 1)])
+        self.assertEqual(list((snapshot + delta).sells.items()), [(101, 2), (103, 1)])
+
+    def test_sorted_prices(self):
+        # Same as a sorted list through chunks splitting and joining
+        generator = random.Random(0)
+        prices = _SortedPrices()
+        expected = []
+        for i in range(20000):
+            price = generator.randint(0, 3000)
+            if price in expected:
+                prices.remove(price)
+                expected.remove(price)
+            else:
+                prices.add(price)
+                insort(expected, price)
+        self.assertEqual(list(prices), expected)
+        self.assertEqual(len(prices), len(expected))
+        self.assertEqual([prices[0], prices[-1], prices[len(expected) // 2]],
+                         [expected[0], expected[-1], expected[len(expected) // 2]])
+        self.assertEqual(list(_SortedPrices(expected).copy()), expected)
+        for price in list(expected):
+            prices.remove(price)
+        self.assertEqual(len(prices), 0)
+        with self.assertRaises(IndexError):
+            prices[0]
+
+    def test_board_set_time(self):
+        source = RecordListSource([
+            (10, RECORD_INSERT_BUY, 100, 1),
+            (10, RECORD_INSERT_SELL, 101, 1),
+            (20, RECORD_CLEAR_ALL, None, None),
+            (20, RECORD_INSERT_BUY, 99, 1),
+            (30, RECORD_SET_BUY, 99, 5),
+        ])
+        board = Board(int, source)
+
+        board.set_time(9)
+        self.assertIsNone(board.best_bid)
+        board.set_time(10)
+        self.assertEqual(board.best_bid, (100, 1))
+        board.progress(15)
+        self.assertEqual(board.best_bid, (99, 1))
+        self.assertIsNone(board.best_ask)
+        board.set_time(datetime.datetime(1970, 1, 1, microsecond=30))
+        self.assertEqual(board.best_bid, (99, 5))
+        self.assertEqual(board.position, 4)
+
+        # Rewinding replays from the beginning
+        board.set_time(10)
+        self.assertEqual(board.best_ask, (101, 1))
+
 
 if __name__ == '__main__':
     unittest.main()